@@ -0,0 +1,389 @@
+# ======================================================
+# SMART BOT – BACKTESTER
+# Replays local 1m OHLCV through the live strategy + exit rules
+# File: backtest.py
+# ======================================================
+#
+# python backtest.py --data data/ --strategy smart --symbols BTCUSDT,ETHUSDT
+#
+# Input: one CSV per symbol, <data>/<SYMBOL>_1.csv
+#   ts,open,high,low,close,volume   (ts in ms, oldest first, header optional)
+# or, with --store, the bot's memory-mapped kline store (KLINE_STORE_DIR)
+#
+# Entries come from the same rule functions the bot trades with
+# (trend_rules / signal_rules / mtf_rules) and every exit goes through
+# smart_bot.exit_rules, so SL / TP / trailing behave exactly as in
+# manage_trades, evaluated on each bar close. Symbols are simulated
+# independently with a fixed notional of CAPITAL * RISK_PER_TRADE;
+# the daily loss / profit kill switch and MAX_TRADES are not modelled.
+
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+import smart_bot as bot
+
+# ===============================
+# CONFIG
+# ===============================
+CAPITAL = 1000.0
+FEE = 0.00055      # taker fee per side
+SLIPPAGE = 0.0002  # 2 bps against us on every fill
+MINUTE = 60_000
+
+# ===============================
+# DATA
+# ===============================
+def load_csv(path):
+    """
+    Columns ts, open, high, low, close, volume as numpy arrays
+    """
+    with open(path) as f:
+        first = f.readline()
+    skip = 0 if first[:1].isdigit() else 1
+    raw = np.loadtxt(path, delimiter=",", skiprows=skip, ndmin=2)
+    return {
+        "ts": raw[:, 0].astype(np.int64),
+        "open": raw[:, 1],
+        "high": raw[:, 2],
+        "low": raw[:, 3],
+        "close": raw[:, 4],
+        "volume": raw[:, 5]
+    }
+
+def load_store(symbol, interval="1"):
+    """
+    Zero-copy arrays over the kline store's mapped columns
+    """
+    cols = bot.store_columns(symbol, interval)
+    return {
+        name: np.frombuffer(col, dtype=np.int64 if name == "ts" else np.float64)
+        for name, col in cols.items()
+    }
+
+def load_symbol(data_dir, symbol):
+    if data_dir is None:
+        return load_store(symbol)
+    return load_csv(os.path.join(data_dir, f"{symbol}_1.csv"))
+
+# ===============================
+# RESAMPLING
+# ===============================
+def tf_closes(ts, close, tf):
+    """
+    Closes of tf-minute buckets and, for every 1m bar, how many buckets
+    were already closed before the bar's own (still forming) bucket
+    """
+    size = int(tf) * MINUTE
+    bucket = ts // size
+    last = np.r_[bucket[1:] != bucket[:-1], True]
+    closed = close[last]
+    before = np.searchsorted(bucket[last], bucket, side="left")
+    return closed, before
+
+# ===============================
+# STRATEGY: smart (ai_trend, 1m)
+# ===============================
+def rolling_mean(x, n):
+    out = np.full(len(x), np.nan)
+    c = np.cumsum(np.r_[0.0, x])
+    out[n - 1:] = (c[n:] - c[:-n]) / n
+    return out
+
+def prepare_smart(bars):
+    c = bars["close"]
+    fast = rolling_mean(c, 5)
+    slow = rolling_mean(c, 20)
+
+    def decide(t):
+        if t < 19:
+            return None
+        return bot.trend_rules(fast[t], slow[t])
+    return decide
+
+# ===============================
+# STRATEGY: signal (get_signal, 15m)
+# ===============================
+def prepare_signal(bars, tf="15"):
+    closed, _ = tf_closes(bars["ts"], bars["close"], tf)
+
+    # run the live indicator engine over the closed tf candles
+    states = {
+        ("ema", 20): bot._new_state("ema", 20),
+        ("ema", 50): bot._new_state("ema", 50),
+        ("rsi", 14): bot._new_state("rsi", 14)
+    }
+    vals = np.full((len(closed), 3), np.nan)
+    for j, x in enumerate(closed.tolist()):
+        for i, ((name, period), st) in enumerate(states.items()):
+            bot._step(name, period, st, x)
+            if st["value"] is not None:
+                vals[j, i] = st["value"]
+
+    # a bucket is usable once its last minute has closed
+    size = int(tf) * MINUTE
+    ends = (np.unique(bars["ts"] // size) + 1) * size
+    done = np.searchsorted(ends, bars["ts"] + MINUTE, side="right")
+
+    def decide(t):
+        k = done[t] - 1
+        if k < 49:  # get_signal wants 50 candles
+            return None
+        ef, es, r = vals[k]
+        if np.isnan(es) or np.isnan(r):
+            return None
+        return bot.signal_rules(ef, es, r)
+    return decide
+
+# ===============================
+# STRATEGY: ai (ai_signal, multi TF)
+# ===============================
+def ema_weights(n, period):
+    """
+    Weights w with ema(window[-n:], period) == w @ window
+    """
+    k = 2 / (period + 1)
+    w = np.empty(n)
+    w[:period] = (1 - k) ** (n - period) / period
+    w[period:] = k * (1 - k) ** np.arange(n - period - 1, -1, -1)
+    return w
+
+def trend_scores(bars, tf):
+    """
+    ai_trend_score for every 1m bar on the tf series whose forming candle
+    closes at that bar; vectorized where the window is complete
+    """
+    c = bars["close"]
+    if tf == "1":
+        closed, before = c, np.arange(len(c))
+    else:
+        closed, before = tf_closes(bars["ts"], c, tf)
+
+    wf, ws = ema_weights(20, 10), ema_weights(50, 25)
+    cf = np.correlate(closed, wf[:-1], "valid")  # cf[m] = wf[:-1] @ closed[m:m+19]
+    cs = np.correlate(closed, ws[:-1], "valid")
+
+    scores = np.zeros(len(c))
+    full = before >= 49
+    k = before[full]
+    last = c[full]
+    ema_fast = cf[k - 19] + wf[-1] * last
+    ema_slow = cs[k - 49] + ws[-1] * last
+    slope = last - closed[k - 9]
+    momentum = (last - closed[k - 19]) / closed[k - 19]
+    scores[full] = (ema_fast - ema_slow) + slope + momentum * last
+
+    # short history: the window length differs, use the live function
+    for t in np.nonzero(~full)[0]:
+        b = before[t]
+        window = list(closed[max(0, b - 99):b]) + [c[t]]
+        scores[t] = bot.ai_trend_score(window)
+    return scores
+
+def prepare_ai(bars):
+    scores = np.column_stack([trend_scores(bars, tf) for tf in bot.AI_TIMEFRAMES])
+
+    def decide(t):
+        return bot.mtf_rules(scores[t].tolist())
+    return decide
+
+STRATEGIES = {
+    "smart": prepare_smart,
+    "signal": prepare_signal,
+    "ai": prepare_ai
+}
+
+# ===============================
+# EXIT EVENTS
+# ===============================
+def event_band(p):
+    """
+    Price band inside which exit_rules is a no-op for position p
+    (no SL / TP hit, no trailing start or move). Slightly narrowed so
+    float rounding can only cause a harmless extra check.
+    """
+    eps = 1e-12
+    if p.side == "BUY":
+        hi = p.tp
+        if not p.trail_active:
+            hi = min(hi, p.entry * (1 + bot.TRAIL_START))
+        else:
+            hi = min(hi, p.sl / (1 - bot.TRAIL_STEP))
+        return p.sl * (1 + eps), hi * (1 - eps)
+
+    lo = p.tp
+    if not p.trail_active:
+        lo = max(lo, p.entry * (1 - bot.TRAIL_START))
+    else:
+        lo = max(lo, p.sl / (1 + bot.TRAIL_STEP))
+    return lo * (1 + eps), p.sl * (1 - eps)
+
+def next_event(c, start, lo, hi, chunk=4096):
+    n = len(c)
+    while start < n:
+        seg = c[start:start + chunk]
+        hit = np.flatnonzero((seg <= lo) | (seg >= hi))
+        if len(hit):
+            return start + int(hit[0])
+        start += chunk
+    return n
+
+# ===============================
+# SIMULATION
+# ===============================
+def fill(price, side, opening):
+    # buying pays up, selling gives up, on both entry and exit
+    buy = (side == "BUY") == opening
+    return price * (1 + SLIPPAGE if buy else 1 - SLIPPAGE)
+
+def run_symbol(symbol, bars, strategy="smart"):
+    c = bars["close"]
+    ts = bars["ts"]
+    decide = STRATEGIES[strategy](bars)
+    trades = []
+    notional = CAPITAL * bot.RISK_PER_TRADE
+    n = len(c)
+    t = 0
+
+    while t < n:
+        side = decide(t)
+        if not side:
+            t += 1
+            continue
+
+        side = side.upper()
+        entry = fill(c[t], side, True)
+        p = bot.new_position(side, entry, notional / entry, symbol)
+        opened = t
+        t += 1
+
+        reason = None
+        while t < n:
+            lo, hi = event_band(p)
+            t = next_event(c, t, lo, hi)
+            if t >= n:
+                break
+            reason = bot.exit_rules(p, c[t])
+            if reason:
+                break
+            t += 1
+
+        if not reason:
+            reason = "END"
+            t = n - 1
+
+        exit_price = fill(c[t], side, False)
+        qty = p.qty
+        gross = (exit_price - entry) * qty if side == "BUY" else (entry - exit_price) * qty
+        fees = FEE * (entry + exit_price) * qty
+        trades.append({
+            "symbol": symbol,
+            "side": side,
+            "entry_ts": int(ts[opened]),
+            "exit_ts": int(ts[t]),
+            "entry": entry,
+            "exit": exit_price,
+            "qty": qty,
+            "pnl": gross - fees,
+            "reason": reason
+        })
+        t += 1
+
+    return trades
+
+def equity_curve(trades):
+    trades = sorted(trades, key=lambda x: x["exit_ts"])
+    eq = CAPITAL
+    curve = []
+    for tr in trades:
+        eq += tr["pnl"]
+        curve.append((tr["exit_ts"], eq))
+    return curve
+
+def max_drawdown(curve):
+    peak = CAPITAL
+    worst = 0.0
+    for _, eq in curve:
+        peak = max(peak, eq)
+        worst = max(worst, (peak - eq) / peak)
+    return worst
+
+def backtest(data_dir, symbols, strategy="smart"):
+    trades = []
+    bars_total = 0
+    started = time.perf_counter()
+
+    for sym in symbols:
+        bars = load_symbol(data_dir, sym)
+        bars_total += len(bars["close"])
+        trades += run_symbol(sym, bars, strategy)
+
+    elapsed = time.perf_counter() - started
+    curve = equity_curve(trades)
+    wins = sum(1 for tr in trades if tr["pnl"] > 0)
+
+    return {
+        "trades": trades,
+        "equity": curve,
+        "stats": {
+            "strategy": strategy,
+            "symbols": len(symbols),
+            "bars": bars_total,
+            "seconds": elapsed,
+            "bars_per_sec": bars_total / elapsed if elapsed else 0.0,
+            "trades": len(trades),
+            "win_rate": wins / len(trades) if trades else 0.0,
+            "pnl": sum(tr["pnl"] for tr in trades),
+            "max_drawdown": max_drawdown(curve)
+        }
+    }
+
+# ===============================
+# OUTPUT
+# ===============================
+def write_results(result, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+
+    with open(os.path.join(out_dir, "trades.csv"), "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=[
+            "symbol", "side", "entry_ts", "exit_ts",
+            "entry", "exit", "qty", "pnl", "reason"
+        ])
+        w.writeheader()
+        w.writerows(result["trades"])
+
+    with open(os.path.join(out_dir, "equity.csv"), "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["ts", "equity"])
+        w.writerows(result["equity"])
+
+    with open(os.path.join(out_dir, "stats.json"), "w") as f:
+        json.dump(result["stats"], f, indent=2)
+
+def main():
+    global FEE, SLIPPAGE, CAPITAL
+
+    ap = argparse.ArgumentParser(description="Backtest smart_bot strategies on local klines")
+    ap.add_argument("--data", default="data")
+    ap.add_argument("--store", action="store_true", help="read from the kline store instead of CSV")
+    ap.add_argument("--symbols", default=",".join(bot.BASE_SYMBOLS))
+    ap.add_argument("--strategy", choices=sorted(STRATEGIES), default="smart")
+    ap.add_argument("--fee", type=float, default=FEE)
+    ap.add_argument("--slippage", type=float, default=SLIPPAGE)
+    ap.add_argument("--capital", type=float, default=CAPITAL)
+    ap.add_argument("--out", default="backtest_out")
+    args = ap.parse_args()
+
+    FEE, SLIPPAGE, CAPITAL = args.fee, args.slippage, args.capital
+
+    data = None if args.store else args.data
+    result = backtest(data, args.symbols.split(","), args.strategy)
+    write_results(result, args.out)
+    print(json.dumps(result["stats"], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+# ======================================================
+# SMART BOT – BENCHMARKS
+# Indicators, scan loop and order path against a local fake exchange
+# File: bench.py
+# ======================================================
+#
+# python bench.py                          -> bench_results.json
+# python bench.py --compare old.json       -> exit 1 on a regression
+#
+# smart_bot.session is replaced by FakeSession (deterministic klines,
+# tickers, wallet and order acks, optional --rtt per call) and the
+# Telegram outbox posts to FakeTelegram, so nothing leaves the machine.
+
+import os
+os.environ.setdefault("KLINE_STORE", "0")
+os.environ.setdefault("TG_TOKEN", "bench")
+os.environ.setdefault("TG_ADMIN", "1")
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import smart_bot as bot
+
+# ===============================
+# FAKE EXCHANGE
+# ===============================
+class FakeSession:
+    """
+    Answers the pybit calls the bot makes with deterministic data
+    """
+    def __init__(self, rtt=0.0):
+        self.rtt = rtt
+        self.calls = 0
+
+    def _wait(self):
+        self.calls += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def _series(self, symbol, interval, limit):
+        step = bot.INTERVAL_SECONDS.get(str(interval), 60) * 1000
+        now = int(time.time() * 1000) // step * step
+        rnd = random.Random(f"{symbol}:{interval}")
+        price = 100.0
+        rows = []
+        for i in range(limit):
+            price *= 1 + rnd.gauss(0, 0.002)
+            rows.append([str(now - i * step), str(price), str(price * 1.001),
+                         str(price * 0.999), str(price), "10", "1000"])
+        return rows
+
+    def get_kline(self, category, symbol, interval, limit=200, **kw):
+        self._wait()
+        return {"retCode": 0, "result": {"list": self._series(symbol, interval, limit)}}
+
+    def get_tickers(self, category, symbol=None, **kw):
+        self._wait()
+        symbols = [symbol] if symbol else UNIVERSE
+        return {"retCode": 0, "result": {"list": [
+            {"symbol": s, "lastPrice": "100", "bid1Price": "99.99",
+             "ask1Price": "100.01", "volume24h": "1000", "price24hPcnt": "0.01"}
+            for s in symbols
+        ]}}
+
+    def get_wallet_balance(self, **kw):
+        self._wait()
+        return {"retCode": 0, "result": {"list": [{
+            "totalWalletBalance": "10000", "totalEquity": "10000",
+            "totalAvailableBalance": "9000", "totalPerpUPL": "0"
+        }]}}
+
+    def get_instruments_info(self, category, symbol=None, **kw):
+        self._wait()
+        symbols = [symbol] if symbol else UNIVERSE
+        return {"retCode": 0, "result": {"nextPageCursor": "", "list": [
+            {"symbol": s,
+             "lotSizeFilter": {"qtyStep": "0.001", "minOrderQty": "0.001",
+                               "maxMktOrderQty": "1000", "minNotionalValue": "5"},
+             "priceFilter": {"tickSize": "0.01"},
+             "leverageFilter": {"maxLeverage": "100"}}
+            for s in symbols
+        ]}}
+
+    def set_leverage(self, **kw):
+        self._wait()
+        return {"retCode": 0, "result": {}}
+
+    def place_order(self, **kw):
+        self._wait()
+        return {"retCode": 0, "result": {"orderId": "bench"}}
+
+    def set_trading_stop(self, **kw):
+        self._wait()
+        return {"retCode": 0, "result": {}}
+
+    def get_positions(self, **kw):
+        self._wait()
+        return {"retCode": 0, "result": {"nextPageCursor": "", "list": []}}
+
+class FakeTelegram:
+    class _Resp:
+        status_code = 200
+
+        def json(self):
+            return {"ok": True}
+
+    def __init__(self):
+        self.sent = 0
+
+    def post(self, url, data=None, json=None, timeout=None):
+        self.sent += 1
+        return self._Resp()
+
+# enough symbols for the 500-position manage_trades case
+UNIVERSE = list(dict.fromkeys(bot.SYMBOLS)) + [f"BENCH{i}USDT" for i in range(500)]
+
+def install_fakes(rtt=0.0):
+    bot.session = FakeSession(rtt)
+    bot.TG_SESSION = FakeTelegram()
+    if bot.TG_SENDER is None:
+        bot.TG_SENDER = threading.Thread(target=bot.tg_sender, daemon=True)
+        bot.TG_SENDER.start()
+
+def reset_state():
+    bot.KLINE_CACHE.clear()
+    bot.IND_SERIES.clear()
+    bot.BATCH_MATRIX.update(index={}, x=None, ts=[])
+    bot.SIGNAL_MEMO.clear()
+    bot.OPEN_TRADES.clear()
+    bot.TRADES_TODAY = 0
+    bot.BOT_ACTIVE = True
+    bot.KILL_SWITCH = False
+    bot.TICKER_SNAPSHOT = {"ts": 0, "data": {}}
+    bot.TRIGGER_BOOKS.clear()
+    bot.LEVERAGE_SET.clear()
+    bot.invalidate_account()
+
+# ===============================
+# TIMING
+# ===============================
+def measure(name, fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - t0)
+    return summarize(name, samples)
+
+def summarize(name, samples):
+    us = sorted(s / 1000 for s in samples)
+    return {
+        "name": name,
+        "n": len(us),
+        "mean_us": statistics.fmean(us),
+        "p50_us": us[len(us) // 2],
+        "p95_us": us[min(len(us) - 1, int(len(us) * 0.95))],
+        "min_us": us[0]
+    }
+
+# ===============================
+# BENCHMARKS
+# ===============================
+def bench_indicators(repeat):
+    rnd = random.Random(7)
+    closes = [100.0]
+    for _ in range(199):
+        closes.append(closes[-1] * (1 + rnd.gauss(0, 0.002)))
+
+    return [
+        measure("indicator.ema", lambda: bot.ema(closes, 20), repeat),
+        measure("indicator.EMA", lambda: bot.EMA(closes[-20:], 20), repeat),
+        measure("indicator.rsi", lambda: bot.rsi(closes, 14), repeat),
+        measure("indicator.RSI", lambda: bot.RSI(closes, 14), repeat),
+        measure("indicator.rsi_wilder", lambda: bot.rsi_wilder(closes, 14), repeat),
+        measure("indicator.ai_trend_score", lambda: bot.ai_trend_score(closes), repeat)
+    ]
+
+def bench_metrics(repeat):
+    labels = (("method", "bench"),)
+    h = bot.histogram("bench_seconds", labels)
+
+    def burst():
+        for _ in range(1000):
+            bot.observe("bench_seconds", labels, 0.004)
+
+    def burst_bound():
+        for _ in range(1000):
+            h.observe(0.004)
+
+    # reported per 1000 observations: p50_us is ns per call
+    return [
+        measure("metrics.observe_x1000", burst, repeat),
+        measure("metrics.histogram_observe_x1000", burst_bound, repeat)
+    ]
+
+def bench_scan(repeat):
+    results = []
+    default = bot.BATCH_SIGNALS
+    for batch in (True, False):
+        if batch and bot.np is None:
+            continue
+        bot.BATCH_SIGNALS = batch
+        mode = "batch" if batch else "per_symbol"
+        results.append(measure(f"scan.{mode}.cold", bot.trader_cycle, repeat, setup=reset_state))
+
+        reset_state()
+        bot.trader_cycle()
+        results.append(measure(
+            f"scan.{mode}.warm", bot.trader_cycle, repeat,
+            setup=lambda: (bot.OPEN_TRADES.clear(), setattr(bot, "TRADES_TODAY", 0))
+        ))
+
+        # the signal pass alone, memo bypassed: what a new candle costs
+        reset_state()
+        bot.scan_signals(UNIVERSE)
+        results.append(measure(f"signals.{mode}.warm", lambda: bot.scan_signals(UNIVERSE), repeat))
+    bot.BATCH_SIGNALS = default
+    return results
+
+def bench_open_trade(repeat):
+    reset_state()
+    sym = UNIVERSE[0]
+
+    def setup():
+        bot.OPEN_TRADES.clear()
+        bot.TRADES_TODAY = 0
+
+    return [measure("order.open_trade", lambda: bot.open_trade(sym, "BUY"), repeat, setup=setup)]
+
+def bench_manage(repeat):
+    results = []
+    for n in (5, 50, 500):
+        reset_state()
+        for sym in UNIVERSE[-n:]:
+            # far levels: measure the steady-state pass, not the closes
+            bot.register_trade(sym, "BUY", 100.0, 1.0)
+            bot.OPEN_TRADES.update(sym, sl=1.0, tp=1e9)
+            bot.index_trade(sym)
+        results.append(measure(f"manage.cycle.{n}", bot.manage_cycle, repeat))
+    return results
+
+def bench_triggers(repeat):
+    """
+    One price update against a book of n positions (nothing crosses)
+    """
+    rnd = random.Random(11)
+    results = []
+    for n in (50, 500, 5000):
+        book = bot.TriggerBook()
+        for i in range(n):
+            side = rnd.choice(("BUY", "SELL"))
+            book.add(i, bot.new_position(side, 100.0 * (1 + rnd.uniform(-0.005, 0.005)), 1.0))
+        results.append(measure(f"exits.trigger_check.{n}", lambda: book.check(100.0), repeat))
+    return results
+
+def bench_ticks(repeat):
+    """
+    publicTrade ingestion: 1000 trades at ~300/s into 1s/5s/15s bars
+    """
+    rnd = random.Random(13)
+    t0 = int(time.time() * 1000) // 1000 * 1000
+    clock = {"t": t0}
+
+    def batch():
+        trades = []
+        for i in range(1000):
+            clock["t"] += 3
+            trades.append({"T": clock["t"], "p": str(100 + rnd.random()), "v": "0.01"})
+        return trades
+
+    batches = [batch() for _ in range(repeat)]
+    it = iter(batches)
+    # reported per 1000 trades: p50_us is ns per trade
+    return [measure("ticks.on_trades_x1000", lambda: bot.on_trades("BENCHTICK", next(it)), repeat)]
+
+def bench_scheduler(repeat):
+    """
+    Start-time jitter of a 10 ms job on the scheduler
+    """
+    every = 0.01
+    starts = []
+    done = threading.Event()
+
+    def job():
+        starts.append(time.perf_counter_ns())
+        if len(starts) > repeat:
+            done.set()
+            return 3600  # park it
+
+    bot.add_job("bench", job, every)
+    bot.start_scheduler()
+    done.wait(repeat * every * 10 + 5)
+    # fixed-rate: distance of each start from the grid of the first
+    grid = [abs(t - starts[0] - i * every * 1e9) for i, t in enumerate(starts)]
+    return [summarize("scheduler.jitter", grid[1:])]
+
+def bench_positions(repeat):
+    results = []
+    for n in (50, 500):
+        store = bot.PositionStore()
+        for i in range(n):
+            store.put(bot.new_position("BUY", 100.0, 1.0, f"P{i}"))
+        results.append(measure(f"positions.update.{n}", lambda: store.update("P0", sl=99.5), repeat))
+        results.append(measure(
+            f"positions.snapshot_scan.{n}",
+            lambda: sum(p.qty for p in store.snapshot().values()),
+            repeat
+        ))
+    return results
+
+def position_memory(n=10000):
+    """
+    Bytes per open position: store records vs the old dict-of-dicts
+    """
+    def traced(build):
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        keep = build()
+        used = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+        del keep
+        return used / n
+
+    def records():
+        return [bot.new_position("BUY", 100.0 + i, 1.0, f"P{i}") for i in range(n)]
+
+    def dicts():
+        return [p.as_dict() for p in records()]
+
+    return {"position_bytes": traced(records), "dict_bytes": traced(dicts)}
+
+COLD_START = """
+import time
+t0 = time.perf_counter_ns()
+import smart_bot
+t1 = time.perf_counter_ns()
+smart_bot.session.client()
+t2 = time.perf_counter_ns()
+print(t1 - t0, t2 - t1)
+"""
+
+def bench_cold_start(repeat):
+    """
+    Fresh interpreters: import smart_bot, then the first (lazy) session
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    imports, sessions = [], []
+    for _ in range(repeat):
+        try:
+            out = subprocess.check_output(
+                [sys.executable, "-c", COLD_START], cwd=here, stderr=subprocess.DEVNULL
+            )
+        except subprocess.CalledProcessError:
+            return []  # pybit missing: nothing to compare
+        a, b = out.decode().strip().splitlines()[-1].split()
+        imports.append(int(a))
+        sessions.append(int(b))
+    return [summarize("startup.import", imports), summarize("startup.session", sessions)]
+
+def run(args):
+    install_fakes(args.rtt)
+    results = []
+    results += bench_indicators(args.repeat * 100)
+    results += bench_metrics(args.repeat * 10)
+    results += bench_scan(args.repeat)
+    results += bench_open_trade(args.repeat * 10)
+    results += bench_manage(args.repeat)
+    results += bench_triggers(args.repeat * 100)
+    results += bench_positions(args.repeat * 100)
+    results += bench_ticks(args.repeat * 10)
+    results += bench_scheduler(args.repeat * 5)
+    results += bench_cold_start(max(3, args.repeat // 4))
+    return results
+
+# ===============================
+# OUTPUT / REGRESSIONS
+# ===============================
+def git_rev():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def compare(current, baseline, threshold):
+    old = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        b = old.get(r["name"])
+        if not b or not b["p50_us"]:
+            continue
+        change = r["p50_us"] / b["p50_us"] - 1
+        flag = " REGRESSION" if change > threshold else ""
+        print(f"{r['name']:32s} {b['p50_us']:12.1f} -> {r['p50_us']:12.1f} us  {change:+7.1%}{flag}")
+        if flag:
+            regressions.append(r["name"])
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser(description="smart_bot benchmarks")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--rtt", type=float, default=0.0, help="fake round-trip per session call (s)")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", help="previous results file")
+    ap.add_argument("--threshold", type=float, default=0.20, help="allowed p50 slowdown")
+    args = ap.parse_args()
+
+    report = {
+        "rev": git_rev(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "rtt": args.rtt,
+        "results": run(args),
+        "memory": position_memory()
+    }
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+    else:
+        for r in report["results"]:
+            print(f"{r['name']:32s} p50 {r['p50_us']:12.1f} us   p95 {r['p95_us']:12.1f} us")
+        for k, v in report["memory"].items():
+            print(f"{'memory.' + k:32s} {v:12.0f} B")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,12 @@
-from flask import Flask
+import json
+
+from flask import Flask, Response, request
 import smart_bot
 
 app = Flask(__name__)
 
-@app.route("/")
-def home():
-    status = "ON 🟢" if smart_bot.BOT_ACTIVE else "OFF 🔴"
-    balance = smart_bot.get_balance()
-    trades = smart_bot.TRADES_TODAY
-
-    return f"""
+# static page: all data arrives over /api/stream
+PAGE = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -17,35 +14,35 @@ def home():
 <title>SMART BOT</title>
 
 <style>
-body {{
+body {
     margin:0;
     font-family: Arial, sans-serif;
     background: #0f172a;
     color: white;
-}}
+}
 
-.header {{
+.header {
     background: linear-gradient(135deg,#2563eb,#06b6d4);
     padding: 25px;
     text-align:center;
     font-size: 24px;
     font-weight:bold;
-}}
+}
 
-.card {{
+.card {
     background:#020617;
     margin:15px;
     padding:20px;
     border-radius:16px;
     box-shadow:0 0 15px rgba(0,0,0,0.5);
-}}
+}
 
-.big {{
+.big {
     font-size:28px;
     font-weight:bold;
-}}
+}
 
-.btn {{
+.btn {
     display:block;
     width:100%;
     margin-top:12px;
@@ -54,18 +51,23 @@ body {{
     border:none;
     font-size:18px;
     font-weight:bold;
-}}
+}
 
-.start {{ background:#16a34a; color:white; }}
-.stop {{ background:#dc2626; color:white; }}
-.refresh {{ background:#2563eb; color:white; }}
+.start { background:#16a34a; color:white; }
+.stop { background:#dc2626; color:white; }
+.refresh { background:#2563eb; color:white; }
 
-.footer {{
+.small { font-size:14px; opacity:0.8; }
+.pos { display:flex; justify-content:space-between; padding:6px 0; border-bottom:1px solid #1e293b; }
+.up { color:#22c55e; }
+.down { color:#ef4444; }
+
+.footer {
     text-align:center;
     opacity:0.6;
     margin:20px;
     font-size:12px;
-}}
+}
 </style>
 </head>
 
@@ -75,43 +77,155 @@ body {{
 
 <div class="card">
     <p>Status</p>
-    <p class="big">{status}</p>
+    <p class="big" id="status">…</p>
 </div>
 
 <div class="card">
     <p>Balance</p>
-    <p class="big">${balance}</p>
+    <p class="big" id="balance">…</p>
+    <p class="small" id="pnl"></p>
 </div>
 
 <div class="card">
     <p>Trades Today</p>
-    <p class="big">{trades}</p>
+    <p class="big" id="trades">…</p>
+</div>
+
+<div class="card">
+    <p>Open Positions</p>
+    <div id="positions" class="small">–</div>
 </div>
 
 <div class="card">
     <button class="btn start" onclick="location.href='/start'">▶ START BOT</button>
     <button class="btn stop" onclick="location.href='/stop'">⛔ STOP BOT</button>
-    <button class="btn refresh" onclick="location.href='/'">🔄 REFRESH</button>
 </div>
 
 <div class="footer">
-SMART BOT • Mobile Dashboard
+SMART BOT • Mobile Dashboard • <span id="live">connecting</span>
 </div>
 
+<script>
+let state = {};
+
+function money(x) { return x === null || x === undefined ? "–" : "$" + x; }
+function signed(x) { return (x > 0 ? "+" : "") + x; }
+
+function render() {
+    document.getElementById("status").textContent =
+        state.kill ? "KILLED ⛔" : (state.active ? "ON 🟢" : "OFF 🔴");
+    document.getElementById("balance").textContent = money(state.balance);
+    document.getElementById("pnl").textContent =
+        state.day_pnl === null || state.day_pnl === undefined ? "" :
+        "Day PnL " + signed(state.day_pnl) + " | Open " + signed(state.upnl);
+    document.getElementById("trades").textContent =
+        state.trades_today + " / " + state.max_trades;
+
+    const rows = (state.positions || []).map(p =>
+        `<div class="pos"><span>${p.side} ${p.symbol} ${p.qty}</span>` +
+        `<span class="${p.pnl >= 0 ? "up" : "down"}">${p.pnl === null ? "–" : signed(p.pnl)}</span></div>`
+    );
+    document.getElementById("positions").innerHTML = rows.length ? rows.join("") : "–";
+}
+
+function connect() {
+    const es = new EventSource("/api/stream");
+    es.addEventListener("state", e => { state = JSON.parse(e.data); render(); });
+    es.addEventListener("delta", e => { Object.assign(state, JSON.parse(e.data)); render(); });
+    es.onopen = () => { document.getElementById("live").textContent = "live"; };
+    es.onerror = () => { document.getElementById("live").textContent = "reconnecting"; };
+}
+
+fetch("/api/state").then(r => r.json()).then(s => { state = s; render(); });
+connect();
+</script>
+
 </body>
 </html>
 """
 
+@app.route("/")
+def home():
+    return PAGE
+
+# ===============================
+# STATE API
+# (served from smart_bot's snapshot; viewers never reach the exchange)
+# ===============================
+@app.route("/api/state")
+def api_state():
+    smart_bot.start_state_publisher()
+    state = smart_bot.state_snapshot()
+    if request.headers.get("If-None-Match") == state["etag"]:
+        return Response(status=304, headers={"ETag": state["etag"]})
+    return Response(
+        state["body"],
+        mimetype="application/json",
+        headers={"ETag": state["etag"], "Cache-Control": "no-cache"}
+    )
+
+def sse(event, data):
+    return f"event: {event}\nid: {smart_bot.state_event_id(data['version'])}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@app.route("/api/stream")
+def api_stream():
+    smart_bot.start_state_publisher()
+    since = smart_bot.event_since(request.headers.get("Last-Event-ID"))
+
+    def events():
+        nonlocal since
+        state = smart_bot.state_snapshot()
+        delta = smart_bot.state_delta(since) if since >= 0 else None
+        if delta is None:
+            yield sse("state", dict(state["data"], version=state["version"]))
+            since = state["version"]
+
+        while True:
+            state = smart_bot.wait_state(since)
+            if state["version"] <= since:
+                yield ": ping\n\n"
+                continue
+            delta = smart_bot.state_delta(since)
+            if delta is None:
+                yield sse("state", dict(state["data"], version=state["version"]))
+            else:
+                yield sse("delta", dict(delta, version=state["version"]))
+            since = state["version"]
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route("/start")
 def start():
     smart_bot.BOT_ACTIVE = True
     smart_bot.KILL_SWITCH = False
+    smart_bot.publish_state()
     return "<script>location.href='/'</script>"
 
 @app.route("/stop")
 def stop():
     smart_bot.BOT_ACTIVE = False
+    smart_bot.publish_state()
     return "<script>location.href='/'</script>"
 
+@app.route("/metrics")
+def metrics():
+    return Response(
+        smart_bot.metrics_text(smart_bot.bot_gauges()),
+        mimetype="text/plain; version=0.0.4"
+    )
+
+@app.route("/tg/webhook", methods=["POST"])
+def tg_webhook():
+    if not smart_bot.webhook_allowed(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+        return "forbidden", 403
+    # handle_update keeps to TG_ADMIN; anything else is still acknowledged
+    # so Telegram stops retrying it
+    smart_bot.handle_update(request.get_json(silent=True) or {})
+    return "ok"
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=10000)
@@ -5,11 +5,48 @@
 # ======================================================
 
 import os
+import sys
 import time
 import threading
-import requests
-from datetime import datetime
-from pybit.unified_trading import HTTP
+import importlib
+import importlib.util
+
+# ===============================
+# LAZY IMPORTS
+# (importing smart_bot must stay cheap: the dashboard and the tools
+#  import it without trading)
+# ===============================
+class LazyModule:
+    """
+    Stands in for a heavy module and imports it on first attribute
+    access, under a lock so threads racing on first use are safe
+    """
+    def __init__(self, name):
+        self._name = name
+        self._mod = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._mod is None:
+            with self._lock:
+                if self._mod is None:
+                    self._mod = importlib.import_module(self._name)
+        return self._mod
+
+    def __getattr__(self, attr):
+        return getattr(self._mod or self.load(), attr)
+
+def lazy_module(name):
+    """
+    LazyModule, or None when the package is not installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
+
+requests = lazy_module("requests")
 
 # ===============================
 # MODE CONFIG (DEMO / REAL)
@@ -41,7 +78,135 @@ BOT_ACTIVE = True
 KILL_SWITCH = False
 START_DAY_BALANCE = None
 TRADES_TODAY = 0
-OPEN_TRADES = {}
+
+# ===============================
+# POSITION STORE
+# (one record type for every order path; writers serialize, readers get
+#  the current read-only mapping without locking)
+# ===============================
+from types import MappingProxyType
+
+class Position:
+    __slots__ = (
+        "symbol", "side", "entry", "qty", "sl", "tp",
+        "trail_active", "opened", "native", "closing"
+    )
+
+    def __init__(self, symbol, side, entry, qty, sl, tp,
+                 trail_active=False, opened=None, native=False, closing=False):
+        self.symbol = symbol
+        self.side = side
+        self.entry = entry
+        self.qty = qty
+        self.sl = sl
+        self.tp = tp
+        self.trail_active = trail_active
+        self.opened = opened if opened is not None else time.time()
+        self.native = native
+        self.closing = closing
+
+    def replace(self, **fields):
+        """
+        Copy with some fields changed; stored positions are never edited
+        """
+        p = Position.__new__(Position)
+        for f in Position.__slots__:
+            setattr(p, f, fields[f] if f in fields else getattr(self, f))
+        return p
+
+    def as_dict(self):
+        return {f: getattr(self, f) for f in Position.__slots__}
+
+    def __repr__(self):
+        return f"Position({self.symbol} {self.side} {self.qty}@{self.entry} sl={self.sl} tp={self.tp})"
+
+class PositionStore:
+    """
+    symbol -> Position. Every write copies the mapping under the lock and
+    publishes it in one assignment, so a reader's snapshot never changes.
+    """
+    __slots__ = ("_lock", "_snap", "listener")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snap = MappingProxyType({})
+        self.listener = None  # (op, value) for every write, under the lock
+
+    # ---- writers ----
+    def _publish(self, d, op=None, value=None):
+        self._snap = MappingProxyType(d)
+        if self.listener is not None:
+            self.listener(op, value)
+
+    def put(self, p):
+        with self._lock:
+            d = dict(self._snap)
+            d[p.symbol] = p
+            self._publish(d, "put", p)
+        return p
+
+    def update(self, symbol, **fields):
+        with self._lock:
+            p = self._snap.get(symbol)
+            if p is None:
+                return None
+            p = p.replace(**fields)
+            d = dict(self._snap)
+            d[symbol] = p
+            self._publish(d, "put", p)
+        return p
+
+    def swap(self, old, new):
+        """
+        Replaces old with new only if old is still the stored position
+        """
+        with self._lock:
+            if self._snap.get(old.symbol) is not old:
+                return False
+            d = dict(self._snap)
+            d[old.symbol] = new
+            self._publish(d, "put", new)
+        return True
+
+    def pop(self, symbol, default=None):
+        with self._lock:
+            if symbol not in self._snap:
+                return default
+            d = dict(self._snap)
+            p = d.pop(symbol)
+            self._publish(d, "pop", symbol)
+        return p
+
+    def clear(self):
+        with self._lock:
+            self._publish({}, "clear")
+
+    # ---- readers (no lock) ----
+    def snapshot(self):
+        return self._snap
+
+    def get(self, symbol, default=None):
+        return self._snap.get(symbol, default)
+
+    def keys(self):
+        return self._snap.keys()
+
+    def values(self):
+        return self._snap.values()
+
+    def items(self):
+        return self._snap.items()
+
+    def __contains__(self, symbol):
+        return symbol in self._snap
+
+    def __len__(self):
+        return len(self._snap)
+
+    def __iter__(self):
+        return iter(self._snap)
+
+OPEN_TRADES = PositionStore()
 
 # ===============================
 # RISK SETTINGS (BASE)
@@ -52,40 +217,573 @@ MAX_DAILY_LOSS = 0.10
 MAX_DAILY_PROFIT = 0.25
 MAX_TRADES = 5
 
+# ===============================
+# METRICS
+# (prometheus-style histograms / counters, rendered by mini_app /metrics)
+# ===============================
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        # no lock on purpose: a rare lost increment is fine for monitoring
+        self.counts[bisect_left(LATENCY_BUCKETS, v)] += 1
+        self.sum += v
+        self.count += 1
+
+METRIC_HIST = {}   # (name, labels) -> Histogram, labels = ((key, value), ...)
+METRIC_COUNT = {}  # (name, labels) -> int
+METRIC_HELP = {
+    "bybit_request_seconds": "Latency of pybit session calls",
+    "bybit_request_errors_total": "Failed pybit session calls",
+    "bybit_ratelimit_wait_seconds": "Time spent waiting for a rate limit token",
+    "telegram_send_seconds": "Latency of Telegram sendMessage posts",
+    "telegram_send_errors_total": "Failed Telegram sendMessage posts",
+    "scan_cycle_seconds": "Duration of one trader job pass",
+    "scan_symbol_seconds": "Per-symbol signal evaluation time in a scan",
+    "manage_cycle_seconds": "Duration of one manager job pass",
+    "order_latency_seconds": "open_trade from signal to order placed and notified",
+    "job_jitter_seconds": "Delay between a job's due time and its start",
+    "job_run_seconds": "Duration of one scheduler job run",
+    "job_overruns_total": "Job slots skipped because the previous run was still going",
+    "swallowed_errors_total": "Exceptions caught and ignored, by location"
+}
+
+def histogram(name, labels=()):
+    """
+    The Histogram behind (name, labels); hot paths bind it once
+    """
+    h = METRIC_HIST.get((name, labels))
+    if h is None:
+        h = METRIC_HIST.setdefault((name, labels), Histogram())
+    return h
+
+def observe(name, labels, seconds):
+    histogram(name, labels).observe(seconds)
+
+def count(name, labels=(), n=1):
+    key = (name, labels)
+    METRIC_COUNT[key] = METRIC_COUNT.get(key, 0) + n
+
+def count_error(where):
+    count("swallowed_errors_total", (("where", where),))
+
+def bot_gauges():
+    """
+    Point-in-time state exported next to the histograms
+    """
+    g = {
+        "bot_active": BOT_ACTIVE,
+        "bot_kill_switch": KILL_SWITCH,
+        "bot_trades_today": TRADES_TODAY,
+        "bot_open_trades": len(OPEN_TRADES),
+        "bot_native_exits": sum(1 for t in OPEN_TRADES.values() if t.native),
+        "telegram_outbox_size": len(TG_OUTBOX)
+    }
+    k = kline_cache_stats()
+    g["kline_cache_hits"] = k["hits"]
+    g["kline_cache_misses"] = k["misses"]
+    g["stream_connected"] = STREAM_STATS["connected"]
+    g["scan_evaluated"] = SCHED_STATS["last_evaluated"]
+    g["scan_skipped"] = SCHED_STATS["last_skipped"]
+    g["scan_stale"] = SCHED_STATS["last_stale"]
+    g["scheduler_jobs"] = len(JOBS)
+    for k, v in STARTUP.items():
+        g[f"startup_{k}_ms"] = v
+    return g
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+def metrics_text(gauges=None):
+    """
+    Text exposition format (version 0.0.4)
+    """
+    out = []
+    typed = set()
+
+    for (name, labels), h in sorted(METRIC_HIST.items()):
+        if name not in typed:
+            typed.add(name)
+            out.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            out.append(f"# TYPE {name} histogram")
+        cum = 0
+        for bound, c in zip(LATENCY_BUCKETS + ("+Inf",), h.counts):
+            cum += c
+            out.append(f"{name}_bucket{_labels(labels, ('le', bound))} {cum}")
+        out.append(f"{name}_sum{_labels(labels)} {h.sum}")
+        out.append(f"{name}_count{_labels(labels)} {h.count}")
+
+    for (name, labels), v in sorted(METRIC_COUNT.items()):
+        if name not in typed:
+            typed.add(name)
+            out.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            out.append(f"# TYPE {name} counter")
+        out.append(f"{name}{_labels(labels)} {v}")
+
+    for name, v in sorted((gauges or {}).items()):
+        out.append(f"# TYPE {name} gauge")
+        out.append(f"{name} {float(v)}")
+
+    return "\n".join(out) + "\n"
+
+# ===============================
+# RATE LIMITER
+# (token bucket per bybit endpoint class, priority ordered)
+# ===============================
+import heapq
+import itertools
+
+PRIO_EXIT = 0     # closes, stop exits
+PRIO_ORDER = 1    # new orders, leverage
+PRIO_ACCOUNT = 2  # balance, positions
+PRIO_SCAN = 3     # market data for scans
+
+ENDPOINT_CLASS = {
+    "get_kline": "market",
+    "get_tickers": "market",
+    "get_instruments_info": "market",
+    "place_order": "order",
+    "amend_order": "order",
+    "cancel_order": "order",
+    "cancel_all_orders": "order",
+    "get_open_orders": "order",
+    "set_leverage": "position",
+    "set_trading_stop": "position",
+    "get_positions": "position",
+    "get_wallet_balance": "account"
+}
+
+CLASS_PRIORITY = {
+    "market": PRIO_SCAN,
+    "order": PRIO_ORDER,
+    "position": PRIO_ORDER,
+    "account": PRIO_ACCOUNT
+}
+
+# requests per second, burst
+RATE_LIMITS = {
+    "market": (20, 20),
+    "order": (10, 10),
+    "position": (10, 10),
+    "account": (10, 10)
+}
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiters = []  # heap of (priority, seq)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def acquire(self, priority=PRIO_SCAN):
+        ticket = (priority, next(self.seq))
+        with self.cond:
+            heapq.heappush(self.waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.waiters[0] == ticket and now >= self.blocked_until and self.tokens >= 1:
+                        heapq.heappop(self.waiters)
+                        self.tokens -= 1
+                        self.cond.notify_all()
+                        return
+                    if now < self.blocked_until:
+                        wait = self.blocked_until - now
+                    else:
+                        wait = max((1 - self.tokens) / self.rate, 0.001)
+                    self.cond.wait(wait)
+            except BaseException:
+                if ticket in self.waiters:
+                    self.waiters.remove(ticket)
+                    heapq.heapify(self.waiters)
+                    self.cond.notify_all()
+                raise
+
+    def observe(self, headers):
+        """
+        Syncs the bucket with bybit's X-Bapi-Limit* response headers
+        """
+        if not headers:
+            return
+        try:
+            limit = int(headers.get("X-Bapi-Limit") or 0)
+            remaining = headers.get("X-Bapi-Limit-Status")
+            reset_ms = int(headers.get("X-Bapi-Limit-Reset-Timestamp") or 0)
+        except (TypeError, ValueError):
+            return
+
+        with self.cond:
+            if limit > 0 and limit != self.burst:
+                self.rate = self.burst = limit
+            if remaining is not None:
+                remaining = int(remaining)
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and reset_ms:
+                    wait = reset_ms / 1000 - time.time()
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + max(wait, 0))
+            self.cond.notify_all()
+
+# class buckets stay at RATE_LIMITS; X-Bapi-Limit is per endpoint, so the
+# headers feed one bucket per method, created on the first reply carrying them
+BUCKETS = {name: TokenBucket(*lim) for name, lim in RATE_LIMITS.items()}
+METHOD_BUCKETS = {}  # pybit method name -> TokenBucket
+METHOD_LOCK = threading.Lock()
+
+def method_bucket(name, headers):
+    """
+    Per-endpoint bucket synced with the response headers of `name`
+    """
+    bucket = METHOD_BUCKETS.get(name)
+    if bucket is None:
+        try:
+            limit = int((headers or {}).get("X-Bapi-Limit") or 0)
+        except (TypeError, ValueError):
+            return None
+        if limit <= 0:
+            return None
+        with METHOD_LOCK:
+            bucket = METHOD_BUCKETS.setdefault(name, TokenBucket(limit, limit))
+    bucket.observe(headers)
+    return bucket
+
+_PRIORITY = threading.local()
+
+class priority:
+    """
+    with priority(PRIO_EXIT): ... – every session call in the block
+    jumps ahead of lower priority traffic
+    """
+    def __init__(self, level):
+        self.level = level
+
+    def __enter__(self):
+        self.prev = getattr(_PRIORITY, "level", None)
+        _PRIORITY.level = self.level
+        return self
+
+    def __exit__(self, *exc):
+        _PRIORITY.level = self.prev
+
+class RateLimitedSession:
+    """
+    Wraps the pybit HTTP session: every call takes a token from its
+    endpoint class bucket (and its method bucket, once the exchange has
+    reported one) and feeds the limit headers back
+    """
+    def __init__(self, factory):
+        self._factory = factory  # builds the pybit session on first use
+        self._http = None
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def client(self):
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    self._http = self._factory()
+        return self._http
+
+    def __getattr__(self, name):
+        call = self._calls.get(name)
+        if call is not None:
+            return call
+
+        attr = getattr(self.client(), name)
+        if not callable(attr):
+            return attr
+
+        cls = ENDPOINT_CLASS.get(name, "market")
+        bucket = BUCKETS[cls]
+        labels = (("method", name),)
+        h_wait = histogram("bybit_ratelimit_wait_seconds", (("class", cls),))
+        h_call = histogram("bybit_request_seconds", labels)
+
+        def call(*args, **kwargs):
+            level = getattr(_PRIORITY, "level", None)
+            if level is None:
+                level = PRIO_EXIT if kwargs.get("reduceOnly") else CLASS_PRIORITY[cls]
+            t0 = time.perf_counter()
+            bucket.acquire(level)
+            endpoint = METHOD_BUCKETS.get(name)
+            if endpoint is not None:
+                endpoint.acquire(level)
+            t1 = time.perf_counter()
+            h_wait.observe(t1 - t0)
+            try:
+                r = attr(*args, **kwargs)
+            except Exception as e:
+                h_call.observe(time.perf_counter() - t1)
+                count("bybit_request_errors_total", labels)
+                method_bucket(name, getattr(e, "resp_headers", None))
+                raise
+            h_call.observe(time.perf_counter() - t1)
+            if isinstance(r, tuple):
+                # return_response_headers=True -> (json, elapsed, headers)
+                method_bucket(name, r[-1])
+                r = r[0]
+            return r
+
+        self._calls[name] = call
+        return call
+
 # ===============================
 # CONNECT TO BYBIT
+# (lazy: the first session call connects)
 # ===============================
-print("🔌 Connecting to Bybit...")
+def connect_bybit():
+    from pybit.unified_trading import HTTP
+
+    print("🔌 Connecting to Bybit...")
+    return HTTP(
+        testnet=TESTNET,
+        api_key=API_KEY,
+        api_secret=API_SECRET,
+        return_response_headers=True
+    )
 
-session = HTTP(
-    testnet=TESTNET,
-    api_key=API_KEY,
-    api_secret=API_SECRET
-)
+session = RateLimitedSession(connect_bybit)
 
 # ===============================
 # TELEGRAM CORE
+# (non-blocking outbox, one background sender)
 # ===============================
-def tg(msg):
+from collections import deque
+
+TG_QUEUE_MAX = 200
+TG_COALESCE = 0.25   # seconds to let a burst gather into one message
+TG_MAX_LEN = 4000    # telegram rejects texts over 4096 chars
+TG_TIMEOUT = 10
+
+TG_OUTBOX = deque()  # (text, low_priority)
+TG_COND = threading.Condition()
+TG_SESSION = None
+TG_SENDER = None
+TG_STATS = {"queued": 0, "sent": 0, "merged": 0, "dropped": 0, "retries": 0, "failed": 0}
+
+def tg(msg, low=False):
+    """
+    Queues a message and returns immediately. When the outbox is full,
+    low priority messages are dropped and the rest are merged into the
+    tail while it fits one Telegram message; past that the oldest entry
+    makes room.
+    """
     if not TG_TOKEN or TG_ADMIN == 0:
         return
-    try:
-        requests.post(
-            f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage",
-            data={"chat_id": TG_ADMIN, "text": msg}
-        )
-    except:
-        pass
+
+    with TG_COND:
+        if len(TG_OUTBOX) >= TG_QUEUE_MAX:
+            if low:
+                TG_STATS["dropped"] += 1
+                return
+            for i, (_, old_low) in enumerate(TG_OUTBOX):
+                if old_low:
+                    del TG_OUTBOX[i]
+                    TG_STATS["dropped"] += 1
+                    break
+            else:
+                text, _ = TG_OUTBOX[-1]
+                if len(text) + 2 + len(msg) <= TG_MAX_LEN:
+                    TG_OUTBOX.pop()
+                    msg = f"{text}\n\n{msg}"
+                    TG_STATS["merged"] += 1
+                else:
+                    TG_OUTBOX.popleft()
+                    TG_STATS["dropped"] += 1
+
+        TG_OUTBOX.append((msg, low))
+        TG_STATS["queued"] += 1
+        TG_COND.notify()
+
+    if TG_SENDER is None:
+        start_tg_sender()
+
+def start_tg_sender():
+    global TG_SESSION, TG_SENDER
+    with TG_COND:
+        if TG_SENDER is not None:
+            return
+        TG_SESSION = requests.Session()  # keep-alive connection pool
+        TG_SENDER = threading.Thread(target=tg_sender, daemon=True)
+        TG_SENDER.start()
+
+def tg_sender():
+    # TG_SENDER is started once: an escaped error would silence every later tg()
+    while True:
+        try:
+            with TG_COND:
+                while not TG_OUTBOX:
+                    TG_COND.wait()
+
+            time.sleep(TG_COALESCE)
+
+            with TG_COND:
+                if not TG_OUTBOX:
+                    continue
+                batch = [TG_OUTBOX.popleft()[0]]
+                size = len(batch[0])
+                while TG_OUTBOX and size + len(TG_OUTBOX[0][0]) + 2 <= TG_MAX_LEN:
+                    text = TG_OUTBOX.popleft()[0]
+                    batch.append(text)
+                    size += len(text) + 2
+                if len(batch) > 1:
+                    TG_STATS["merged"] += len(batch) - 1
+
+            for part in tg_chunks("\n\n".join(batch)):
+                tg_send(part)
+        except Exception:
+            count_error("tg")
+            time.sleep(1)
+
+def tg_chunks(text):
+    """
+    Pieces of at most TG_MAX_LEN, cut at a line break where there is one
+    """
+    while len(text) > TG_MAX_LEN:
+        cut = text.rfind("\n", 0, TG_MAX_LEN)
+        if cut <= 0:
+            cut = TG_MAX_LEN
+        yield text[:cut]
+        text = text[cut:].lstrip("\n")
+    yield text
+
+def tg_send(text):
+    for attempt in range(5):
+        try:
+            t0 = time.perf_counter()
+            r = TG_SESSION.post(
+                f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage",
+                data={"chat_id": TG_ADMIN, "text": text},
+                timeout=TG_TIMEOUT
+            )
+            observe("telegram_send_seconds", (), time.perf_counter() - t0)
+            if r.status_code == 429:
+                count("telegram_send_errors_total", (("code", "429"),))
+                # flood control: telegram says how long to back off
+                try:
+                    wait = r.json()["parameters"]["retry_after"]
+                except Exception:
+                    wait = 2 ** attempt
+                TG_STATS["retries"] += 1
+                time.sleep(wait)
+                continue
+            if r.status_code >= 500:
+                count("telegram_send_errors_total", (("code", str(r.status_code)),))
+                TG_STATS["retries"] += 1
+                time.sleep(2 ** attempt)
+                continue
+            try:
+                body = r.json()
+            except ValueError:
+                body = {}
+            if not body.get("ok"):
+                # 400 bad chat / text, 401 bad token, 403 blocked: retrying won't help
+                count("telegram_send_errors_total", (("code", str(r.status_code)),))
+                print(f"⚠️ Telegram sendMessage {r.status_code}: {body.get('description')}")
+                break
+            TG_STATS["sent"] += 1
+            return True
+        except requests.RequestException:
+            count("telegram_send_errors_total", (("code", "network"),))
+            TG_STATS["retries"] += 1
+            time.sleep(2 ** attempt)
+
+    TG_STATS["failed"] += 1
+    return False
 
 # ===============================
 # WALLET
+# (short TTL cache, dropped whenever an order fills or a position closes)
 # ===============================
-def get_balance():
+BALANCE_TTL = 10
+ACCOUNT_STATE = {
+    "fetched": 0,
+    "valid": False,
+    "wallet": 0.0,
+    "equity": 0.0,
+    "available": 0.0,
+    "upnl": 0.0
+}
+ACCOUNT_LOCK = threading.Lock()
+
+def refresh_account():
+    global ACCOUNT_STATE
     try:
         r = session.get_wallet_balance(accountType="UNIFIED")
-        return float(r["result"]["list"][0]["totalWalletBalance"])
+        a = r["result"]["list"][0]
+        snap = {
+            "fetched": time.time(),
+            "valid": True,
+            "wallet": float(a["totalWalletBalance"]),
+            "equity": float(a.get("totalEquity") or 0),
+            "available": float(a.get("totalAvailableBalance") or 0),
+            "upnl": float(a.get("totalPerpUPL") or 0)
+        }
     except:
+        count_error("refresh_account")
+        return False
+    # swap, never mutate: readers always see one consistent snapshot
+    ACCOUNT_STATE = snap
+    return True
+
+def invalidate_account():
+    global ACCOUNT_STATE
+    ACCOUNT_STATE = dict(ACCOUNT_STATE, valid=False)
+
+def account_snapshot(fresh=False):
+    """
+    Copy of the account state plus its age in seconds (None if never read).
+    fresh=True is reserved for position sizing.
+    """
+    snap = ACCOUNT_STATE
+    if fresh or not snap["valid"] or time.time() - snap["fetched"] > BALANCE_TTL:
+        with ACCOUNT_LOCK:
+            snap = ACCOUNT_STATE
+            if fresh or not snap["valid"] or time.time() - snap["fetched"] > BALANCE_TTL:
+                ok = refresh_account()
+                if fresh and not ok:
+                    return None
+                snap = ACCOUNT_STATE
+
+    out = dict(snap)
+    out["age"] = time.time() - snap["fetched"] if snap["fetched"] else None
+    return out
+
+def cached_balance():
+    """
+    (wallet, age) without touching the exchange
+    """
+    snap = ACCOUNT_STATE
+    if not snap["fetched"]:
+        return 0.0, None
+    return snap["wallet"], time.time() - snap["fetched"]
+
+def get_balance(fresh=False):
+    snap = account_snapshot(fresh)
+    if not snap or not snap["fetched"]:
         return 0.0
+    return snap["wallet"]
 
 # ===============================
 # DAILY INIT
@@ -116,16 +814,6 @@ def daily_risk_check():
         KILL_SWITCH = True
         tg("🎯 DAILY PROFIT TARGET HIT")
 
-# ===============================
-# TEST CORE
-# ===============================
-if __name__ == "__main__":
-    init_day()
-    while True:
-        daily_risk_check()
-        print("Balance:", get_balance(), "| Active:", BOT_ACTIVE, "| Kill:", KILL_SWITCH)
-        time.sleep(15)
-
 # ======================================================
 # SMART BOT – PART 2 : MARKET DATA & INDICATORS
 # ======================================================
@@ -133,9 +821,80 @@ if __name__ == "__main__":
 import math
 
 # ===============================
-# GET KLINES
+# KLINE CACHE
+# (one window per symbol + interval, valid until the next candle closes)
 # ===============================
-def get_klines(symbol="BTCUSDT", interval="1", limit=200):
+INTERVAL_SECONDS = {
+    "1": 60, "3": 180, "5": 300, "15": 900, "30": 1800,
+    "60": 3600, "120": 7200, "240": 14400, "360": 21600, "720": 43200,
+    "D": 86400, "W": 604800
+}
+
+KLINE_CACHE = {}  # (symbol, interval) -> {"rows", "limit", "expires"}
+KLINE_CACHE_LOCK = threading.Lock()
+KLINE_STATS = {"hits": 0, "misses": 0}
+
+def candle_expiry(rows, interval):
+    """
+    Time (epoch seconds) at which the newest candle in rows closes
+    """
+    step = INTERVAL_SECONDS.get(interval, 60)
+    if not rows:
+        return time.time() + step
+    return int(rows[0][0]) / 1000 + step
+
+def fetch_klines(symbol="BTCUSDT", interval="1", limit=200):
+    """
+    Raw Bybit kline rows (newest first) served from the shared cache
+    """
+    interval = str(interval)
+    if RESAMPLE and interval in RESAMPLE_TFS:
+        rows = resampled(symbol, interval, limit)
+        if rows:
+            return rows
+
+    key = (symbol, interval)
+    now = time.time()
+
+    with KLINE_CACHE_LOCK:
+        entry = KLINE_CACHE.get(key)
+        if entry and now < entry["expires"] and limit <= entry["limit"]:
+            KLINE_STATS["hits"] += 1
+            return entry["rows"][:limit]
+        KLINE_STATS["misses"] += 1
+        # refetch the widest window anyone asked for
+        window = max(limit, entry["limit"]) if entry else limit
+
+    rows = exchange_klines(symbol, interval, window)
+    if not rows:
+        return []
+    if interval == "1":
+        resample_feed(symbol, rows)
+
+    with KLINE_CACHE_LOCK:
+        KLINE_CACHE[key] = {
+            "rows": rows,
+            "limit": window,
+            "expires": candle_expiry(rows, interval)
+        }
+    return rows[:limit]
+
+def kline_cached(symbol, interval, limit):
+    """
+    True when fetch_klines would answer from the cache
+    """
+    with KLINE_CACHE_LOCK:
+        entry = KLINE_CACHE.get((symbol, str(interval)))
+        return bool(entry) and time.time() < entry["expires"] and limit <= entry["limit"]
+
+def exchange_klines(symbol, interval, limit):
+    """
+    Uncached read: local store when enabled, else bybit REST
+    """
+    if KLINE_STORE:
+        rows = store_fetch(symbol, interval, limit)
+        if rows is not None:
+            return rows
     try:
         r = session.get_kline(
             category="linear",
@@ -143,12 +902,31 @@ def get_klines(symbol="BTCUSDT", interval="1", limit=200):
             interval=interval,
             limit=limit
         )
-        data = r["result"]["list"]
-        closes = [float(c[4]) for c in data]
-        return closes
+        return r["result"]["list"]
     except:
+        count_error("fetch_klines")
         return []
 
+def kline_cache_stats():
+    with KLINE_CACHE_LOCK:
+        hits = KLINE_STATS["hits"]
+        misses = KLINE_STATS["misses"]
+        entries = len(KLINE_CACHE)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "entries": entries,
+        "hit_rate": hits / total if total else 0.0
+    }
+
+# ===============================
+# GET KLINES
+# ===============================
+def get_klines(symbol="BTCUSDT", interval="1", limit=200):
+    data = fetch_klines(symbol, interval, limit)
+    return [float(c[4]) for c in data]
+
 # ===============================
 # EMA
 # ===============================
@@ -190,12 +968,12 @@ def rsi(data, period=14):
 # TREND FILTER (AI-LIKE SIMPLE)
 # ===============================
 def trend_filter(symbol="BTCUSDT"):
-    closes = get_klines(symbol, "5", 120)
-    if not closes:
+    rows = fetch_klines(symbol, "5", 120)
+    if not rows:
         return "NONE"
 
-    fast = ema(closes, 20)
-    slow = ema(closes, 50)
+    fast = indicator(symbol, "5", "ema", 20, rows)
+    slow = indicator(symbol, "5", "ema", 50)
 
     if not fast or not slow:
         return "NONE"
@@ -216,6 +994,9 @@ def trend_filter(symbol="BTCUSDT"):
 # GET LAST PRICE
 # ===============================
 def get_price(symbol="BTCUSDT"):
+    price = live_price(symbol) or snapshot_price(symbol)
+    if price:
+        return price
     try:
         r = session.get_tickers(category="linear", symbol=symbol)
         return float(r["result"]["list"][0]["lastPrice"])
@@ -226,34 +1007,29 @@ def get_price(symbol="BTCUSDT"):
 # POSITION SIZE (RISK BASED)
 # ===============================
 def calc_size(symbol="BTCUSDT", risk=RISK_PER_TRADE):
-    balance = get_balance()
+    balance = get_balance(fresh=True)
     price = get_price(symbol)
     if not price or balance <= 0:
         return 0
 
     risk_amount = balance * risk
     qty = (risk_amount * LEVERAGE) / price
-    return round(qty, 3)
+    return float(quantize_qty(symbol, qty))
 
 # ===============================
 # SET LEVERAGE
 # ===============================
 def set_leverage(symbol="BTCUSDT"):
     try:
-        session.set_leverage(
-            category="linear",
-            symbol=symbol,
-            buyLeverage=str(LEVERAGE),
-            sellLeverage=str(LEVERAGE)
-        )
+        ensure_leverage(symbol)
     except:
-        pass
+        count_error("set_leverage")
 
 # ===============================
 # OPEN MARKET ORDER
 # ===============================
 def open_trade(symbol="BTCUSDT", side="Buy"):
-    global OPEN_TRADES, TRADES_TODAY
+    global TRADES_TODAY
 
     if KILL_SWITCH or not BOT_ACTIVE:
         return
@@ -261,8 +1037,9 @@ def open_trade(symbol="BTCUSDT", side="Buy"):
     if TRADES_TODAY >= MAX_TRADES:
         return
 
-    qty = calc_size(symbol)
-    if qty <= 0:
+    price = get_price(symbol)
+    qty = preflight(symbol, calc_size(symbol), price)
+    if not qty:
         return
 
     set_leverage(symbol)
@@ -271,19 +1048,16 @@ def open_trade(symbol="BTCUSDT", side="Buy"):
         order = session.place_order(
             category="linear",
             symbol=symbol,
-            side=side,
+            side=order_side(side),
             orderType="Market",
             qty=qty,
             timeInForce="GoodTillCancel"
         )
 
-        OPEN_TRADES[symbol] = {
-            "side": side,
-            "qty": qty,
-            "time": datetime.now()
-        }
+        register_trade(symbol, side, price, float(qty))
 
         TRADES_TODAY += 1
+        invalidate_account()
         tg(f"📥 OPEN {side} {symbol}\nQty: {qty}")
 
     except Exception as e:
@@ -297,15 +1071,17 @@ def close_trade(symbol="BTCUSDT", side="Sell"):
         session.place_order(
             category="linear",
             symbol=symbol,
-            side=side,
+            side=order_side(side),
             orderType="Market",
             qty=0,
             reduceOnly=True
         )
         OPEN_TRADES.pop(symbol, None)
+        unindex_trade(symbol)
+        invalidate_account()
         tg(f"📤 CLOSED {symbol}")
     except:
-        pass
+        count_error("close_trade")
 
 # ===============================
 # CHECK OPEN POSITIONS (LOCAL)
@@ -321,16 +1097,7 @@ def has_open_trade(symbol="BTCUSDT"):
 # GET CANDLES
 # ===============================
 def get_candles(symbol="BTCUSDT", tf="5", limit=200):
-    try:
-        r = session.get_kline(
-            category="linear",
-            symbol=symbol,
-            interval=tf,
-            limit=limit
-        )
-        return r["result"]["list"]
-    except:
-        return []
+    return fetch_klines(symbol, tf, limit)
 
 # ===============================
 # SIMPLE INDICATORS
@@ -362,22 +1129,24 @@ def RSI(closes, period=14):
 # ===============================
 # SIGNAL LOGIC
 # ===============================
-def get_signal(symbol="BTCUSDT"):
-    candles = get_candles(symbol)
+def get_signal(symbol="BTCUSDT", tf="15"):
+    candles = get_candles(symbol, tf, 100)
     if len(candles) < 50:
         return None
 
-    closes = [float(c[4]) for c in candles][::-1]
+    ema_fast = indicator(symbol, tf, "ema", 20, candles)
+    ema_slow = indicator(symbol, tf, "ema", 50)
+    rsi = indicator(symbol, tf, "rsi", 14)
 
-    ema_fast = EMA(closes[-20:], 20)
-    ema_slow = EMA(closes[-50:], 50)
-    rsi = RSI(closes, 14)
+    return signal_rules(ema_fast, ema_slow, rsi)
 
+def signal_rules(ema_fast, ema_slow, rsi):
+    """
+    Entry rule of get_signal on already computed indicators
+    """
     if not ema_fast or not ema_slow or not rsi:
         return None
 
-    price = closes[-1]
-
     # BUY SIGNAL
     if ema_fast > ema_slow and rsi < 35:
         return "Buy"
@@ -392,7 +1161,7 @@ def get_signal(symbol="BTCUSDT"):
 # STRATEGY LOOP
 # ===============================
 def strategy_engine():
-    tg("🤖 Strategy engine started")
+    tg("🤖 Strategy engine started", low=True)
 
     while BOT_ACTIVE:
         try:
@@ -443,7 +1212,7 @@ def trade_engine(symbol, side):
     """
     Executes a trade with risk control
     """
-    global TRADES_TODAY, OPEN_TRADES
+    global TRADES_TODAY
 
     if KILL_SWITCH or not BOT_ACTIVE:
         return
@@ -451,60 +1220,43 @@ def trade_engine(symbol, side):
     if TRADES_TODAY >= MAX_TRADES:
         return
 
-    balance = get_balance()
+    balance = get_balance(fresh=True)
     if balance <= 0:
         return
 
     # position size based on risk
     risk_amount = balance * RISK_PER_TRADE
 
-    try:
-        price = float(
-            session.get_tickers(
-                category="linear",
-                symbol=symbol
-            )["result"]["list"][0]["lastPrice"]
-        )
-    except:
-        return
-
-    if price <= 0:
+    price = get_price(symbol)
+    if not price or price <= 0:
         return
 
-    qty = round(risk_amount / price, 3)
-    if qty <= 0:
+    qty = preflight(symbol, risk_amount / price, price)
+    if not qty:
         return
 
     try:
-        # set leverage
-        session.set_leverage(
-            category="linear",
-            symbol=symbol,
-            buyLeverage=LEVERAGE,
-            sellLeverage=LEVERAGE
-        )
+        # set leverage (skipped when already applied)
+        ensure_leverage(symbol)
 
         # place market order
         session.place_order(
             category="linear",
             symbol=symbol,
-            side=side,
+            side=order_side(side),
             orderType="Market",
             qty=qty,
             timeInForce="IOC"
         )
 
         TRADES_TODAY += 1
-        OPEN_TRADES[symbol] = {
-            "side": side,
-            "qty": qty,
-            "price": price,
-            "time": datetime.utcnow()
-        }
+        invalidate_account()
+        register_trade(symbol, side, price, float(qty))
 
         tg(f"📈 TRADE OPENED\n{symbol} | {side}\nQty: {qty}")
 
     except Exception as e:
+        forget_leverage(symbol)
         tg(f"⚠️ Trade failed: {e}")
 
   # ======================================================
@@ -512,85 +1264,142 @@ def trade_engine(symbol, side):
 # ======================================================
 
 # ===============================
-# TELEGRAM LISTENER
+# COMMAND HANDLERS
+# (answered from cached state, no exchange round-trips)
 # ===============================
-def telegram_listener():
-    global BOT_ACTIVE, KILL_SWITCH, TRADES_TODAY
+def cmd_start(arg):
+    global BOT_ACTIVE, KILL_SWITCH
+    BOT_ACTIVE = True
+    KILL_SWITCH = False
+    tg("▶️ BOT STARTED")
 
-    offset = None
-    tg("🤖 SMART BOT Telegram control connected")
+def cmd_stop(arg):
+    global BOT_ACTIVE
+    BOT_ACTIVE = False
+    tg("⛔ BOT STOPPED")
 
-    while True:
-        try:
-            r = requests.get(
-                f"https://api.telegram.org/bot{TG_TOKEN}/getUpdates",
-                params={"offset": offset, "timeout": 30}
-            ).json()
+def cmd_kill(arg):
+    global KILL_SWITCH
+    KILL_SWITCH = True
+    tg("🛑 KILL SWITCH ACTIVATED")
+
+def cmd_status(arg):
+    bal, age = cached_balance()
+    age_txt = f" ({age:.0f}s ago)" if age is not None else ""
+    tg(
+        f"⚙️ SMART BOT STATUS\n"
+        f"Mode: {MODE}\n"
+        f"Balance: {bal}{age_txt}\n"
+        f"Trades today: {TRADES_TODAY}\n"
+        f"Open trades: {len(OPEN_TRADES)}\n"
+        f"Pairs: {len(SYMBOLS)}\n"
+        f"Timeframe: {ACTIVE_TIMEFRAME}\n"
+        f"Last scan: {SCHED_STATS['last_evaluated']} evaluated / {SCHED_STATS['last_skipped']} skipped\n"
+        f"Active: {BOT_ACTIVE}\n"
+        f"Kill: {KILL_SWITCH}"
+    )
 
-            for u in r.get("result", []):
-                offset = u["update_id"] + 1
+def cmd_closeall(arg):
+    for s in list(OPEN_TRADES.keys()):
+        close_trade(s, "MANUAL CLOSE ALL")
+    tg("❌ ALL TRADES CLOSED")
 
-                if "message" not in u:
-                    continue
+def cmd_reset(arg):
+    init_day()
+    tg("🔄 DAILY RESET DONE")
 
-                chat_id = u["message"]["chat"]["id"]
-                if chat_id != TG_ADMIN:
-                    continue
+def cmd_close(arg):
+    sym = arg.upper()
+    if sym in OPEN_TRADES:
+        close_trade(sym, "MANUAL CLOSE")
+    else:
+        tg("⚠️ Symbol not open")
+
+def cmd_tf(arg):
+    global ACTIVE_TIMEFRAME
+    if arg in TIMEFRAMES:
+        was_tick = tick_mode()
+        ACTIVE_TIMEFRAME = arg
+        if tick_mode():
+            tick_mode_on()
+        elif was_tick:
+            tick_mode_off()
+        wake_trader()
+        tg(f"⏱ Timeframe set to {arg}")
+
+COMMANDS = {
+    "/start": cmd_start,
+    "/stop": cmd_stop,
+    "/kill": cmd_kill,
+    "/status": cmd_status,
+    "/closeall": cmd_closeall,
+    "/reset": cmd_reset
+}
 
-                txt = u["message"].get("text", "").lower()
-
-                # =========================
-                # COMMANDS
-                # =========================
-
-                if txt == "/start":
-                    BOT_ACTIVE = True
-                    KILL_SWITCH = False
-                    tg("▶️ BOT STARTED")
-
-                elif txt == "/stop":
-                    BOT_ACTIVE = False
-                    tg("⛔ BOT STOPPED")
-
-                elif txt == "/kill":
-                    KILL_SWITCH = True
-                    tg("🛑 KILL SWITCH ACTIVATED")
-
-                elif txt == "/status":
-                    bal = get_balance()
-                    tg(
-                        f"⚙️ SMART BOT STATUS\n"
-                        f"Mode: {MODE}\n"
-                        f"Balance: {bal}\n"
-                        f"Trades today: {TRADES_TODAY}\n"
-                        f"Open trades: {len(OPEN_TRADES)}\n"
-                        f"Active: {BOT_ACTIVE}\n"
-                        f"Kill: {KILL_SWITCH}"
-                    )
-
-                elif txt == "/closeall":
-                    for s in list(OPEN_TRADES.keys()):
-                        close_trade(s, "MANUAL CLOSE ALL")
-                    tg("❌ ALL TRADES CLOSED")
-
-                elif txt == "/reset":
-                    init_day()
-                    tg("🔄 DAILY RESET DONE")
-
-                elif txt.startswith("/close"):
-                    try:
-                        sym = txt.replace("/close", "").strip().upper()
-                        if sym in OPEN_TRADES:
-                            close_trade(sym, "MANUAL CLOSE")
-                        else:
-                            tg("⚠️ Symbol not open")
-                    except:
-                        pass
+# checked in order after the exact matches
+PREFIX_COMMANDS = [
+    ("/close", cmd_close),
+    ("/tf", cmd_tf)
+]
 
-        except:
-            pass
+# ===============================
+# UPDATE DISPATCH
+# (shared by long-poll and webhook)
+# ===============================
+def handle_update(u):
+    msg = u.get("message")
+    if not msg:
+        return
+    # TG_ADMIN unset (0) owns nothing; a forged chat id 0 must not pass
+    if not TG_ADMIN or msg.get("chat", {}).get("id") != TG_ADMIN:
+        return
+
+    txt = (msg.get("text") or "").strip().lower()
+
+    try:
+        fn = COMMANDS.get(txt)
+        if fn:
+            fn("")
+            return
+        for prefix, fn in PREFIX_COMMANDS:
+            if txt.startswith(prefix):
+                fn(txt[len(prefix):].strip())
+                return
+    except Exception as e:
+        tg(f"⚠️ Command failed: {txt}\n{e}")
+
+def poll_updates(offset):
+    """
+    One getUpdates long-poll; returns the next offset
+    """
+    r = requests.get(
+        f"https://api.telegram.org/bot{TG_TOKEN}/getUpdates",
+        params={"offset": offset, "timeout": 30},
+        timeout=40
+    ).json()
+
+    if not r.get("ok"):
+        # 401 bad token, 404 no token, 409 webhook still set: returns at once
+        raise RuntimeError(f"getUpdates {r.get('error_code')}: {r.get('description')}")
+
+    for u in r.get("result", []):
+        offset = u["update_id"] + 1
+        handle_update(u)
+    return offset
+
+# ===============================
+# TELEGRAM LISTENER
+# ===============================
+def telegram_listener():
+    offset = None
+    tg("🤖 SMART BOT Telegram control connected", low=True)
 
-        time.sleep(5)
+    while True:
+        try:
+            offset = poll_updates(offset)
+        except:
+            # only back off on errors, the long-poll itself already waits
+            time.sleep(5)
 
   # ======================================================
 # SMART BOT – PART 7 : AI TREND FILTER & MULTI-TF SIGNAL
@@ -602,22 +1411,14 @@ import math
 # TIMEFRAMES CONFIG
 # ===============================
 TIMEFRAMES = ["1", "5", "15", "60", "240"]  # 1m,5m,15m,1h,4h
+AI_TIMEFRAMES = TIMEFRAMES  # part 9 reuses the TIMEFRAMES name for its dict
 TREND_CONFIRMATION = 3  # how many TFs must agree
 
 # ===============================
 # CANDLE DATA
 # ===============================
 def get_candles(symbol, tf="15", limit=100):
-    try:
-        r = session.get_kline(
-            category="linear",
-            symbol=symbol,
-            interval=tf,
-            limit=limit
-        )
-        return r["result"]["list"]
-    except:
-        return []
+    return fetch_klines(symbol, tf, limit)
 
 # ===============================
 # SIMPLE AI TREND MODEL
@@ -647,17 +1448,26 @@ def ai_trend_score(closes):
 # MULTI TF SIGNAL
 # ===============================
 def ai_signal(symbol):
-    bull = 0
-    bear = 0
+    scores = []
 
-    for tf in TIMEFRAMES:
+    for tf in AI_TIMEFRAMES:
         candles = get_candles(symbol, tf, 100)
         if not candles:
             continue
 
         closes = [float(c[4]) for c in candles][::-1]
-        score = ai_trend_score(closes)
+        scores.append(ai_trend_score(closes))
+
+    return mtf_rules(scores)
+
+def mtf_rules(scores):
+    """
+    Multi-TF vote of ai_signal on per-timeframe trend scores
+    """
+    bull = 0
+    bear = 0
 
+    for score in scores:
         if score > 0:
             bull += 1
         else:
@@ -686,24 +1496,83 @@ TRAIL_STEP = 0.003       # trail distance 0.3%
 # PRICE
 # ===============================
 def get_price(symbol):
+    # streamed ticker table (part 10), bulk snapshot (part 11), then REST
+    price = live_price(symbol) or snapshot_price(symbol)
+    if price:
+        return price
     try:
         r = session.get_tickers(category="linear", symbol=symbol)
         return float(r["result"]["list"][0]["lastPrice"])
     except:
+        count_error("get_price")
         return None
 
 # ===============================
 # REGISTER TRADE
 # ===============================
-def register_trade(symbol, side, entry, qty):
-    OPEN_TRADES[symbol] = {
-        "side": side,
-        "entry": entry,
-        "qty": qty,
-        "sl": entry * (1 - STOP_LOSS_PCT if side == "BUY" else 1 + STOP_LOSS_PCT),
-        "tp": entry * (1 + TAKE_PROFIT_PCT if side == "BUY" else 1 - TAKE_PROFIT_PCT),
-        "trail_active": False
-    }
+def new_position(side, entry, qty, symbol=None):
+    side = side.upper()
+    return Position(
+        symbol=symbol,
+        side=side,
+        entry=entry,
+        qty=qty,
+        sl=entry * (1 - STOP_LOSS_PCT if side == "BUY" else 1 + STOP_LOSS_PCT),
+        tp=entry * (1 + TAKE_PROFIT_PCT if side == "BUY" else 1 - TAKE_PROFIT_PCT)
+    )
+
+def order_side(side):
+    """
+    Signals and positions say BUY / SELL; bybit v5 orders want Buy / Sell
+    """
+    return side.capitalize()
+
+def register_trade(symbol, side, entry, qty, native=False):
+    # native: bybit already holds the exits, the trigger book stays out of it
+    OPEN_TRADES.put(new_position(side, entry, qty, symbol).replace(native=native))
+    index_trade(symbol)
+
+# ===============================
+# EXIT RULES
+# ===============================
+def exit_rules(t, price):
+    """
+    SL / TP / trailing on one price update. Moves the trailing stop in t
+    and returns the exit reason, or None to keep the position.
+    t must be a private Position (backtests); the live store is driven
+    by the trigger book.
+    """
+    # STOP LOSS
+    if t.side == "BUY" and price <= t.sl:
+        return "STOP LOSS"
+    elif t.side == "SELL" and price >= t.sl:
+        return "STOP LOSS"
+
+    # TAKE PROFIT
+    if t.side == "BUY" and price >= t.tp:
+        return "TAKE PROFIT"
+    elif t.side == "SELL" and price <= t.tp:
+        return "TAKE PROFIT"
+
+    # TRAILING START
+    if not t.trail_active:
+        if t.side == "BUY" and price >= t.entry * (1 + TRAIL_START):
+            t.trail_active = True
+        elif t.side == "SELL" and price <= t.entry * (1 - TRAIL_START):
+            t.trail_active = True
+
+    # TRAILING MOVE
+    if t.trail_active:
+        if t.side == "BUY":
+            new_sl = price * (1 - TRAIL_STEP)
+            if new_sl > t.sl:
+                t.sl = new_sl
+        else:
+            new_sl = price * (1 + TRAIL_STEP)
+            if new_sl < t.sl:
+                t.sl = new_sl
+
+    return None
 
 # ===============================
 # CLOSE TRADE
@@ -714,75 +1583,61 @@ def close_trade(symbol, reason="exit"):
         if not trade:
             return
 
-        side = "SELL" if trade["side"] == "BUY" else "BUY"
+        side = "SELL" if trade.side == "BUY" else "BUY"
 
         session.place_order(
             category="linear",
             symbol=symbol,
-            side=side,
+            side=order_side(side),
             orderType="Market",
-            qty=trade["qty"],
+            qty=trade.qty,
             timeInForce="IOC",
             reduceOnly=True
         )
 
         tg(f"❌ CLOSED {symbol} | {reason}")
-        del OPEN_TRADES[symbol]
+        OPEN_TRADES.pop(symbol)
+        unindex_trade(symbol)
+        invalidate_account()
 
     except:
-        pass
+        count_error("close_trade")
 
 # ===============================
 # TRADE MONITOR
 # ===============================
-def manage_trades():
-    while True:
-        try:
-            for symbol in list(OPEN_TRADES.keys()):
-                t = OPEN_TRADES[symbol]
-                price = get_price(symbol)
-                if not price:
-                    continue
+def manage_cycle():
+    """
+    One pass over the open positions
+    """
+    t0 = time.perf_counter()
+    try:
+        _manage_cycle()
+    finally:
+        observe("manage_cycle_seconds", (), time.perf_counter() - t0)
+
+def _manage_cycle():
+    if reconcile_due():
+        reconcile_positions()
+
+    # native positions exit on the exchange; the rest sit in the trigger
+    # book, which the stream evaluates on every tick. This pass is the
+    # fallback for symbols without a live price.
+    watched = [s for s in sync_books() if not live_price(s)]
+    if not watched:
+        return
 
-                # STOP LOSS
-                if t["side"] == "BUY" and price <= t["sl"]:
-                    close_trade(symbol, "STOP LOSS")
-                elif t["side"] == "SELL" and price >= t["sl"]:
-                    close_trade(symbol, "STOP LOSS")
-
-                # TAKE PROFIT
-                if t["side"] == "BUY" and price >= t["tp"]:
-                    close_trade(symbol, "TAKE PROFIT")
-                elif t["side"] == "SELL" and price <= t["tp"]:
-                    close_trade(symbol, "TAKE PROFIT")
-
-                # TRAILING START
-                if not t["trail_active"]:
-                    if t["side"] == "BUY" and price >= t["entry"] * (1 + TRAIL_START):
-                        t["trail_active"] = True
-                    elif t["side"] == "SELL" and price <= t["entry"] * (1 - TRAIL_START):
-                        t["trail_active"] = True
-
-                # TRAILING MOVE
-                if t["trail_active"]:
-                    if t["side"] == "BUY":
-                        new_sl = price * (1 - TRAIL_STEP)
-                        if new_sl > t["sl"]:
-                            t["sl"] = new_sl
-                    else:
-                        new_sl = price * (1 + TRAIL_STEP)
-                        if new_sl < t["sl"]:
-                            t["sl"] = new_sl
+    with priority(PRIO_EXIT):
+        prime_prices(watched)
 
-        except:
-            pass
+        for symbol in watched:
+            price = get_price(symbol)
+            if not price:
+                continue
 
-        time.sleep(3)
+            for key, reason in check_triggers(symbol, price):
+                exit_trade(key, reason)
 
-# ===============================
-# START TRADE MANAGER
-# ===============================
-threading.Thread(target=manage_trades, daemon=True).start()
 # ======================================================
 # SMART BOT – PART 9 : MASTER ENGINE (FINAL)
 # ======================================================
@@ -824,24 +1679,27 @@ ACTIVE_TIMEFRAME = "1m"
 # ===============================
 def ai_trend(symbol):
     try:
-        k = session.get_kline(
-            category="linear",
-            symbol=symbol,
-            interval=1,
-            limit=20
-        )["result"]["list"]
+        if tick_mode():
+            return tick_trend(symbol, TICK_TFS[ACTIVE_TIMEFRAME])
 
-        closes = [float(c[4]) for c in k]
-        sma_fast = sum(closes[-5:]) / 5
-        sma_slow = sum(closes) / len(closes)
+        k = fetch_klines(symbol, "1", 21)
 
-        if sma_fast > sma_slow:
-            return "BUY"
-        else:
-            return "SELL"
+        sma_fast = indicator(symbol, "1", "sma", 5, k)
+        sma_slow = indicator(symbol, "1", "sma", 20)
+        if sma_fast is None or sma_slow is None:
+            return None
+
+        return trend_rules(sma_fast, sma_slow)
     except:
+        count_error("ai_trend")
         return None
 
+def trend_rules(sma_fast, sma_slow):
+    if sma_fast > sma_slow:
+        return "BUY"
+    else:
+        return "SELL"
+
 # ===============================
 # SMART SIGNAL
 # ===============================
@@ -860,130 +1718,2881 @@ def open_trade(symbol, side):
     if symbol in OPEN_TRADES:
         return
 
+    started = time.perf_counter()
     try:
-        bal = get_balance()
+        bal = get_balance(fresh=True)
         risk = bal * RISK_PER_TRADE
 
         price = get_price(symbol)
-        qty = round(risk / price, 3)
+        qty = preflight(symbol, risk / price, price)
+        if not qty:
+            return
 
-        session.set_leverage(
+        ensure_leverage(symbol)
+
+        session.place_order(
             category="linear",
             symbol=symbol,
-            buyLeverage=LEVERAGE,
-            sellLeverage=LEVERAGE
+            side=order_side(side),
+            orderType="Market",
+            qty=qty,
+            timeInForce="IOC",
+            **exit_params(symbol, side, price)
         )
 
-        session.place_order(
+        native = exchange_exits()
+        register_trade(symbol, side, price, float(qty), native=native)
+        if native and not attach_trailing(symbol):
+            # trailing stays client-side: only now does the book watch it
+            OPEN_TRADES.update(symbol, native=False)
+            index_trade(symbol)
+        TRADES_TODAY += 1
+        invalidate_account()
+
+        tg(f"📈 OPEN {side} {symbol} | {price}")
+        observe("order_latency_seconds", (), time.perf_counter() - started)
+
+    except:
+        count_error("open_trade")
+        forget_leverage(symbol)
+
+# ===============================
+# TELEGRAM COMMAND CENTER
+# ===============================
+import secrets
+
+TG_WEBHOOK_URL = os.getenv("TG_WEBHOOK_URL")  # e.g. https://yourbot.onrender.com/tg/webhook
+# never empty: without one anyone reaching /tg/webhook could post commands
+TG_WEBHOOK_SECRET = os.getenv("TG_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+TG_WEBHOOK_ACTIVE = False  # mini_app refuses updates unless set_webhook succeeded
+
+def set_webhook():
+    try:
+        r = requests.post(
+            f"https://api.telegram.org/bot{TG_TOKEN}/setWebhook",
+            data={
+                "url": TG_WEBHOOK_URL,
+                "secret_token": TG_WEBHOOK_SECRET,
+                "allowed_updates": '["message"]'
+            },
+            timeout=10
+        ).json()
+        return r.get("ok", False)
+    except:
+        count_error("set_webhook")
+        return False
+
+def webhook_allowed(token):
+    """
+    mini_app /tg/webhook gate: webhook mode on and Telegram's secret header
+    """
+    return TG_WEBHOOK_ACTIVE and secrets.compare_digest(token or "", TG_WEBHOOK_SECRET)
+
+TG_OFFSET = None  # next getUpdates offset in long-poll mode
+TG_POLL_BACKOFF = {"delay": 0}  # seconds, doubles per failed poll up to TG_POLL_MAX_BACKOFF
+TG_POLL_MAX_BACKOFF = 300
+TG_POLLER = None  # thread running telegram_loop in long-poll mode
+
+def telegram_webhook():
+    """
+    True in webhook mode (TG_WEBHOOK_URL set and registered; updates
+    arrive on mini_app /tg/webhook). Otherwise clears any old webhook
+    so the telegram poller can long-poll.
+    """
+    global TG_WEBHOOK_ACTIVE
+    if TG_WEBHOOK_URL and set_webhook():
+        TG_WEBHOOK_ACTIVE = True
+        tg("🔗 Telegram webhook active", low=True)
+        return True
+    TG_WEBHOOK_ACTIVE = False
+
+    try:
+        # getUpdates is refused while a webhook is registered
+        requests.post(
+            f"https://api.telegram.org/bot{TG_TOKEN}/deleteWebhook",
+            timeout=10
+        )
+    except:
+        count_error("delete_webhook")
+    return False
+
+def telegram_poll():
+    """
+    One long-poll for telegram_loop; returns the backoff before the next
+    """
+    global TG_OFFSET
+    try:
+        TG_OFFSET = poll_updates(TG_OFFSET)
+    except:
+        count_error("telegram_poll")
+        delay = min(max(TG_POLL_BACKOFF["delay"] * 2, 5), TG_POLL_MAX_BACKOFF)
+        TG_POLL_BACKOFF["delay"] = delay
+        return delay
+    TG_POLL_BACKOFF["delay"] = 0
+    return 0
+
+def telegram_loop():
+    """
+    The long-poll on a thread of its own: it waits inside getUpdates most
+    of the time and would otherwise pin a job worker
+    """
+    while True:
+        wait = telegram_poll()
+        if wait:
+            time.sleep(wait)
+
+def start_telegram_poller():
+    global TG_POLLER
+    with JOB_COND:
+        if TG_POLLER is None:
+            TG_POLLER = start_thread(telegram_loop, "telegram")
+    return TG_POLLER
+
+# ===============================
+# MASTER TRADER LOOP
+# ===============================
+def trader_cycle():
+    """
+    One trader job pass; returns the seconds to wait before the next
+    """
+    t0 = time.perf_counter()
+    try:
+        return _trader_cycle()
+    finally:
+        observe("scan_cycle_seconds", (), time.perf_counter() - t0)
+
+def _trader_cycle():
+    if not BOT_ACTIVE or KILL_SWITCH:
+        return 5
+
+    if TRADES_TODAY >= MAX_TRADES:
+        return 30
+
+    if tick_mode():
+        return 1  # signals run on tick bar closes (part 22)
+
+    prime_prices(SYMBOLS)
+    try:
+        # only symbols with a new closed candle are evaluated (part 23)
+        for sym, sig in scan_fresh(SYMBOLS):
+            if KILL_SWITCH or not BOT_ACTIVE:
+                break
+
+            open_trade(sym, sig)
+    finally:
+        release_prices()
+
+    return next_scan_wait()
+
+# ======================================================
+# SMART BOT – PART 10 : MARKET STREAM (WEBSOCKET)
+# ======================================================
+
+import json
+
+websocket = lazy_module("websocket")
+
+# ===============================
+# STREAM CONFIG
+# ===============================
+STREAM_ENABLED = os.getenv("STREAM_ENABLED", "1") == "1"
+STREAM_URL = os.getenv(
+    "BYBIT_WS_URL",
+    "wss://stream-testnet.bybit.com/v5/public/linear" if TESTNET
+    else "wss://stream.bybit.com/v5/public/linear"
+)
+STREAM_INTERVALS = os.getenv("STREAM_INTERVALS", "1").split(",")  # higher TFs come from the resampler
+STREAM_MAX_AGE = 5        # seconds a streamed price stays usable
+STREAM_PING = 20          # bybit drops idle sockets after ~30s
+STREAM_IDLE_TIMEOUT = 60  # reconnect if nothing arrives for this long
+
+# ===============================
+# STREAM STATE
+# ===============================
+LAST_PRICE = {}   # symbol -> (price, received_at), lastPrice of LAST_TICKER parsed once
+LAST_TICKER = {}  # symbol -> merged ticker fields, "_received" = local time of the last delta
+LAST_CANDLE = {}  # (symbol, interval) -> bybit kline row
+STREAM_TOPICS = set()
+STREAM_LOCK = threading.Lock()
+STREAM_WS = None
+STREAM_STOP = threading.Event()  # ends market_stream after the current socket closes
+STREAM_STATS = {
+    "connected": False,
+    "messages": 0,
+    "reconnects": 0,
+    "last_message": 0
+}
+
+# ===============================
+# PRICE LOOKUP
+# ===============================
+def live_price(symbol):
+    """
+    Streamed last price, or None when the stream has nothing fresh
+    """
+    p = LAST_PRICE.get(symbol)
+    if p and time.time() - p[1] <= STREAM_MAX_AGE:
+        return p[0]
+    return None
+
+def live_quote(symbol):
+    """
+    Streamed (bid, ask) from the ticker table, or None when stale / absent
+    """
+    t = LAST_TICKER.get(symbol)
+    if not t or time.time() - t.get("_received", 0) > STREAM_MAX_AGE:
+        return None
+    try:
+        bid, ask = float(t["bid1Price"]), float(t["ask1Price"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (bid, ask) if bid > 0 and ask > 0 else None
+
+# ===============================
+# KLINE MERGE
+# ===============================
+def stream_apply_kline(symbol, interval, row):
+    """
+    Pushes a streamed candle into the kline cache so readers skip REST
+    """
+    key = (symbol, interval)
+    LAST_CANDLE[key] = row
+    if interval == "1":
+        resample_feed(symbol, [row])
+
+    with KLINE_CACHE_LOCK:
+        entry = KLINE_CACHE.get(key)
+        if not entry:
+            return
+        rows = entry["rows"]
+        head = int(rows[0][0])
+        start = int(row[0])
+
+        if start == head:
+            rows = [row] + rows[1:]
+        elif start == head + INTERVAL_SECONDS.get(interval, 60) * 1000:
+            rows = ([row] + rows)[:entry["limit"]]
+        else:
+            # gap in the stream: let the entry expire and refetch
+            return
+
+        entry["rows"] = rows
+        entry["expires"] = candle_expiry(rows, interval)
+
+# ===============================
+# MESSAGE HANDLERS
+# ===============================
+def on_stream_message(ws, message):
+    try:
+        msg = json.loads(message)
+    except ValueError:
+        return
+
+    now = time.time()
+    STREAM_STATS["messages"] += 1
+    STREAM_STATS["last_message"] = now
+
+    topic = msg.get("topic", "")
+    data = msg.get("data")
+    if not topic or data is None:
+        return
+
+    if topic.startswith("tickers."):
+        symbol = data.get("symbol") or topic.split(".", 1)[1]
+        t = LAST_TICKER.setdefault(symbol, {})
+        t.update(data)  # deltas only carry changed fields
+        t["_received"] = now
+        if "lastPrice" in data:
+            try:
+                LAST_PRICE[symbol] = (float(data["lastPrice"]), now)
+            except (TypeError, ValueError):
+                pass
+            else:
+                if symbol in TRIGGER_BOOKS:
+                    on_trigger_price(symbol, LAST_PRICE[symbol][0])
+
+    elif topic.startswith("publicTrade."):
+        on_trade_message(topic.split(".", 1)[1], msg, now)
+
+    elif topic.startswith("kline."):
+        _, interval, symbol = topic.split(".", 2)
+        for k in data:
+            row = [
+                str(k["start"]), k["open"], k["high"], k["low"],
+                k["close"], k["volume"], k["turnover"]
+            ]
+            stream_apply_kline(symbol, interval, row)
+
+def on_stream_open(ws):
+    STREAM_STATS["connected"] = True
+    STREAM_STATS["last_message"] = time.time()
+    with STREAM_LOCK:
+        topics = sorted(STREAM_TOPICS)
+    send_subscribe(ws, topics)
+
+def on_stream_close(ws, *args):
+    STREAM_STATS["connected"] = False
+
+def on_stream_error(ws, error):
+    STREAM_STATS["connected"] = False
+
+# ===============================
+# SUBSCRIPTIONS
+# ===============================
+def send_subscribe(ws, topics, op="subscribe"):
+    # bybit caps the args of one request, so send in batches
+    for i in range(0, len(topics), 10):
+        try:
+            ws.send(json.dumps({"op": op, "args": topics[i:i + 10]}))
+        except Exception:
+            return
+
+def stream_topics(symbol):
+    topics = [f"tickers.{symbol}"] + [f"kline.{i}.{symbol}" for i in STREAM_INTERVALS]
+    if tick_mode():
+        topics.append(f"publicTrade.{symbol}")
+    return topics
+
+def stream_subscribe(symbols):
+    """
+    Adds symbols to the stream; they are resubscribed on every reconnect
+    """
+    new = []
+    with STREAM_LOCK:
+        for s in symbols:
+            for topic in stream_topics(s):
+                if topic not in STREAM_TOPICS:
+                    STREAM_TOPICS.add(topic)
+                    new.append(topic)
+
+    ws = STREAM_WS
+    if new and ws is not None and STREAM_STATS["connected"]:
+        send_subscribe(ws, new)
+
+def stream_unsubscribe(prefix):
+    """
+    Drops every topic starting with prefix, now and on later reconnects
+    """
+    with STREAM_LOCK:
+        gone = sorted(t for t in STREAM_TOPICS if t.startswith(prefix))
+        STREAM_TOPICS.difference_update(gone)
+
+    ws = STREAM_WS
+    if gone and ws is not None and STREAM_STATS["connected"]:
+        send_subscribe(ws, gone, "unsubscribe")
+    return gone
+
+# ===============================
+# HEARTBEAT
+# ===============================
+def stream_heartbeat():
+    """
+    Scheduler job (every STREAM_PING): pings the live socket, closes it
+    when idle so market_stream reconnects
+    """
+    ws = STREAM_WS
+    if ws is None or not STREAM_STATS["connected"]:
+        return
+    if time.time() - STREAM_STATS["last_message"] > STREAM_IDLE_TIMEOUT:
+        ws.close()
+        return
+    try:
+        ws.send(json.dumps({"op": "ping"}))
+    except Exception:
+        pass
+
+# ===============================
+# STREAM LOOP
+# ===============================
+def market_stream(symbols=None):
+    """
+    Keeps the public websocket alive, reconnecting with backoff
+    """
+    global STREAM_WS
+
+    stream_subscribe(symbols or SYMBOLS)
+    backoff = 1
+
+    while not STREAM_STOP.is_set():
+        ws = websocket.WebSocketApp(
+            STREAM_URL,
+            on_open=on_stream_open,
+            on_message=on_stream_message,
+            on_close=on_stream_close,
+            on_error=on_stream_error
+        )
+        STREAM_WS = ws
+
+        started = time.time()
+        try:
+            ws.run_forever()
+        except Exception:
+            pass
+
+        STREAM_STATS["connected"] = False
+        STREAM_STATS["reconnects"] += 1
+
+        # a connection that lived a while resets the backoff
+        if time.time() - started > 60:
+            backoff = 1
+        STREAM_STOP.wait(backoff)
+        backoff = min(backoff * 2, 30)
+
+# ======================================================
+# SMART BOT – PART 11 : BULK TICKER SNAPSHOT
+# ======================================================
+
+from collections import namedtuple
+
+# ===============================
+# SNAPSHOT CONFIG
+# ===============================
+Ticker = namedtuple("Ticker", "last bid ask volume24h change")
+
+# the snapshot belongs to one trader cycle: taken at its start, dropped at
+# its end; the TTL only bounds a cycle that runs unusually long
+TICKER_SNAPSHOT_TTL = 30
+TICKER_SNAPSHOT = {"ts": 0, "data": {}}
+TICKER_LOCK = threading.Lock()
+
+# ===============================
+# FETCH WHOLE UNIVERSE
+# ===============================
+def _f(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+def refresh_tickers():
+    """
+    One get_tickers call for every linear symbol, indexed by symbol
+    """
+    global TICKER_SNAPSHOT
+
+    try:
+        r = session.get_tickers(category="linear")
+        rows = r["result"]["list"]
+    except:
+        count_error("refresh_tickers")
+        return TICKER_SNAPSHOT["data"]
+
+    data = {
+        t["symbol"]: Ticker(
+            _f(t.get("lastPrice")),
+            _f(t.get("bid1Price")),
+            _f(t.get("ask1Price")),
+            _f(t.get("volume24h")),
+            _f(t.get("price24hPcnt"))
+        )
+        for t in rows
+    }
+
+    # swap the whole dict so readers never see a half-built index
+    TICKER_SNAPSHOT = {"ts": time.time(), "data": data}
+    return data
+
+def ticker_snapshot(max_age=TICKER_SNAPSHOT_TTL):
+    """
+    Shared index for the current cycle, refreshed at most once per max_age
+    """
+    if time.time() - TICKER_SNAPSHOT["ts"] <= max_age:
+        return TICKER_SNAPSHOT["data"]
+
+    with TICKER_LOCK:
+        # another thread may have refreshed while we waited
+        if time.time() - TICKER_SNAPSHOT["ts"] <= max_age:
+            return TICKER_SNAPSHOT["data"]
+        return refresh_tickers()
+
+def snapshot_price(symbol):
+    """
+    Last price from the current snapshot, or None if it is stale
+    """
+    snap = TICKER_SNAPSHOT
+    if time.time() - snap["ts"] > TICKER_SNAPSHOT_TTL:
+        return None
+    t = snap["data"].get(symbol)
+    return t.last if t and t.last > 0 else None
+
+def get_quote(symbol):
+    """
+    (bid, ask): streamed ticker table first, then the bulk snapshot,
+    then one REST call
+    """
+    q = live_quote(symbol)
+    if q:
+        return q
+    snap = TICKER_SNAPSHOT
+    t = snap["data"].get(symbol)
+    if t and t.bid > 0 and t.ask > 0 and time.time() - snap["ts"] <= TICKER_SNAPSHOT_TTL:
+        return (t.bid, t.ask)
+    try:
+        r = session.get_tickers(category="linear", symbol=symbol)
+        t = r["result"]["list"][0]
+        return (float(t["bid1Price"]), float(t["ask1Price"]))
+    except:
+        count_error("get_quote")
+        return None
+
+def prime_prices(symbols):
+    """
+    Start of a cycle: one bulk call unless the stream already covers everything
+    """
+    if any(live_price(s) is None for s in symbols):
+        ticker_snapshot()
+
+def release_prices():
+    """
+    End of a cycle: later readers go to the stream or REST, never to a
+    snapshot left over from a previous cycle
+    """
+    global TICKER_SNAPSHOT
+    TICKER_SNAPSHOT = {"ts": 0, "data": {}}
+
+# ======================================================
+# SMART BOT – PART 12 : STREAMING INDICATOR ENGINE
+# ======================================================
+
+# ===============================
+# ENGINE STATE
+# ===============================
+IND_HISTORY = 500  # closes kept per series to seed late indicators
+IND_SERIES = {}    # (symbol, tf) -> {"last_ts", "closes", "ind"}
+IND_LOCK = threading.Lock()
+
+# ===============================
+# O(1) UPDATE RULES
+# ===============================
+def _new_state(name, period):
+    if name == "ema":
+        return {"n": 0, "sum": 0.0, "value": None}
+    if name == "rsi":
+        return {"n": 0, "prev": None, "gain": 0.0, "loss": 0.0, "value": None}
+    if name == "sma":
+        return {"win": deque(maxlen=period), "value": None}
+    raise ValueError(f"unknown indicator {name}")
+
+def _step(name, period, st, x):
+    if name == "ema":
+        # seeded with the SMA of the first period closes, same as ema()
+        st["n"] += 1
+        if st["n"] <= period:
+            st["sum"] += x
+            if st["n"] == period:
+                st["value"] = st["sum"] / period
+        else:
+            k = 2 / (period + 1)
+            st["value"] = x * k + st["value"] * (1 - k)
+
+    elif name == "rsi":
+        # Wilder smoothing
+        if st["prev"] is None:
+            st["prev"] = x
+            return
+        diff = x - st["prev"]
+        st["prev"] = x
+        st["n"] += 1
+        g = diff if diff > 0 else 0.0
+        l = -diff if diff < 0 else 0.0
+        if st["n"] <= period:
+            st["gain"] += g
+            st["loss"] += l
+            if st["n"] < period:
+                return
+            st["gain"] /= period
+            st["loss"] /= period
+        else:
+            st["gain"] = (st["gain"] * (period - 1) + g) / period
+            st["loss"] = (st["loss"] * (period - 1) + l) / period
+        if st["loss"] == 0:
+            st["value"] = 100.0
+        else:
+            st["value"] = 100 - (100 / (1 + st["gain"] / st["loss"]))
+
+    elif name == "sma":
+        st["win"].append(x)
+        if len(st["win"]) == period:
+            st["value"] = sum(st["win"]) / period
+
+# ===============================
+# BATCH RSI
+# (runs the engine's own update rule; the independent parity reference
+#  lives in tests/test_indicators.py)
+# ===============================
+def rsi_wilder(closes, period=14):
+    """
+    Wilder RSI over chronological closes in one pass
+    """
+    st = _new_state("rsi", period)
+    for x in closes:
+        _step("rsi", period, st, x)
+    return st["value"]
+
+# ===============================
+# SERIES UPDATE
+# ===============================
+def _new_series():
+    return {"last_ts": 0, "closes": deque(maxlen=IND_HISTORY), "ind": {}}
+
+def update_series(symbol, tf, rows):
+    """
+    Feeds closed candles from bybit rows (newest first) that the engine
+    has not seen yet. The forming candle is ignored.
+    """
+    tf = str(tf)
+    key = (symbol, tf)
+    step = INTERVAL_SECONDS.get(tf, 60) * 1000
+    now_ms = time.time() * 1000
+
+    with IND_LOCK:
+        s = IND_SERIES.get(key)
+        if s is None:
+            s = IND_SERIES[key] = _new_series()
+
+        new = []
+        for r in rows:
+            ts = int(r[0])
+            if ts + step > now_ms:
+                continue  # still forming
+            if ts <= s["last_ts"]:
+                break
+            new.append(r)
+
+        if not new:
+            return
+
+        new.reverse()
+        if s["last_ts"] and int(new[0][0]) != s["last_ts"] + step:
+            # missed candles: rebuild from the full closed window
+            s = IND_SERIES[key] = _new_series()
+            new = [r for r in reversed(rows) if int(r[0]) + step <= now_ms]
+
+        inds = list(s["ind"].items())
+        for r in new:
+            x = float(r[4])
+            s["closes"].append(x)
+            for (name, period), st in inds:
+                _step(name, period, st, x)
+        s["last_ts"] = int(new[-1][0])
+
+def indicator(symbol, tf, name, period, rows=None):
+    """
+    Current value of an indicator on closed candles (None until warmed up)
+    """
+    tf = str(tf)
+    if rows is not None:
+        newest = int(rows[0][0]) if rows else None
+        if not (KLINE_STORE and store_series(symbol, tf, newest)):
+            update_series(symbol, tf, rows)
+
+    with IND_LOCK:
+        s = IND_SERIES.get((symbol, tf))
+        if s is None:
+            return None
+        st = s["ind"].get((name, period))
+        if st is None:
+            # first use: replay the kept history once
+            st = s["ind"][(name, period)] = _new_state(name, period)
+            for x in s["closes"]:
+                _step(name, period, st, x)
+        return st["value"]
+
+# ======================================================
+# SMART BOT – PART 13 : VECTORIZED SIGNALS (NUMPY)
+# ======================================================
+
+np = lazy_module("numpy")  # None -> falls back to the per-symbol path
+
+# opt-in: the incremental engine (part 12) stays the default path,
+# bench.py signals.* compares the two on the same universe
+BATCH_SIGNALS = os.getenv("BATCH_SIGNALS", "0") == "1" and np is not None
+BATCH_TF = "1"    # smart_signal runs on 1m candles
+BATCH_BARS = 20   # the slow SMA of trend_rules
+
+# rows persist between scans; a symbol is re-parsed only when its candles move
+BATCH_MATRIX = {"index": {}, "x": None, "ts": []}  # symbol -> row, closes, newest closed ts
+BATCH_LOCK = threading.Lock()
+
+# ===============================
+# STACK CLOSES (SYMBOLS x BARS)
+# ===============================
+def _batch_row(sym, bars):
+    m = BATCH_MATRIX
+    i = m["index"].get(sym)
+    if i is not None:
+        return i
+    i = len(m["index"])
+    if m["x"] is None or i == len(m["x"]):
+        x = np.zeros((max(64, 2 * i), bars))
+        if m["x"] is not None:
+            x[:i] = m["x"]
+        m["x"] = x
+    m["index"][sym] = i
+    m["ts"].append(-1)
+    return i
+
+def stack_closes(symbols, tf=BATCH_TF, bars=BATCH_BARS):
+    """
+    Closed candles for every symbol as one 2-D array, oldest bar first.
+    Symbols without enough history are left out of the matrix. An
+    unchanged symbol costs one timestamp compare, a new candle shifts
+    its row by one; only gaps re-parse the window.
+    """
+    step = INTERVAL_SECONDS.get(tf, 60) * 1000
+    now_ms = time.time() * 1000
+    kept, idx = [], []
+
+    with BATCH_LOCK:
+        for sym in symbols:
+            k = fetch_klines(sym, tf, bars + 1)
+            j = 0 if k and int(k[0][0]) + step <= now_ms else 1  # skip the forming candle
+            if len(k) < j + bars:
+                continue
+            ts = int(k[j][0])
+            i = _batch_row(sym, bars)
+            x, seen = BATCH_MATRIX["x"], BATCH_MATRIX["ts"]
+            last = seen[i]
+            if ts != last:
+                if ts == last + step:
+                    x[i, :-1] = x[i, 1:]
+                    x[i, -1] = float(k[j][4])
+                else:
+                    x[i] = [float(c[4]) for c in reversed(k[j:j + bars])]
+                seen[i] = ts
+            kept.append(sym)
+            idx.append(i)
+
+        if not idx:
+            return kept, np.empty((0, bars))
+        return kept, BATCH_MATRIX["x"][idx]
+
+# ===============================
+# VECTORIZED INDICATORS
+# ===============================
+def batch_indicators(x):
+    """
+    trend_rules inputs for the whole universe in two array passes
+    """
+    return {
+        "sma_fast": x[:, -5:].mean(axis=1),
+        "sma_slow": x[:, -20:].mean(axis=1)
+    }
+
+# ===============================
+# SIGNAL VECTOR
+# ===============================
+def batch_signals(symbols):
+    """
+    smart_signal for the whole list in a few array passes.
+    Returns one entry per input symbol ("BUY" / "SELL" / None).
+    """
+    unique = list(dict.fromkeys(symbols))
+    kept, x = stack_closes(unique)
+    if not kept:
+        return [None] * len(symbols)
+
+    ind = batch_indicators(x)
+    sig = np.where(ind["sma_fast"] > ind["sma_slow"], "BUY", "SELL")
+    by_symbol = dict(zip(kept, sig.tolist()))
+    return [by_symbol.get(s) for s in symbols]
+
+# ======================================================
+# SMART BOT – PART 14 : CONCURRENT SCANNER
+# ======================================================
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# ===============================
+# SCAN CONFIG
+# ===============================
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "8"))
+SCAN_POOL = None
+SCAN_POOL_LOCK = threading.Lock()
+SCAN_STATS = {
+    "scans": 0,
+    "cancelled": 0,
+    "symbols": 0,
+    "last_ms": 0.0,
+    "max_ms": 0.0
+}
+
+def scan_pool():
+    global SCAN_POOL
+    with SCAN_POOL_LOCK:
+        if SCAN_POOL is None:
+            SCAN_POOL = ThreadPoolExecutor(
+                max_workers=SCAN_WORKERS,
+                thread_name_prefix="scan"
+            )
+        return SCAN_POOL
+
+def scan_halted():
+    return KILL_SWITCH or not BOT_ACTIVE
+
+# ===============================
+# ORDERED PARALLEL MAP
+# ===============================
+def _scan_one(fn, symbol, failed=None):
+    if scan_halted():
+        return None
+    try:
+        return fn(symbol)
+    except Exception:
+        count_error("scan")
+        if failed is not None:
+            failed.add(symbol)
+        return None
+
+def scan_symbols(symbols, fn, failed=None):
+    """
+    Runs fn over symbols on the worker pool and returns results in input
+    order. Duplicates are evaluated once. Pending work is dropped as soon
+    as the kill switch flips. Symbols whose fn raised are added to failed.
+    """
+    started = time.perf_counter()
+    unique = list(dict.fromkeys(symbols))
+    pool = scan_pool()
+    futures = [pool.submit(_scan_one, fn, s, failed) for s in unique]
+    results = {}
+    cancelled = False
+
+    for sym, f in zip(unique, futures):
+        while sym not in results:
+            if scan_halted():
+                cancelled = True
+                break
+            try:
+                results[sym] = f.result(timeout=0.1)
+            except FutureTimeout:
+                continue
+            except Exception:
+                results[sym] = None
+                if failed is not None:
+                    failed.add(sym)
+        if cancelled:
+            break
+
+    if cancelled:
+        for f in futures:
+            f.cancel()
+        SCAN_STATS["cancelled"] += 1
+
+    ms = (time.perf_counter() - started) * 1000
+    SCAN_STATS["scans"] += 1
+    SCAN_STATS["symbols"] = len(unique)
+    SCAN_STATS["last_ms"] = ms
+    SCAN_STATS["max_ms"] = max(SCAN_STATS["max_ms"], ms)
+
+    return [results.get(s) for s in symbols]
+
+# ===============================
+# SCAN STAGE
+# ===============================
+def _timed_signal(symbol):
+    # evaluation only: cache warmers and memo keys run through scan_symbols too
+    t0 = time.perf_counter()
+    try:
+        return smart_signal(symbol)
+    finally:
+        observe("scan_symbol_seconds", (), time.perf_counter() - t0)
+
+def _prefetch_batch(symbol):
+    return fetch_klines(symbol, BATCH_TF, BATCH_BARS + 1)
+
+def scan_signals(symbols, failed=None):
+    """
+    One signal per symbol for the trader job, fetched concurrently
+    """
+    if not BATCH_SIGNALS:
+        return scan_symbols(symbols, _timed_signal, failed)
+
+    # fetch only what the kline cache cannot serve, then one vectorized pass
+    stale = [s for s in symbols if not kline_cached(s, BATCH_TF, BATCH_BARS + 1)]
+    if stale:
+        scan_symbols(stale, _prefetch_batch, failed)
+    if scan_halted():
+        return [None] * len(symbols)
+    return batch_signals(symbols)
+
+# ======================================================
+# SMART BOT – PART 15 : LOCAL KLINE STORE (MMAP COLUMNS)
+# ======================================================
+
+import mmap
+from array import array
+
+# ===============================
+# STORE CONFIG
+# ===============================
+# opt-in: the live bot reads REST unless a writable store dir is wanted
+KLINE_STORE = os.getenv("KLINE_STORE", "0") == "1"
+KLINE_STORE_DIR = os.getenv("KLINE_STORE_DIR", "data/klines")
+STORE_BOOTSTRAP = 1000  # candles pulled for a symbol seen for the first time
+STORE_PAGE = 1000       # bybit get_kline maximum
+STORE_RETRY = 30        # s before syncing again after the exchange was unreachable
+STORE_OFFLINE = {"until": 0.0}
+
+# one fixed-width file per column: int64 timestamps, float64 prices
+STORE_COLUMNS = (
+    ("ts", "q"),
+    ("open", "d"),
+    ("high", "d"),
+    ("low", "d"),
+    ("close", "d"),
+    ("volume", "d")
+)
+
+STORE_MAPS = {}   # (symbol, interval) -> (rows, {column: memoryview})
+STORE_LOCKS = {}
+STORE_GUARD = threading.Lock()
+
+def store_dir(symbol, interval):
+    return os.path.join(KLINE_STORE_DIR, symbol, str(interval))
+
+def store_lock(key):
+    with STORE_GUARD:
+        lock = STORE_LOCKS.get(key)
+        if lock is None:
+            lock = STORE_LOCKS[key] = threading.Lock()
+        return lock
+
+# ===============================
+# MAPPED READS
+# ===============================
+def _store_len(path):
+    try:
+        return os.path.getsize(os.path.join(path, "ts.bin")) // 8
+    except OSError:
+        return 0
+
+def store_columns(symbol, interval):
+    """
+    Memory-mapped columns for (symbol, interval) as typed memoryviews.
+    Slices of these are zero-copy windows over the files.
+    """
+    key = (symbol, str(interval))
+    path = store_dir(*key)
+    n = _store_len(path)
+    cached = STORE_MAPS.get(key)
+    if cached and cached[0] == n:
+        return cached[1]
+
+    cols = {}
+    for name, code in STORE_COLUMNS:
+        if n == 0:
+            cols[name] = memoryview(array(code))
+            continue
+        with open(os.path.join(path, f"{name}.bin"), "rb") as f:
+            mm = mmap.mmap(f.fileno(), n * 8, access=mmap.ACCESS_READ)
+        cols[name] = memoryview(mm).cast(code)
+
+    # old maps stay valid for whoever still holds a window into them
+    STORE_MAPS[key] = (n, cols)
+    return cols
+
+def store_range(symbol, interval, start=None, end=None):
+    """
+    Columns restricted to start <= ts < end (ms), without copying
+    """
+    cols = store_columns(symbol, interval)
+    ts = cols["ts"]
+    lo = 0 if start is None else bisect_left(ts, start)
+    hi = len(ts) if end is None else bisect_left(ts, end)
+    return {name: col[lo:hi] for name, col in cols.items()}
+
+def store_closes(symbol, interval, start=None, end=None):
+    """
+    Closes over [start, end) as a zero-copy float view, oldest first
+    """
+    return store_range(symbol, interval, start, end)["close"]
+
+def store_rows(symbol, interval, limit):
+    """
+    Last limit candles in bybit row layout (newest first)
+    """
+    cols = store_columns(symbol, interval)
+    n = len(cols["ts"])
+    rows = []
+    for i in range(n - 1, max(-1, n - 1 - limit), -1):
+        rows.append([
+            str(cols["ts"][i]), cols["open"][i], cols["high"][i],
+            cols["low"][i], cols["close"][i], cols["volume"][i], 0.0
+        ])
+    return rows
+
+# ===============================
+# APPEND (DEDUP ON TIMESTAMP)
+# ===============================
+def store_append(symbol, interval, rows):
+    """
+    Adds bybit rows (any order). Candles older than the last stored one
+    are skipped, an equal timestamp overwrites the last (forming) candle.
+    Returns the number of new candles.
+    """
+    key = (symbol, str(interval))
+    path = store_dir(*key)
+
+    with store_lock(key):
+        os.makedirs(path, exist_ok=True)
+        n = _store_len(path)
+        last = store_columns(*key)["ts"][n - 1] if n else -1
+
+        fresh = {}
+        for r in rows:
+            ts = int(r[0])
+            if ts >= last:
+                fresh[ts] = r
+        if not fresh:
+            return 0
+
+        ordered = [fresh[ts] for ts in sorted(fresh)]
+        overwrite = int(ordered[0][0]) == last
+
+        # ts goes last: its length is what readers trust
+        for i, (name, code) in reversed(list(enumerate(STORE_COLUMNS))):
+            values = array(code, [int(r[0]) if i == 0 else float(r[i]) for r in ordered])
+            with open(os.path.join(path, f"{name}.bin"), "r+b" if n else "wb") as f:
+                f.seek((n - 1) * 8 if overwrite else n * 8)
+                f.write(values.tobytes())
+
+        return len(ordered) - (1 if overwrite else 0)
+
+# ===============================
+# INCREMENTAL SYNC
+# ===============================
+def store_sync(symbol, interval, since=None):
+    """
+    Pulls only the candles missing since the last stored one, page by page.
+    Returns False when the exchange could not be reached.
+    """
+    interval = str(interval)
+    step = INTERVAL_SECONDS.get(interval, 60) * 1000
+    now = int(time.time() * 1000)
+
+    ts = store_columns(symbol, interval)["ts"]
+    if len(ts):
+        start = ts[-1]  # refetch the last one, it may have been forming
+    else:
+        start = since if since is not None else now - STORE_BOOTSTRAP * step
+
+    while start <= now:
+        end = min(now, start + (STORE_PAGE - 1) * step)
+        try:
+            r = session.get_kline(
+                category="linear",
+                symbol=symbol,
+                interval=interval,
+                start=start,
+                end=end,
+                limit=STORE_PAGE
+            )
+            rows = r["result"]["list"]
+        except:
+            count_error("store_sync")
+            return False
+
+        store_append(symbol, interval, rows)
+        start = end + 1
+    return True
+
+def store_fetch(symbol, interval, limit):
+    """
+    Kline cache miss path: top up the store, then read the window locally
+    (works offline on whatever is already stored). None when the store
+    itself fails (disk full, read-only dir): the caller goes to REST.
+    """
+    try:
+        if time.time() >= STORE_OFFLINE["until"]:
+            if not store_sync(symbol, interval):
+                STORE_OFFLINE["until"] = time.time() + STORE_RETRY
+        return store_rows(symbol, interval, limit)
+    except (OSError, ValueError):
+        count_error("kline_store")
+        return None
+
+# ===============================
+# ENGINE FEED
+# ===============================
+def store_series(symbol, tf, newest=None):
+    """
+    Feeds the indicator engine straight from the mapped close column:
+    only closed candles after the last one it saw, no row building or
+    float parsing. False when the store is empty or older than the
+    newest REST candle (newest, ms), so the caller feeds rows instead.
+    """
+    tf = str(tf)
+    key = (symbol, tf)
+    step = INTERVAL_SECONDS.get(tf, 60) * 1000
+    end = int(time.time() * 1000) - step + 1  # ts + step <= now: closed
+
+    with IND_LOCK:
+        try:
+            stored = store_columns(symbol, tf)["ts"]
+        except (OSError, ValueError):
+            count_error("kline_store")
+            return False
+        if not len(stored) or (newest is not None and newest > stored[-1] + step):
+            return False
+
+        s = IND_SERIES.get(key)
+        if s is None:
+            s = IND_SERIES[key] = _new_series()
+
+        cols = store_range(symbol, tf, s["last_ts"] + step if s["last_ts"] else None, end)
+        ts, closes = cols["ts"], cols["close"]
+        if not len(ts):
+            return True
+
+        if s["last_ts"] and ts[0] != s["last_ts"] + step:
+            # hole in the store: rebuild from the kept history length
+            s = IND_SERIES[key] = _new_series()
+            cols = store_range(symbol, tf, None, end)
+            ts, closes = cols["ts"], cols["close"]
+        keep = s["closes"].maxlen
+        closes = closes[max(0, len(closes) - keep):]
+
+        inds = list(s["ind"].items())
+        for x in closes:
+            s["closes"].append(x)
+            for (name, period), st in inds:
+                _step(name, period, st, x)
+        s["last_ts"] = ts[-1]
+    return True
+
+# ===============================
+# FIXTURES / OFFLINE IMPORT
+# ===============================
+def store_import_csv(symbol, interval, path):
+    """
+    Loads a ts,open,high,low,close,volume CSV (same layout as backtest.py)
+    """
+    rows = []
+    with open(path) as f:
+        for line in f:
+            parts = line.strip().split(",")
+            if not parts[0][:1].isdigit():
+                continue
+            rows.append([int(float(parts[0]))] + parts[1:6])
+    return store_append(symbol, interval, rows)
+
+# ======================================================
+# SMART BOT – PART 16 : ORDER PREFLIGHT
+# ======================================================
+
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+# ===============================
+# INSTRUMENT RULES
+# (lot size, tick size, min notional – cached from get_instruments_info)
+# ===============================
+INSTRUMENTS_TTL = 6 * 3600
+LEVERAGE_NOT_MODIFIED = 110043
+
+Instrument = namedtuple(
+    "Instrument",
+    "qty_step min_qty max_qty min_notional tick_size max_leverage"
+)
+
+INSTRUMENTS_RETRY = 60  # s before asking again after a failed load
+INSTRUMENTS = {"ts": 0, "data": {}, "retry": {}}  # retry: symbol or None (full list) -> not before
+INSTRUMENTS_LOCK = threading.Lock()
+LEVERAGE_TTL = 3600  # s; leverage can also be changed in the bybit UI
+LEVERAGE_SET = {}  # symbol -> (leverage bybit already has, set at)
+PREFLIGHT_STATS = {"rejected": 0, "leverage_calls": 0, "leverage_skipped": 0}
+
+def parse_instrument(x):
+    lot = x.get("lotSizeFilter", {})
+    px = x.get("priceFilter", {})
+    lev = x.get("leverageFilter", {})
+    return Instrument(
+        qty_step=Decimal(lot.get("qtyStep") or "0.001"),
+        min_qty=Decimal(lot.get("minOrderQty") or "0"),
+        # market orders have their own, smaller cap
+        max_qty=Decimal(lot.get("maxMktOrderQty") or lot.get("maxOrderQty") or "0"),
+        min_notional=Decimal(lot.get("minNotionalValue") or "0"),
+        tick_size=Decimal(px.get("tickSize") or "0.01"),
+        max_leverage=float(lev.get("maxLeverage") or LEVERAGE)
+    )
+
+def load_instruments(symbol=None):
+    """
+    Pages through linear instruments (or just one symbol) into the cache
+    """
+    data = {}
+    cursor = ""
+    while True:
+        kw = {"category": "linear", "limit": 1000}
+        if symbol:
+            kw["symbol"] = symbol
+        if cursor:
+            kw["cursor"] = cursor
+        try:
+            r = session.get_instruments_info(**kw)
+        except:
+            count_error("load_instruments")
+            with INSTRUMENTS_LOCK:
+                INSTRUMENTS["retry"][symbol] = time.time() + INSTRUMENTS_RETRY
+            return False
+
+        result = r["result"]
+        for x in result["list"]:
+            data[x["symbol"]] = parse_instrument(x)
+        cursor = result.get("nextPageCursor")
+        if symbol or not cursor:
+            break
+
+    with INSTRUMENTS_LOCK:
+        INSTRUMENTS["retry"].pop(symbol, None)
+        if symbol:
+            INSTRUMENTS["data"][symbol] = data.get(symbol)
+        else:
+            INSTRUMENTS["ts"] = time.time()
+            INSTRUMENTS["data"] = data
+    return True
+
+def instrument(symbol):
+    """
+    Cached rules for a symbol, None if bybit does not list it (or could
+    not be asked; failed loads are retried after INSTRUMENTS_RETRY)
+    """
+    now = time.time()
+    retry = INSTRUMENTS["retry"]
+    if now - INSTRUMENTS["ts"] > INSTRUMENTS_TTL and now >= retry.get(None, 0):
+        load_instruments()
+    if symbol not in INSTRUMENTS["data"] and now >= retry.get(symbol, 0):
+        load_instruments(symbol)
+    return INSTRUMENTS["data"].get(symbol)
+
+# ===============================
+# QUANTIZE
+# ===============================
+def quantize_qty(symbol, qty):
+    """
+    Floors qty to the lot step; Decimal, 0 if the symbol is unknown
+    """
+    rules = instrument(symbol)
+    if not rules:
+        return Decimal(0)
+    q = Decimal(str(qty)).quantize(rules.qty_step, rounding=ROUND_DOWN)
+    if rules.max_qty and q > rules.max_qty:
+        q = rules.max_qty
+    return q
+
+def quantize_price(symbol, price, rounding=ROUND_HALF_UP):
+    rules = instrument(symbol)
+    if not rules:
+        return Decimal(str(price))
+    return Decimal(str(price)).quantize(rules.tick_size, rounding=rounding)
+
+def preflight(symbol, qty, price):
+    """
+    Order qty as a bybit-ready string, None when the exchange would reject it
+    """
+    rules = instrument(symbol)
+    if not rules or not price:
+        PREFLIGHT_STATS["rejected"] += 1
+        return None
+
+    q = quantize_qty(symbol, qty)
+    if q <= 0 or q < rules.min_qty or q * Decimal(str(price)) < rules.min_notional:
+        PREFLIGHT_STATS["rejected"] += 1
+        count("order_preflight_rejected_total", (("symbol", symbol),))
+        return None
+    return format(q.normalize(), "f")
+
+# ===============================
+# LEVERAGE STATE
+# ===============================
+def ensure_leverage(symbol, leverage=None):
+    """
+    Sets leverage once per symbol; "not modified" counts as success
+    """
+    leverage = leverage or LEVERAGE
+    rules = instrument(symbol)
+    if rules:
+        leverage = min(leverage, rules.max_leverage)
+
+    known = LEVERAGE_SET.get(symbol)
+    if known and known[0] == leverage and time.time() - known[1] < LEVERAGE_TTL:
+        PREFLIGHT_STATS["leverage_skipped"] += 1
+        return
+
+    PREFLIGHT_STATS["leverage_calls"] += 1
+    try:
+        session.set_leverage(
             category="linear",
             symbol=symbol,
-            side=side,
-            orderType="Market",
-            qty=qty,
-            timeInForce="IOC"
+            buyLeverage=f"{leverage:g}",
+            sellLeverage=f"{leverage:g}"
         )
+    except Exception as e:
+        if getattr(e, "status_code", None) != LEVERAGE_NOT_MODIFIED:
+            raise
+    LEVERAGE_SET[symbol] = (leverage, time.time())
+
+def forget_leverage(symbol):
+    """
+    After a rejected order: the next attempt sets leverage again
+    """
+    LEVERAGE_SET.pop(symbol, None)
+
+# ======================================================
+# SMART BOT – PART 17 : EXCHANGE-SIDE EXITS
+# ======================================================
+
+# ===============================
+# EXIT MODE
+# client   -> the manager job polls prices and closes with market orders
+# exchange -> SL/TP ride on the order, trailing via set_trading_stop;
+#             the manager job only reconciles with get_positions
+# ===============================
+EXIT_MODE = os.getenv("EXIT_MODE", "client")
+EXIT_TRIGGER = os.getenv("EXIT_TRIGGER", "LastPrice")  # LastPrice / MarkPrice / IndexPrice
+RECONCILE_INTERVAL = 15   # seconds between get_positions passes
+RECONCILE_GRACE = 10      # fresh orders may not show up in positions yet
+
+RECONCILE = {"ts": 0, "closed": 0, "runs": 0}
+
+def exchange_exits():
+    return EXIT_MODE == "exchange"
+
+def exit_params(symbol, side, entry):
+    """
+    stopLoss / takeProfit for place_order, same levels as new_position()
+    """
+    if not exchange_exits():
+        return {}
+    t = new_position(side, entry, 0)
+    return {
+        "stopLoss": str(quantize_price(symbol, t.sl)),
+        "takeProfit": str(quantize_price(symbol, t.tp)),
+        "tpslMode": "Full",
+        "slTriggerBy": EXIT_TRIGGER,
+        "tpTriggerBy": EXIT_TRIGGER
+    }
+
+def attach_trailing(symbol):
+    """
+    Hands the trailing stop to bybit. The position is marked native only
+    if this succeeds; otherwise the client rules keep watching it.
+    """
+    t = OPEN_TRADES.get(symbol)
+    if not t:
+        return False
+
+    # bybit trails by a fixed distance: TRAIL_STEP of the activation price
+    if t.side == "BUY":
+        active = t.entry * (1 + TRAIL_START)
+    else:
+        active = t.entry * (1 - TRAIL_START)
+    distance = quantize_price(symbol, active * TRAIL_STEP)
+
+    try:
+        with priority(PRIO_EXIT):
+            session.set_trading_stop(
+                category="linear",
+                symbol=symbol,
+                trailingStop=str(distance),
+                activePrice=str(quantize_price(symbol, active)),
+                positionIdx=0
+            )
+    except:
+        count_error("attach_trailing")
+        return False
+
+    OPEN_TRADES.update(symbol, native=True)
+    unindex_trade(symbol)
+    return True
+
+# ===============================
+# RECONCILIATION
+# ===============================
+def fetch_positions():
+    """
+    symbol -> bybit position for every non-empty linear USDT position,
+    None on error
+    """
+    live = {}
+    cursor = ""
+    while True:
+        kw = {"category": "linear", "settleCoin": "USDT", "limit": 200}
+        if cursor:
+            kw["cursor"] = cursor
+        try:
+            r = session.get_positions(**kw)
+        except:
+            count_error("fetch_positions")
+            return None
+
+        result = r["result"]
+        for p in result["list"]:
+            if float(p.get("size") or 0) > 0:
+                live[p["symbol"]] = p
+        cursor = result.get("nextPageCursor")
+        if not cursor:
+            return live
+
+def reconcile_positions():
+    """
+    Drops native positions bybit has closed and mirrors the trailed stop
+    """
+    with priority(PRIO_ACCOUNT):
+        live = fetch_positions()
+    RECONCILE["ts"] = time.time()
+    if live is None:
+        return False
+    RECONCILE["runs"] += 1
+
+    now = time.time()
+    for symbol, t in OPEN_TRADES.items():
+        if not t.native:
+            continue
+
+        p = live.get(symbol)
+        if p is None:
+            if now - t.opened < RECONCILE_GRACE:
+                continue
+            OPEN_TRADES.pop(symbol, None)
+            unindex_trade(symbol)
+            RECONCILE["closed"] += 1
+            invalidate_account()
+            tg(f"❌ CLOSED {symbol} | exchange exit")
+            continue
+
+        sl = float(p.get("stopLoss") or 0)
+        if sl and sl != t.sl:
+            trailing = float(p.get("trailingStop") or 0) > 0 and (
+                sl > t.entry if t.side == "BUY" else sl < t.entry
+            )
+            OPEN_TRADES.update(symbol, sl=sl, trail_active=trailing)
+    return True
+
+def reconcile_due():
+    return exchange_exits() and time.time() - RECONCILE["ts"] >= RECONCILE_INTERVAL
+
+# ======================================================
+# SMART BOT – PART 18 : TRIGGER BOOK
+# ======================================================
+
+from bisect import bisect_right, insort
+
+# ===============================
+# INDEX
+# (per symbol, sorted exit levels so a price update only touches the
+#  triggers it crosses)
+# ===============================
+TRIGGER_BOOKS = {}  # symbol -> TriggerBook
+TRIGGER_LOCK = threading.RLock()
+TRIGGER_SEQ = itertools.count()
+EXIT_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="exit")
+TRIGGER_STATS = {"checks": 0, "fired": 0, "trail_moves": 0}
+
+class TriggerBook:
+    """
+    below: fires when price <= level (long SL, short TP, short trail start)
+    above: fires when price >= level (long TP, long trail start, short SL)
+    trail_long / trail_short: stops of positions already trailing
+    Entries are (level, seq, key, kind); seq keeps tuples from comparing keys.
+    """
+    __slots__ = ("below", "above", "trail_long", "trail_short", "entries", "trades", "moved")
+
+    def __init__(self):
+        self.below = []
+        self.above = []
+        self.trail_long = []
+        self.trail_short = []
+        self.entries = {}  # key -> [(list, entry), ...]
+        self.trades = {}   # key -> Position the entries were built from
+        self.moved = []
+
+    def _insert(self, key, lst, level, kind):
+        e = (level, next(TRIGGER_SEQ), key, kind)
+        insort(lst, e)
+        self.entries[key].append((lst, e))
+
+    def add(self, key, t):
+        self.remove(key)
+        self.entries[key] = []
+        self.trades[key] = t
+
+        if t.side == "BUY":
+            self._insert(key, self.below, t.sl, "sl")
+            self._insert(key, self.above, t.tp, "tp")
+            if t.trail_active:
+                self._insert(key, self.trail_long, t.sl, "trail")
+            else:
+                self._insert(key, self.above, t.entry * (1 + TRAIL_START), "start")
+        else:
+            self._insert(key, self.above, t.sl, "sl")
+            self._insert(key, self.below, t.tp, "tp")
+            if t.trail_active:
+                self._insert(key, self.trail_short, t.sl, "trail")
+            else:
+                self._insert(key, self.below, t.entry * (1 - TRAIL_START), "start")
+
+    def remove(self, key):
+        for lst, e in self.entries.pop(key, ()):
+            i = bisect_left(lst, e)
+            if i < len(lst) and lst[i] == e:
+                del lst[i]
+        self.trades.pop(key, None)
+
+    def crossed(self, price):
+        """
+        Entries whose level the price is at or through
+        """
+        hits = self.below[bisect_left(self.below, (price,)):]
+        hits += self.above[:bisect_right(self.above, (price, math.inf))]
+        return hits
+
+    def check(self, price):
+        """
+        Same decisions as exit_rules() for every indexed position.
+        Returns [(key, reason)] and drops those keys. Trailing changes are
+        made on copies and returned as [(old, new)] in self.moved.
+        """
+        self.moved = []
+        exits = []
+        started = []
+        for level, _, key, kind in self.crossed(price):
+            if kind == "sl":
+                exits.append((key, "STOP LOSS"))
+            elif kind == "tp":
+                exits.append((key, "TAKE PROFIT"))
+            else:
+                started.append(key)
+
+        for key, _ in exits:
+            self.remove(key)
+
+        for key in started:
+            t = self.trades.get(key)
+            if t is not None:
+                self._move(key, t, trail_active=True)
+
+        # trailing move: only the stops the new level improves are reindexed
+        new_sl = price * (1 - TRAIL_STEP)
+        for _, _, key, _ in self.trail_long[:bisect_left(self.trail_long, (new_sl,))]:
+            self._move(key, self.trades[key], sl=new_sl)
+
+        new_sl = price * (1 + TRAIL_STEP)
+        for _, _, key, _ in self.trail_short[bisect_right(self.trail_short, (new_sl, math.inf)):]:
+            self._move(key, self.trades[key], sl=new_sl)
+
+        return exits
+
+    def _move(self, key, t, **fields):
+        new = t.replace(**fields)
+        self.add(key, new)
+        self.moved.append((t, new))  # chained if one check moves a key twice
+        if "sl" in fields:
+            TRIGGER_STATS["trail_moves"] += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+# ===============================
+# BOOK MAINTENANCE
+# ===============================
+def indexable(t):
+    return not t.native and not t.closing
+
+def index_trade(key, symbol=None):
+    t = OPEN_TRADES.get(key)
+    with TRIGGER_LOCK:
+        book = TRIGGER_BOOKS.get(symbol or key)
+        if t is None or not indexable(t):
+            if book is not None:
+                book.remove(key)
+            return
+        if book is None:
+            book = TRIGGER_BOOKS[symbol or key] = TriggerBook()
+        book.add(key, t)
+
+def unindex_trade(key, symbol=None):
+    with TRIGGER_LOCK:
+        book = TRIGGER_BOOKS.get(symbol or key)
+        if book is not None:
+            book.remove(key)
+            if not book:
+                del TRIGGER_BOOKS[symbol or key]
+
+def sync_books():
+    """
+    Brings the books in line with OPEN_TRADES (commands and reconcile edit
+    it directly). Returns the symbols that have client-side triggers.
+    """
+    with TRIGGER_LOCK:
+        live = {k: t for k, t in OPEN_TRADES.items() if indexable(t)}
+
+        for symbol, book in list(TRIGGER_BOOKS.items()):
+            for key in list(book.trades):
+                if key not in live:
+                    book.remove(key)
+            if not book:
+                del TRIGGER_BOOKS[symbol]
+
+        for key, t in live.items():
+            symbol = t.symbol or key
+            book = TRIGGER_BOOKS.get(symbol)
+            if book is None or book.trades.get(key) is not t:
+                index_trade(key, symbol)
+
+        return list(TRIGGER_BOOKS.keys())
+
+# ===============================
+# EVALUATION
+# ===============================
+def check_triggers(symbol, price):
+    """
+    Crossed exits for one price update; marks them closing
+    """
+    book = TRIGGER_BOOKS.get(symbol)
+    if book is None:
+        return []
 
-        register_trade(symbol, side, price, qty)
-        TRADES_TODAY += 1
+    with TRIGGER_LOCK:
+        TRIGGER_STATS["checks"] += 1
+        exits = book.check(price)
+        # a position closed or edited meanwhile fails the swap; the next
+        # sync rebuilds it from the store
+        for old, new in book.moved:
+            OPEN_TRADES.swap(old, new)
+        for key, _ in exits:
+            OPEN_TRADES.update(key, closing=True)
+        if not book:
+            TRIGGER_BOOKS.pop(symbol, None)
+
+    TRIGGER_STATS["fired"] += len(exits)
+    return exits
+
+def exit_trade(key, reason):
+    """
+    close_trade; a failed close goes back into the book on the next sync
+    """
+    try:
+        close_trade(key, reason)
+    finally:
+        OPEN_TRADES.update(key, closing=False)
 
-        tg(f"📈 OPEN {side} {symbol} | {price}")
+def on_trigger_price(symbol, price):
+    """
+    Stream hook: evaluated on every price update, closes run off-thread
+    """
+    for key, reason in check_triggers(symbol, price):
+        EXIT_POOL.submit(exit_trade, key, reason)
 
-    except:
-        pass
+# ======================================================
+# SMART BOT – PART 19 : STATE JOURNAL
+# ======================================================
 
 # ===============================
-# TELEGRAM COMMAND CENTER
+# JOURNAL CONFIG
+# data/journal/snapshot.json  full state + the journal it supersedes
+# data/journal/journal.log    one JSON record per line, appended
 # ===============================
-def telegram_listener():
-    global BOT_ACTIVE, KILL_SWITCH, ACTIVE_TIMEFRAME
-    offset = None
+JOURNAL_ENABLED = os.getenv("JOURNAL", "1") == "1"
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "data/journal")
+JOURNAL_FLUSH = 0.02      # gather window before one write + fsync
+JOURNAL_IDLE = 1.0        # day counters are checked at least this often
+JOURNAL_COMPACT = 5000    # records before the log is folded into a snapshot
+
+JOURNAL_QUEUE = deque()
+JOURNAL_COND = threading.Condition()
+JOURNAL_WRITER = None
+JOURNAL_STATS = {"records": 0, "fsyncs": 0, "compactions": 0, "replayed": 0, "replay_ms": 0.0}
+
+def journal_path(name):
+    return os.path.join(JOURNAL_DIR, name)
+
+def utc_day():
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+def day_state():
+    return {
+        "day": utc_day(),
+        "trades_today": TRADES_TODAY,
+        "start_balance": START_DAY_BALANCE,
+        "kill_switch": KILL_SWITCH
+    }
+
+# ===============================
+# RECORDING
+# (called under the store lock, so log order is write order)
+# ===============================
+def journal_record(op, value):
+    if op == "put":
+        rec = {"op": "put", "p": value.as_dict()}
+    elif op == "pop":
+        rec = {"op": "pop", "s": value}
+    else:
+        rec = {"op": "clear"}
+    with JOURNAL_COND:
+        JOURNAL_QUEUE.append(rec)
+        JOURNAL_COND.notify()
+
+def journal_writer():
+    """
+    Single writer: batches records, one write + fsync per batch, and
+    appends a day record whenever the counters changed
+    """
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    f = open(journal_path("journal.log"), "a")
+    since_compact = 0
+    last_day = None
 
     while True:
+        with JOURNAL_COND:
+            if not JOURNAL_QUEUE:
+                JOURNAL_COND.wait(JOURNAL_IDLE)
+        time.sleep(JOURNAL_FLUSH)
+
+        batch = []
+        while JOURNAL_QUEUE:
+            batch.append(JOURNAL_QUEUE.popleft())
+
+        day = day_state()
+        if day != last_day:
+            batch.append(dict(day, op="day"))
+            last_day = day
+
+        if not batch:
+            continue
+
         try:
-            r = requests.get(
-                f"https://api.telegram.org/bot{TG_TOKEN}/getUpdates",
-                params={"offset": offset, "timeout": 30}
-            ).json()
-
-            for u in r["result"]:
-                offset = u["update_id"] + 1
-                if "message" not in u:
-                    continue
-                if u["message"]["chat"]["id"] != TG_ADMIN:
-                    continue
+            if f.closed:
+                f = open(journal_path("journal.log"), "a")  # a failed reopen is retried here
+            f.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in batch))
+            f.flush()
+            os.fsync(f.fileno())
+            JOURNAL_STATS["records"] += len(batch)
+            JOURNAL_STATS["fsyncs"] += 1
+            since_compact += len(batch)
+        except:
+            count_error("journal_writer")
+            continue
 
-                cmd = u["message"]["text"].lower()
+        if since_compact >= JOURNAL_COMPACT:
+            # a failed compaction leaves the old log whole: keep appending to it
+            # and try again after another JOURNAL_COMPACT records
+            since_compact = 0
+            f.close()
+            try:
+                journal_compact()
+            except:
+                count_error("journal_compact")
+            try:
+                f = open(journal_path("journal.log"), "a")
+            except:
+                count_error("journal_writer")
+
+def journal_compact():
+    """
+    Writes the current state as a snapshot, then starts an empty log.
+    Records still queued are replayed on top; put/pop are idempotent.
+    """
+    state = {
+        "day": day_state(),
+        "positions": [p.as_dict() for p in OPEN_TRADES.values()]
+    }
+    tmp = journal_path("snapshot.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, journal_path("snapshot.json"))
+    open(journal_path("journal.log"), "w").close()
+    JOURNAL_STATS["compactions"] += 1
 
-                if cmd == "/stop":
-                    BOT_ACTIVE = False
-                    tg("⛔ BOT STOPPED")
+# ===============================
+# REPLAY
+# ===============================
+def journal_replay():
+    """
+    Snapshot + log -> (positions dict, last day record)
+    A torn last line from a crash mid-write is ignored.
+    """
+    positions = {}
+    day = None
+    n = 0
 
-                elif cmd == "/start":
-                    BOT_ACTIVE = True
-                    KILL_SWITCH = False
-                    tg("▶️ BOT STARTED")
+    try:
+        with open(journal_path("snapshot.json")) as f:
+            state = json.load(f)
+        day = state.get("day")
+        for d in state.get("positions", []):
+            positions[d["symbol"]] = Position(**d)
+    except FileNotFoundError:
+        pass
 
-                elif cmd == "/status":
-                    tg(f"⚙️ Mode:{MODE}\nBalance:{get_balance()}\nTrades:{TRADES_TODAY}\nPairs:{len(SYMBOLS)}")
+    try:
+        with open(journal_path("journal.log")) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                n += 1
+                op = rec["op"]
+                if op == "put":
+                    positions[rec["p"]["symbol"]] = Position(**rec["p"])
+                elif op == "pop":
+                    positions.pop(rec["s"], None)
+                elif op == "clear":
+                    positions.clear()
+                elif op == "day":
+                    day = rec
+    except FileNotFoundError:
+        pass
 
-                elif cmd.startswith("/tf"):
-                    tf = cmd.replace("/tf","").strip()
-                    if tf in TIMEFRAMES:
-                        ACTIVE_TIMEFRAME = tf
-                        tg(f"⏱ Timeframe set to {tf}")
+    JOURNAL_STATS["replayed"] = n
+    return positions, day
 
-        except:
-            pass
+def journal_restore():
+    """
+    Start-up: rebuild OPEN_TRADES and today's counters from disk
+    """
+    global TRADES_TODAY, START_DAY_BALANCE, KILL_SWITCH
+
+    t0 = time.perf_counter()
+    positions, day = journal_replay()
+
+    for p in positions.values():
+        p.closing = False
+        OPEN_TRADES.put(p)
+
+    if day and day.get("day") == utc_day():
+        TRADES_TODAY = day["trades_today"]
+        START_DAY_BALANCE = day["start_balance"]
+        KILL_SWITCH = day["kill_switch"]
+
+    JOURNAL_STATS["replay_ms"] = (time.perf_counter() - t0) * 1000
+    return len(positions)
+
+def reconcile_restored():
+    """
+    Lines the restored store up with bybit: drops positions closed while
+    the bot was down, adopts ones it does not know, fixes sizes
+    """
+    live = fetch_positions()
+    if live is None:
+        return False
+
+    dropped, adopted = [], []
+    for symbol, t in OPEN_TRADES.items():
+        p = live.get(symbol)
+        if p is None:
+            OPEN_TRADES.pop(symbol)
+            dropped.append(symbol)
+        elif float(p["size"]) != t.qty:
+            OPEN_TRADES.update(symbol, qty=float(p["size"]))
+
+    for symbol, p in live.items():
+        if symbol in OPEN_TRADES:
+            continue
+        t = new_position(p["side"], float(p["avgPrice"]), float(p["size"]), symbol)
+        if exchange_exits() and float(p.get("stopLoss") or 0):
+            t.native = True
+        OPEN_TRADES.put(t)
+        adopted.append(symbol)
+
+    sync_books()
+    if dropped or adopted:
+        invalidate_account()
+        tg(
+            f"♻️ STATE RESTORED\nOpen: {len(OPEN_TRADES)}\n"
+            f"Closed while down: {', '.join(dropped) or '-'}\n"
+            f"Adopted: {', '.join(adopted) or '-'}"
+        )
+    return True
+
+def start_journal():
+    """
+    Replay, reconcile, then journal every store write from here on
+    """
+    global JOURNAL_WRITER
+    if not JOURNAL_ENABLED or JOURNAL_WRITER is not None:
+        return
 
-        time.sleep(5)
+    n = journal_restore()
+    print(f"📒 Journal: {n} positions, {JOURNAL_STATS['replayed']} records in {JOURNAL_STATS['replay_ms']:.1f} ms")
+    reconcile_restored()
+
+    OPEN_TRADES.listener = journal_record
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    journal_compact()  # restored + reconciled state becomes the new base
+    JOURNAL_WRITER = threading.Thread(target=journal_writer, daemon=True)
+    JOURNAL_WRITER.start()
+
+# ======================================================
+# SMART BOT – PART 20 : DASHBOARD STATE
+# ======================================================
 
 # ===============================
-# MASTER TRADER LOOP
+# STATE SNAPSHOT
+# (built by the bot every DASH_INTERVAL from cached data; dashboard
+#  viewers only ever read it, so they cost no exchange calls)
 # ===============================
-def master_trader():
-    init_day()
+DASH_INTERVAL = 2        # seconds between rebuilds
+DASH_DELTAS = 200        # versions an SSE client may lag behind
+DASH_HEARTBEAT = 15      # idle SSE comment so proxies keep the stream
+
+# versions restart at 0 with the process; ids and ETags carry the boot
+# so a reconnect from before a restart gets the full state, never a 304
+DASH_BOOT = format(int(time.time() * 1000), "x")
+DASH_STATE = {"version": 0, "etag": f'W/"{DASH_BOOT}-0"', "data": {}, "body": b"{}"}
+DASH_HISTORY = deque(maxlen=DASH_DELTAS)  # (version, changed keys)
+DASH_COND = threading.Condition()
+DASH_PUBLISHER = None
+
+def build_state():
+    acct = ACCOUNT_STATE
+    wallet = acct["wallet"] if acct["fetched"] else None
+
+    positions = []
+    upnl = 0.0
+    for symbol, t in sorted(OPEN_TRADES.items()):
+        price = live_price(symbol) or snapshot_price(symbol)
+        pnl = None
+        if price:
+            pnl = (price - t.entry) * t.qty if t.side == "BUY" else (t.entry - price) * t.qty
+            upnl += pnl
+        positions.append({
+            "symbol": symbol,
+            "side": t.side,
+            "qty": t.qty,
+            "entry": t.entry,
+            "price": price,
+            "sl": round(t.sl, 8),
+            "tp": round(t.tp, 8),
+            "trailing": t.trail_active,
+            "pnl": round(pnl, 4) if pnl is not None else None
+        })
+
+    return {
+        "mode": MODE,
+        "active": BOT_ACTIVE,
+        "kill": KILL_SWITCH,
+        "balance": round(wallet, 2) if wallet is not None else None,
+        "equity": round(acct["equity"], 2) if acct["fetched"] else None,
+        "day_pnl": round(wallet - START_DAY_BALANCE, 2) if wallet is not None and START_DAY_BALANCE else None,
+        "upnl": round(upnl, 4),
+        "trades_today": TRADES_TODAY,
+        "max_trades": MAX_TRADES,
+        "positions": positions
+    }
+
+def publish_state():
+    """
+    Rebuilds the snapshot; bumps the version only when something changed
+    """
+    global DASH_STATE
+    data = build_state()
+    with DASH_COND:
+        old = DASH_STATE
+        changed = [k for k in data if data[k] != old["data"].get(k)]
+        if not changed:
+            return old["version"]
+
+        version = old["version"] + 1
+        DASH_STATE = {
+            "version": version,
+            "etag": f'W/"{DASH_BOOT}-{version}"',
+            "data": data,
+            "body": json.dumps(dict(data, version=version), separators=(",", ":")).encode()
+        }
+        DASH_HISTORY.append((version, changed))
+        DASH_COND.notify_all()
+    return version
+
+def state_publisher():
+    account_snapshot()  # TTL-cached, at most one wallet call per BALANCE_TTL
+    publish_state()
+
+def start_state_publisher():
+    global DASH_PUBLISHER
+    with DASH_COND:
+        if DASH_PUBLISHER is not None:
+            return DASH_PUBLISHER
+        DASH_PUBLISHER = add_job("state", state_publisher, DASH_INTERVAL, delay=DASH_INTERVAL)
+    start_scheduler()  # no-op under main(), which runs the dispatcher itself
+    publish_state()  # first viewer gets cached data, not an empty state
+    return DASH_PUBLISHER
+
+# ===============================
+# READERS
+# ===============================
+def state_snapshot():
+    return DASH_STATE
+
+def state_event_id(version):
+    return f"{DASH_BOOT}-{version}"
+
+def event_since(event_id):
+    """
+    Version from an SSE Last-Event-ID, or -1 (send the full state) when
+    it is malformed or from another boot of the bot
+    """
+    boot, _, version = (event_id or "").rpartition("-")
+    if boot != DASH_BOOT or not version.isdigit():
+        return -1
+    return int(version)
+
+def state_delta(since):
+    """
+    Keys changed after version `since` with their current values,
+    or None when the client is too far behind and needs the full state
+    """
+    state = DASH_STATE
+    if since > state["version"]:
+        return None  # an id this boot never issued
+    if since == state["version"]:
+        return {}
+    keys = set()
+    for version, changed in list(DASH_HISTORY):
+        if version > since:
+            keys.update(changed)
+    oldest = DASH_HISTORY[0][0] if DASH_HISTORY else state["version"] + 1
+    if oldest > since + 1:
+        return None
+    return {k: state["data"][k] for k in keys}
+
+def wait_state(version, timeout=DASH_HEARTBEAT):
+    """
+    Blocks until the snapshot is newer than `version` (or timeout)
+    """
+    with DASH_COND:
+        if DASH_STATE["version"] <= version:
+            DASH_COND.wait(timeout)
+    return DASH_STATE
+
+# ======================================================
+# SMART BOT – PART 21 : MULTI-TIMEFRAME RESAMPLER
+# ======================================================
+
+# ===============================
+# RESAMPLER CONFIG
+# (1m bars from the stream / REST are folded into 5m..4h buckets
+#  aligned like bybit's: bucket start = ts - ts % interval, UTC)
+# ===============================
+RESAMPLE = os.getenv("RESAMPLE", "1") == "1"
+RESAMPLE_TFS = ("5", "15", "60", "240")
+RESAMPLE_KEEP = 200                  # closed bars kept per timeframe
+RESAMPLE_BASE_LIMIT = 241            # 1m window covering the widest open bucket
+RESAMPLE_CATCHUP = 30                # 1m rows per top-up when the stream is off
+MINUTE_MS = 60_000
+
+RESAMPLE_STATE = {}   # symbol -> {"last": 1m row, "tfs": {tf: {...}}}
+RESAMPLE_LOCK = threading.Lock()
+RESAMPLE_STATS = {"seeds": 0, "minutes": 0, "gaps": 0, "reads": 0}
+
+def bar(row):
+    """
+    Numeric [start, open, high, low, close, volume, turnover]
+    """
+    return [int(row[0])] + [float(x) for x in row[1:7]]
+
+def fold(acc, m):
+    acc[2] = max(acc[2], m[2])
+    acc[3] = min(acc[3], m[3])
+    acc[4] = m[4]
+    acc[5] += m[5]
+    acc[6] += m[6]
+
+# ===============================
+# SEEDING
+# ===============================
+def seed_symbol(symbol):
+    """
+    Closed higher-TF bars from the exchange (once), open buckets rebuilt
+    from 1m so every later minute folds in exactly once
+    """
+    base = [bar(r) for r in reversed(exchange_klines(symbol, "1", RESAMPLE_BASE_LIMIT))]
+    if not base:
+        return None
+
+    now_ms = int(time.time() * 1000)
+    tfs = {}
+    for tf in RESAMPLE_TFS:
+        step = INTERVAL_SECONDS[tf] * 1000
+        cut = now_ms - now_ms % step  # open bucket: built from 1m below
+        rows = exchange_klines(symbol, tf, RESAMPLE_KEEP + 1)
+        closed = [bar(r) for r in reversed(rows) if int(r[0]) < cut]
+        tfs[tf] = {
+            "step": step,
+            "from": cut,
+            "bars": deque(closed[-RESAMPLE_KEEP:], maxlen=RESAMPLE_KEEP),
+            "cur": None
+        }
+
+    state = {"last": None, "tfs": tfs}
+    for m in base:
+        feed_minute(state, m)
+    RESAMPLE_STATS["seeds"] += 1
+    return state
+
+# ===============================
+# INCREMENTAL UPDATE
+# ===============================
+def close_minute(state, m):
+    RESAMPLE_STATS["minutes"] += 1
+    for s in state["tfs"].values():
+        if m[0] < s["from"]:
+            continue  # already inside a seeded exchange bar
+        start = m[0] - m[0] % s["step"]
+        cur = s["cur"]
+        if cur is None or start > cur[0]:
+            if cur is not None:
+                s["bars"].append(cur)
+            s["cur"] = [start] + m[1:]
+        elif start == cur[0]:
+            fold(cur, m)
+
+def feed_minute(state, m):
+    """
+    m may be the still-forming minute; it is folded once a later one shows
+    up. Returns False on a gap (caller reseeds).
+    """
+    last = state["last"]
+    if last is None or m[0] == last[0]:
+        state["last"] = m
+        return True
+    if m[0] < last[0]:
+        return True
+    if m[0] != last[0] + MINUTE_MS:
+        return False
+    close_minute(state, last)
+    state["last"] = m
+    return True
+
+def resample_feed(symbol, rows):
+    """
+    1m rows (any order, bybit layout) from the stream or REST
+    """
+    if not RESAMPLE:
+        return
+    with RESAMPLE_LOCK:
+        state = RESAMPLE_STATE.get(symbol)
+        if state is None:
+            return  # nobody reads this symbol's higher timeframes yet
+        for r in sorted(rows, key=lambda r: int(r[0])):
+            if not feed_minute(state, bar(r)):
+                RESAMPLE_STATS["gaps"] += 1
+                del RESAMPLE_STATE[symbol]  # next read reseeds
+                return
+
+# ===============================
+# READ
+# ===============================
+def resampled(symbol, tf, limit=100):
+    """
+    Bybit-style rows (newest first) for a resampled timeframe, [] if the
+    symbol could not be seeded
+    """
+    # cache hit while the stream keeps 1m fresh, else one REST call per minute
+    fetch_klines(symbol, "1", RESAMPLE_CATCHUP)
+
+    with RESAMPLE_LOCK:
+        state = RESAMPLE_STATE.get(symbol)
+    if state is None:
+        state = seed_symbol(symbol)
+        if state is None:
+            return []
+        with RESAMPLE_LOCK:
+            state = RESAMPLE_STATE.setdefault(symbol, state)
+
+    with RESAMPLE_LOCK:
+        RESAMPLE_STATS["reads"] += 1
+        s = state["tfs"][tf]
+        rows = list(s["bars"])
+        cur = list(s["cur"]) if s["cur"] else None
+        m = state["last"]
+
+        # the forming minute is folded on read only
+        if m is not None and m[0] >= s["from"]:
+            start = m[0] - m[0] % s["step"]
+            if cur is not None and start == cur[0]:
+                fold(cur, m)
+            else:
+                if cur is not None:
+                    rows.append(cur)
+                cur = [start] + m[1:]
+        if cur is not None:
+            rows.append(cur)
+
+    return rows[::-1][:limit]
+
+def resample_parity(symbol, tf, limit=50):
+    """
+    Closed local bars that differ from bybit's own klines: [(start, local, exchange)]
+    """
+    local = {r[0]: r for r in resampled(symbol, tf, limit)[1:]}
+    diffs = []
+    for r in exchange_klines(symbol, tf, limit):
+        x = bar(r)
+        mine = local.get(x[0])
+        if mine is None:
+            continue
+        if any(abs(a - b) > 1e-9 * max(1.0, abs(b)) for a, b in zip(mine[1:], x[1:])):
+            diffs.append((x[0], mine, x))
+    return diffs
+
+# ======================================================
+# SMART BOT – PART 22 : TICK BARS (SUB-MINUTE TIMEFRAMES)
+# ======================================================
+
+# ===============================
+# TICK CONFIG
+# (bybit has no sub-minute klines: 1s bars are built from publicTrade,
+#  5s / 15s from closed 1s bars)
+# ===============================
+TICK_TFS = {"1s": 1, "5s": 5, "15s": 15}
+TICK_KEEP = 600          # bars kept per symbol and timeframe
+TICK_GRACE = 250         # ms a bucket stays open for late trades
+TICK_SWEEP = 0.2         # s between closing buckets of quiet symbols
+
+TICK_STATE = {}          # symbol -> {"cur": {1: bar, 5: bar, 15: bar}, "rings": {tf: BarRing}, "sealed": ms}
+TICK_CLOCK = {"exchange_ms": 0, "swept": 0.0}
+TICK_PENDING = {}        # symbol -> bar end (ms); coalesced, newest wins
+TICK_COND = threading.Condition()
+TICK_WORKER = None
+TICK_STATS = {"trades": 0, "bars": 0, "late": 0, "coalesced": 0, "evaluated": 0}
+
+def tick_mode():
+    return ACTIVE_TIMEFRAME in TICK_TFS
+
+class BarRing:
+    """
+    Fixed-size OHLCV ring on flat arrays; pushing never allocates.
+    The stream thread pushes while workers read, so both hold the lock.
+    """
+    __slots__ = ("size", "n", "head", "ts", "o", "h", "l", "c", "v", "lock")
+
+    def __init__(self, size):
+        self.size = size
+        self.n = 0
+        self.head = 0
+        self.ts = array("q", bytes(8 * size))
+        self.o = array("d", bytes(8 * size))
+        self.h = array("d", bytes(8 * size))
+        self.l = array("d", bytes(8 * size))
+        self.c = array("d", bytes(8 * size))
+        self.v = array("d", bytes(8 * size))
+        self.lock = threading.Lock()
+
+    def push(self, b):
+        with self.lock:
+            i = self.head
+            self.ts[i], self.o[i], self.h[i], self.l[i], self.c[i], self.v[i] = b
+            self.head = (i + 1) % self.size
+            if self.n < self.size:
+                self.n += 1
+
+    def _window(self, col, k):
+        # caller holds the lock
+        k = min(k, self.n)
+        start = (self.head - k) % self.size
+        if start + k <= self.size:
+            return col[start:start + k]
+        return col[start:] + col[:self.head]
+
+    def closes(self, k):
+        """
+        Last k closes, oldest first
+        """
+        with self.lock:
+            return self._window(self.c, k).tolist()
+
+    def rows(self, k):
+        """
+        Bybit-style rows, newest first
+        """
+        with self.lock:
+            cols = [self._window(c, k) for c in (self.ts, self.o, self.h, self.l, self.c, self.v)]
+        return [[ts, o, h, l, c, v, 0.0] for ts, o, h, l, c, v in zip(*cols)][::-1]
+
+# ===============================
+# AGGREGATION
+# ===============================
+def tick_state(symbol):
+    st = TICK_STATE.get(symbol)
+    if st is None:
+        st = TICK_STATE[symbol] = {
+            "cur": dict.fromkeys(TICK_TFS.values()),
+            "rings": {tf: BarRing(TICK_KEEP) for tf in TICK_TFS.values()},
+            "sealed": -1  # start of the newest closed second; trades at or before it are late
+        }
+    return st
+
+def close_bar(symbol, st, tf, b):
+    st["rings"][tf].push(b)
+    TICK_STATS["bars"] += 1
+    if TICK_TFS.get(ACTIVE_TIMEFRAME) == tf:
+        queue_tick_signal(symbol, b[0] + tf * 1000)
+
+def close_second(symbol, st, b):
+    """
+    A finished 1s bar: stored, then folded into the 5s / 15s buckets
+    """
+    close_bar(symbol, st, 1, b)
+    cur = st["cur"]
+    for tf in (5, 15):
+        start = b[0] - b[0] % (tf * 1000)
+        x = cur[tf]
+        if x is not None and x[0] == start:
+            if b[2] > x[2]:
+                x[2] = b[2]
+            if b[3] < x[3]:
+                x[3] = b[3]
+            x[4] = b[4]
+            x[5] += b[5]
+        else:
+            if x is not None:
+                close_bar(symbol, st, tf, x)
+            cur[tf] = [start] + b[1:]
+
+def on_trades(symbol, trades):
+    """
+    publicTrade batch -> 1s bars. One compare per trade on the hot path.
+    """
+    st = tick_state(symbol)
+    cur = st["cur"]
+    b = cur[1]
+    sealed = st["sealed"]
+    last = 0
+    for t in trades:
+        ts = int(t["T"])
+        p = float(t["p"])
+        start = ts - ts % 1000
+        if b is not None and start == b[0]:
+            if p > b[2]:
+                b[2] = p
+            elif p < b[3]:
+                b[3] = p
+            b[4] = p
+            b[5] += float(t["v"])
+        elif start <= sealed or (b is not None and start < b[0]):
+            TICK_STATS["late"] += 1  # its second is already closed
+        else:
+            if b is not None:
+                close_second(symbol, st, b)
+                sealed = b[0]
+            b = [start, p, p, p, p, float(t["v"])]
+        last = ts
+    cur[1] = b
+    st["sealed"] = sealed
+    TICK_STATS["trades"] += len(trades)
+    return last
+
+def tick_sweep(now_ms):
+    """
+    Closes buckets whose time is up even if no later trade arrived
+    """
+    # every second ending a grace ago is closed, traded or not
+    sealed = now_ms - 1000 - TICK_GRACE
+    sealed -= sealed % 1000
+    for symbol, st in list(TICK_STATE.items()):
+        cur = st["cur"]
+        b = cur[1]
+        if b is not None and b[0] <= sealed:
+            cur[1] = None
+            close_second(symbol, st, b)
+        if sealed > st["sealed"]:
+            st["sealed"] = sealed
+        for tf in (5, 15):
+            x = cur[tf]
+            if x is not None and x[0] + tf * 1000 + TICK_GRACE <= now_ms:
+                cur[tf] = None
+                close_bar(symbol, st, tf, x)
+
+def on_trade_message(symbol, msg, now):
+    """
+    Stream hook for publicTrade.<symbol>
+    """
+    last = on_trades(symbol, msg["data"])
+    if last:
+        observe("tick_ingest_lag_seconds", (), max(0.0, now - last / 1000))
+
+    server = int(msg.get("ts") or last or 0)
+    if server > TICK_CLOCK["exchange_ms"]:
+        TICK_CLOCK["exchange_ms"] = server
+    if now - TICK_CLOCK["swept"] >= TICK_SWEEP:
+        TICK_CLOCK["swept"] = now
+        tick_sweep(TICK_CLOCK["exchange_ms"])
+
+# ===============================
+# READ
+# ===============================
+def tick_closes(symbol, tf, n):
+    st = TICK_STATE.get(symbol)
+    if st is None:
+        return []
+    return st["rings"][tf].closes(n)
+
+def tick_trend(symbol, tf):
+    """
+    ai_trend on tick bars: same SMA 5 / 20 vote as on 1m klines
+    """
+    closes = tick_closes(symbol, tf, 20)
+    if len(closes) < 20:
+        return None
+    return trend_rules(sum(closes[-5:]) / 5, sum(closes) / 20)
+
+# ===============================
+# SIGNALS ON BAR CLOSE
+# (one worker, per-symbol coalescing: a slow order never queues work)
+# ===============================
+def queue_tick_signal(symbol, bar_end):
+    with TICK_COND:
+        if symbol in TICK_PENDING:
+            TICK_STATS["coalesced"] += 1
+        TICK_PENDING[symbol] = bar_end
+        TICK_COND.notify()
+    start_tick_worker()
+
+def start_tick_worker():
+    global TICK_WORKER
+    if TICK_WORKER is not None:
+        return
+    with TICK_COND:
+        if TICK_WORKER is None:
+            TICK_WORKER = threading.Thread(target=tick_signal_worker, name="ticks", daemon=True)
+            TICK_WORKER.start()
 
+def tick_signal_worker():
     while True:
-        try:
-            if not BOT_ACTIVE or KILL_SWITCH:
-                time.sleep(5)
+        with TICK_COND:
+            while not TICK_PENDING:
+                TICK_COND.wait()
+            batch = list(TICK_PENDING.items())
+            TICK_PENDING.clear()
+
+        for symbol, bar_end in batch:
+            observe("tick_signal_lag_seconds", (), max(0.0, time.time() - bar_end / 1000))
+            if not BOT_ACTIVE or KILL_SWITCH or TRADES_TODAY >= MAX_TRADES:
                 continue
+            try:
+                TICK_STATS["evaluated"] += 1
+                sig = smart_signal(symbol)
+                if sig:
+                    open_trade(symbol, sig)
+            except:
+                count_error("tick_signal")
 
-            daily_risk_check()
+def tick_mode_on():
+    """
+    /tf 1s|5s|15s: make sure the trade stream is subscribed
+    """
+    if not STREAM_ENABLED:
+        tg("⚠️ Sub-minute timeframes need the market stream (STREAM_ENABLED=1)")
+        return False
+    stream_subscribe(list(dict.fromkeys(SYMBOLS)))
+    return True
 
-            if TRADES_TODAY >= MAX_TRADES:
-                time.sleep(30)
-                continue
+def tick_mode_off():
+    """
+    /tf back to a candle timeframe: stop the trade stream and drop the
+    tick bars, so a later /tf 1s does not compute across the gap
+    """
+    stream_unsubscribe("publicTrade.")
+    TICK_STATE.clear()
+    with TICK_COND:
+        TICK_PENDING.clear()
 
-            for sym in SYMBOLS:
-                if KILL_SWITCH or not BOT_ACTIVE:
-                    break
+# ======================================================
+# SMART BOT – PART 23 : CANDLE-ALIGNED SCHEDULER
+# ======================================================
 
-                sig = smart_signal(sym)
-                if sig:
-                    open_trade(sym, sig)
+# ===============================
+# SCHEDULER CONFIG
+# ===============================
+SCAN_SETTLE = float(os.getenv("SCAN_SETTLE", "1.5"))  # seconds after the close for the last tick to land
+SCAN_RETRY = 2     # recheck lagging symbols this soon
+SCAN_RETRIES = 3   # ... at most this many times per candle
+MEMO_WINDOW = BATCH_BARS + 1  # widest signal read, so the key lookup fills the cache for it
+CANDLE_ANCHOR = {604800: 345600}  # bybit weeks open Monday 00:00 UTC, not on the epoch
+
+SIGNAL_MEMO = {}  # symbol -> (last closed 1m candle start ms, signal)
+SCHED = {"next": None, "expected": None, "retries": 0, "stale": 0}
+SCHED_STATS = {
+    "cycles": 0,
+    "evaluated": 0,
+    "skipped": 0,
+    "stale": 0,
+    "retries": 0,
+    "last_evaluated": 0,
+    "last_skipped": 0,
+    "last_stale": 0,
+    "late_ms": 0.0
+}
 
-                time.sleep(0.3)
+# ===============================
+# CANDLE CLOCK
+# ===============================
+def candle_open(period, now):
+    """
+    Start (epoch seconds) of the candle of `period` seconds containing now
+    """
+    anchor = CANDLE_ANCHOR.get(period, 0)
+    return now - (now - anchor) % period
 
-            time.sleep(TIMEFRAMES.get(ACTIVE_TIMEFRAME, 60))
+def next_scan_wait(now=None):
+    """
+    Seconds until the next close of ACTIVE_TIMEFRAME plus SCAN_SETTLE,
+    or a short retry while some symbols still miss the last 1m close
+    """
+    now = now or time.time()
+    if SCHED["stale"] and SCHED["retries"] < SCAN_RETRIES:
+        SCHED["retries"] += 1
+        SCHED_STATS["retries"] += 1
+        SCHED["next"] = now + SCAN_RETRY
+        return SCAN_RETRY
+
+    period = TIMEFRAMES.get(ACTIVE_TIMEFRAME, 60)
+    # a wake inside the settle window still belongs to the candle that just closed
+    wake = candle_open(period, now - SCAN_SETTLE) + period + SCAN_SETTLE
+    SCHED["next"] = wake
+    return max(wake - now, 0.05)
+
+def wake_trader():
+    """
+    Runs the trader job now instead of at its next wake (e.g. after /tf)
+    """
+    wake_job("trader")
 
-        except:
-            pass
+# ===============================
+# SIGNAL MEMO
+# ===============================
+def last_closed(symbol):
+    """
+    Start (ms) of the newest closed 1m candle smart_signal would read
+    """
+    step = INTERVAL_SECONDS.get(BATCH_TF, 60) * 1000
+    now_ms = time.time() * 1000
+    for c in fetch_klines(symbol, BATCH_TF, MEMO_WINDOW)[:2]:
+        start = int(c[0])
+        if start + step <= now_ms:
+            return start
+    return None
+
+def scan_fresh(symbols):
+    """
+    Signals for the symbols whose last closed candle moved since they
+    were last evaluated; the rest are skipped. Returns [(symbol, signal)]
+    in input order, fresh evaluations only.
+    """
+    now = time.time()
+    if SCHED["next"]:
+        SCHED_STATS["late_ms"] = (now - SCHED["next"]) * 1000
+
+    unique = list(dict.fromkeys(symbols))
+    keys = dict(zip(unique, scan_symbols(unique, last_closed)))
+    if scan_halted():
+        return []
+
+    expected = int(candle_open(60, now) - 60) * 1000
+    if expected != SCHED["expected"]:
+        SCHED["expected"] = expected
+        SCHED["retries"] = 0
+
+    fresh, stale, skipped = [], 0, 0
+    for sym in unique:
+        key = keys[sym]
+        if key is None or key < expected:
+            stale += 1  # feed has not delivered the close yet
+        memo = SIGNAL_MEMO.get(sym)
+        if key is None or (memo and memo[0] == key):
+            skipped += 1
+            continue
+        fresh.append(sym)
+
+    failed = set()
+    signals = scan_signals(fresh, failed) if fresh else []
+    if scan_halted():
+        return []  # cut short: unevaluated symbols are not "no signal"
+
+    for sym, sig in zip(fresh, signals):
+        if sig is None and sym in failed:
+            continue  # retried next cycle
+        SIGNAL_MEMO[sym] = (keys[sym], sig)
+
+    SCHED["stale"] = stale
+    SCHED_STATS["cycles"] += 1
+    SCHED_STATS["evaluated"] += len(fresh)
+    SCHED_STATS["skipped"] += skipped
+    SCHED_STATS["stale"] += stale
+    SCHED_STATS["last_evaluated"] = len(fresh)
+    SCHED_STATS["last_skipped"] = skipped
+    SCHED_STATS["last_stale"] = stale
+
+    return [(s, sig) for s, sig in zip(fresh, signals) if sig]
+
+# ======================================================
+# SMART BOT – PART 24 : JOB SCHEDULER
+# ======================================================
+
+# ===============================
+# SCHEDULER CONFIG
+# (one heap of periodic jobs, one dispatcher, a small worker pool)
+# ===============================
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "3"))  # trader + manager + one for the short jobs
+RISK_INTERVAL = BALANCE_TTL   # daily_risk_check never sees a newer balance anyway
+DAY_ROLLOVER_DELAY = 1        # seconds past 00:00 UTC
+
+JOBS = {}       # name -> Job
+JOB_HEAP = []   # (due, seq, job), time.monotonic()
+JOB_SEQ = itertools.count()
+JOB_COND = threading.Condition()
+JOB_POOL = None
+JOB_DISPATCHER = None  # thread running run_scheduler
+DAY = {"date": None}
+
+class Job:
+    """
+    A periodic task. seq identifies its live heap entry; wake_job pushes
+    a new one and the old entry is dropped when it surfaces.
+    """
+    __slots__ = ("name", "fn", "every", "seq", "running", "wake", "runs", "overruns")
+
+    def __init__(self, name, fn, every):
+        self.name = name
+        self.fn = fn
+        self.every = every
+        self.seq = None
+        self.running = False
+        self.wake = False
+        self.runs = 0
+        self.overruns = 0
+
+def job_pool():
+    global JOB_POOL
+    with JOB_COND:
+        if JOB_POOL is None:
+            JOB_POOL = ThreadPoolExecutor(
+                max_workers=JOB_WORKERS,
+                thread_name_prefix="job"
+            )
+        return JOB_POOL
+
+def _push(job, due):
+    # caller holds JOB_COND
+    job.seq = next(JOB_SEQ)
+    heapq.heappush(JOB_HEAP, (due, job.seq, job))
+    JOB_COND.notify()
 
 # ===============================
-# SYSTEM START
+# JOBS API
 # ===============================
-threading.Thread(target=telegram_listener, daemon=True).start()
-master_trader()
+def add_job(name, fn, every, delay=0.0):
+    """
+    Runs fn every `every` seconds, first after `delay`. fn may return a
+    number of seconds to pick its own next wait (trader_cycle does).
+    A job never overlaps itself; adding an existing name returns it.
+    """
+    with JOB_COND:
+        job = JOBS.get(name)
+        if job is None:
+            job = JOBS[name] = Job(name, fn, every)
+            _push(job, time.monotonic() + delay)
+        return job
+
+def wake_job(name):
+    """
+    Runs a job as soon as a worker is free instead of at its due time
+    """
+    with JOB_COND:
+        job = JOBS.get(name)
+        if job is None:
+            return
+        if job.running:
+            job.wake = True  # rescheduled for now when the run finishes
+        else:
+            _push(job, time.monotonic())
 
+def run_job(job, due):
+    labels = (("job", job.name),)
+    started = time.monotonic()
+    observe("job_jitter_seconds", labels, max(0.0, started - due))
 
-import threading
-import mini_app
+    wait = None
+    try:
+        wait = job.fn()
+    except:
+        count_error(job.name)
+
+    end = time.monotonic()
+    observe("job_run_seconds", labels, end - started)
+    job.runs += 1
+
+    if isinstance(wait, (int, float)) and not isinstance(wait, bool):
+        due = end + wait
+    elif job.every <= 0:
+        due = end
+    else:
+        due += job.every
+        if due < end:
+            # ran past its next slot(s): skip them, keep the phase
+            missed = int((end - due) // job.every) + 1
+            job.overruns += missed
+            count("job_overruns_total", labels, missed)
+            due += missed * job.every
+
+    with JOB_COND:
+        job.running = False
+        if job.wake:
+            job.wake = False
+            due = end
+        _push(job, due)
+
+# ===============================
+# DISPATCHER
+# ===============================
+def run_scheduler():
+    """
+    Pops due jobs off the heap onto the pool. Blocks forever.
+    """
+    pool = job_pool()
+    while True:
+        with JOB_COND:
+            while True:
+                now = time.monotonic()
+                if JOB_HEAP and JOB_HEAP[0][0] <= now:
+                    due, seq, job = heapq.heappop(JOB_HEAP)
+                    if seq == job.seq:
+                        break
+                    continue  # superseded by wake_job
+                JOB_COND.wait(JOB_HEAP[0][0] - now if JOB_HEAP else None)
+            job.running = True
+        pool.submit(run_job, job, due)
+
+def start_scheduler(inline=False):
+    """
+    Starts the dispatcher once. main() claims it and runs it inline on
+    the main thread; a standalone mini_app gets a daemon thread.
+    """
+    global JOB_DISPATCHER
+    fresh = False
+    with JOB_COND:
+        if JOB_DISPATCHER is None:
+            if inline:
+                JOB_DISPATCHER = threading.current_thread()
+            else:
+                JOB_DISPATCHER = threading.Thread(target=run_scheduler, name="scheduler", daemon=True)
+            fresh = True
+        dispatcher = JOB_DISPATCHER
+
+    if dispatcher is threading.current_thread():
+        if inline:
+            run_scheduler()
+    elif fresh:
+        dispatcher.start()
+    elif inline:
+        dispatcher.join()  # a dashboard viewer started it first
+    return dispatcher
+
+# ===============================
+# DAILY JOBS
+# ===============================
+def until_utc_midnight(now=None):
+    now = now or time.time()
+    return 86400 - now % 86400 + DAY_ROLLOVER_DELAY
+
+def day_rollover():
+    """
+    Scheduler job at 00:00 UTC: new day balance, trade count, kill switch
+    """
+    today = utc_day()
+    if DAY["date"] != today:  # a wake a hair early just reschedules
+        DAY["date"] = today
+        invalidate_account()
+        init_day()
+    return until_utc_midnight()
+
+def risk_check():
+    if BOT_ACTIVE and not KILL_SWITCH:
+        daily_risk_check()
+
+# ===============================
+# JOB TABLE
+# ===============================
+def schedule_jobs():
+    """
+    Every periodic task of the bot; main() runs them with start_scheduler
+    """
+    global JOB_DISPATCHER
+    with JOB_COND:
+        # claim the dispatcher for the main thread before the state job
+        # would start one of its own
+        JOB_DISPATCHER = JOB_DISPATCHER or threading.current_thread()
+
+    if START_DAY_BALANCE is None:  # not restored from today's journal
+        init_day()
+    DAY["date"] = utc_day()
+
+    add_job("trader", trader_cycle, 5)  # every: backoff after a failed pass
+    add_job("manager", manage_cycle, 3)
+    add_job("risk", risk_check, RISK_INTERVAL)
+    add_job("day", day_rollover, 86400, delay=until_utc_midnight())
+    if TG_TOKEN and not telegram_webhook():
+        start_telegram_poller()  # outside the pool, see telegram_loop
+    if STREAM_ENABLED:
+        add_job("stream", stream_heartbeat, STREAM_PING, delay=STREAM_PING)
+    start_state_publisher()
+    return len(JOBS)
+
+def job_stats():
+    with JOB_COND:
+        return {
+            name: {"runs": j.runs, "overruns": j.overruns, "running": j.running}
+            for name, j in JOBS.items()
+        }
+
+# ===============================
+# SERVICE ENTRY POINT
+# (python smart_bot.py; importing the module starts nothing)
+# ===============================
+DASHBOARD_PORT = int(os.getenv("PORT", "10000"))
+
+STARTUP = {}  # phase -> milliseconds, for the log and /metrics
 
-threading.Thread(target=mini_app.app.run, kwargs={
-    "host": "0.0.0.0",
-    "port": 10000
-}, daemon=True).start()
+def phase(name, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        STARTUP[name] = (time.perf_counter() - t0) * 1000
+
+def start_thread(fn, name):
+    t = threading.Thread(target=fn, name=name, daemon=True)
+    t.start()
+    return t
+
+def start_dashboard(port=None):
+    # run as a script this module is __main__; mini_app must get this one
+    sys.modules.setdefault("smart_bot", sys.modules[__name__])
+    import mini_app
+
+    return start_thread(
+        lambda: mini_app.app.run(host="0.0.0.0", port=port or DASHBOARD_PORT),
+        "dashboard"
+    )
+
+def main():
+    t0 = time.perf_counter()
+
+    phase("dashboard", start_dashboard)  # bind the port first for health checks
+    phase("session", session.client)
+    phase("journal", start_journal)
+    phase("telegram", start_tg_sender)
+    if STREAM_ENABLED:
+        phase("stream", start_thread, market_stream, "stream")
+    phase("jobs", schedule_jobs)
+
+    STARTUP["total"] = (time.perf_counter() - t0) * 1000
+    print("⏱ Startup: " + ", ".join(f"{k} {v:.0f} ms" for k, v in STARTUP.items()))
+
+    start_scheduler(inline=True)
 
 def send_webapp_button():
     url = "https://yourbot.onrender.com"  # 🔴 Render link
@@ -1003,3 +4612,6 @@ def send_webapp_button():
         f"https://api.telegram.org/bot{TG_TOKEN}/sendMessage",
         json=data
     )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import random
+
+import pytest
+
+import smart_bot as bot
+
+STEP = 60_000
+T0 = 1_600_000_000_000  # long closed, so update_series sees no forming candle
+PERIODS = [("sma", 5), ("sma", 20), ("ema", 10), ("ema", 25), ("rsi", 14)]
+
+# ===============================
+# TEXTBOOK BATCH REFERENCES
+# ===============================
+def ref_sma(closes, period):
+    if len(closes) < period:
+        return None
+    return sum(closes[-period:]) / period
+
+def ref_ema(closes, period):
+    if len(closes) < period:
+        return None
+    k = 2 / (period + 1)
+    value = sum(closes[:period]) / period
+    for x in closes[period:]:
+        value = x * k + value * (1 - k)
+    return value
+
+def ref_rsi(closes, period):
+    if len(closes) < period + 1:
+        return None
+    diffs = [b - a for a, b in zip(closes, closes[1:])]
+    gains = [max(d, 0.0) for d in diffs]
+    losses = [max(-d, 0.0) for d in diffs]
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    for g, l in zip(gains[period:], losses[period:]):
+        avg_gain = (avg_gain * (period - 1) + g) / period
+        avg_loss = (avg_loss * (period - 1) + l) / period
+    if avg_loss == 0:
+        return 100.0
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+REFS = {"sma": ref_sma, "ema": ref_ema, "rsi": ref_rsi}
+
+# ===============================
+# HELPERS
+# ===============================
+@pytest.fixture(autouse=True)
+def fresh_series(monkeypatch):
+    monkeypatch.setattr(bot, "IND_SERIES", {})
+
+def random_walk(n, seed):
+    rnd = random.Random(seed)
+    x, out = 100.0, []
+    for _ in range(n):
+        x *= 1 + rnd.gauss(0, 0.004)
+        out.append(round(x, 4))
+    return out
+
+def rows(candles):
+    # bybit order: newest first
+    return [[str(ts), "0", "0", "0", str(c), "0", "0"] for ts, c in reversed(candles)]
+
+def assert_parity(symbol, closes):
+    for name, period in PERIODS:
+        got = bot.indicator(symbol, "1", name, period)
+        want = REFS[name](closes, period)
+        if want is None:
+            assert got is None, (name, period, len(closes))
+        else:
+            assert got == pytest.approx(want, abs=1e-9, rel=0), (name, period, len(closes))
+
+# ===============================
+# PARITY
+# ===============================
+def test_incremental_matches_batch_from_first_bar():
+    closes = random_walk(450, seed=1)
+    candles = [(T0 + i * STEP, c) for i, c in enumerate(closes)]
+
+    # the bot refetches an overlapping window of the newest candles
+    for i in range(1, len(candles) + 1):
+        bot.update_series("SYM", "1", rows(candles[max(0, i - 3):i]))
+        assert_parity("SYM", closes[:i])
+
+def test_late_indicator_replays_history():
+    closes = random_walk(300, seed=2)
+    candles = [(T0 + i * STEP, c) for i, c in enumerate(closes)]
+    bot.update_series("SYM", "1", rows(candles))
+
+    assert_parity("SYM", closes)
+
+def test_gap_rebuilds_from_the_fetched_window():
+    closes = random_walk(400, seed=3)
+    candles = [(T0 + i * STEP, c) for i, c in enumerate(closes)]
+    for i in range(1, 151):
+        bot.update_series("SYM", "1", rows(candles[max(0, i - 2):i]))
+    assert_parity("SYM", closes[:150])
+
+    # 20 candles never arrive; the next fetch carries a 60-bar window
+    window = candles[170:230]
+    bot.update_series("SYM", "1", rows(window))
+    seen = [c for _, c in window]
+    assert_parity("SYM", seen)
+
+    for i in range(231, len(candles) + 1):
+        bot.update_series("SYM", "1", rows(candles[i - 2:i]))
+        seen.append(candles[i - 1][1])
+        assert_parity("SYM", seen)
+
+def test_flat_series_rsi_is_100():
+    closes = [100.0] * 40
+    bot.update_series("SYM", "1", rows([(T0 + i * STEP, c) for i, c in enumerate(closes)]))
+
+    assert bot.indicator("SYM", "1", "rsi", 14) == 100.0
+    assert ref_rsi(closes, 14) == 100.0
+
+def test_batch_matrix_follows_new_and_missing_candles(monkeypatch):
+    if bot.np is None:
+        pytest.skip("numpy not installed")
+    monkeypatch.setattr(bot, "BATCH_MATRIX", {"index": {}, "x": None, "ts": []})
+    closes = random_walk(80, seed=4)
+    candles = [(T0 + i * STEP, c) for i, c in enumerate(closes)]
+    window = {}
+    monkeypatch.setattr(bot, "fetch_klines", lambda sym, tf, limit: rows(window[sym])[:limit])
+
+    # one candle at a time shifts the row, a skipped stretch re-parses it
+    for i in list(range(21, 40)) + list(range(55, 81)):
+        window["SYM"] = candles[:i]
+        kept, x = bot.stack_closes(["SYM"])
+        assert kept == ["SYM"]
+        assert x[0].tolist() == closes[i - bot.BATCH_BARS:i]
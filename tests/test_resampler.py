@@ -0,0 +1,127 @@
+import random
+
+import pytest
+
+import smart_bot as bot
+
+MIN = 60_000
+A = 1_700_006_400_000  # 4h-aligned, UTC
+TFS = {"5": 5, "15": 15, "60": 60, "240": 240}
+
+# ===============================
+# FIXTURES
+# ===============================
+def minute_series(n, seed=7):
+    rnd = random.Random(seed)
+    out, price = [], 100.0
+    for i in range(n):
+        o = price
+        c = round(o * (1 + rnd.gauss(0, 0.002)), 4)
+        h = round(max(o, c) * (1 + rnd.random() * 0.001), 4)
+        l = round(min(o, c) * (1 - rnd.random() * 0.001), 4)
+        v = round(rnd.random() * 10, 3)
+        out.append([A + i * MIN, o, h, l, c, v, round(v * c, 4)])
+        price = c
+    return out
+
+def aggregate(minutes, tf_min):
+    """
+    Bybit's rule: bucket = ts - ts % interval; open of the first minute,
+    close of the last, extremes and sums over the minutes present
+    """
+    step = tf_min * MIN
+    out = {}
+    for m in minutes:
+        start = m[0] - m[0] % step
+        b = out.get(start)
+        if b is None:
+            out[start] = [start] + m[1:]
+        else:
+            b[2] = max(b[2], m[2])
+            b[3] = min(b[3], m[3])
+            b[4] = m[4]
+            b[5] += m[5]
+            b[6] += m[6]
+    return [out[k] for k in sorted(out)]
+
+def as_rows(bars):
+    # bybit layout, newest first
+    return [[str(b[0])] + [repr(x) for x in b[1:]] for b in reversed(bars)]
+
+class Exchange:
+    """
+    Fixture kline endpoint: everything up to `now`, the forming bar included
+    """
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.now = A
+
+    def upto(self):
+        return [m for m in self.minutes if m[0] <= self.now]
+
+    def klines(self, symbol, interval, limit):
+        bars = self.upto() if interval == "1" else aggregate(self.upto(), TFS[interval])
+        return as_rows(bars[-limit:])
+
+@pytest.fixture
+def ex(monkeypatch):
+    e = Exchange(minute_series(6 * 60))
+    monkeypatch.setattr(bot, "RESAMPLE", True)
+    monkeypatch.setattr(bot, "RESAMPLE_STATE", {})
+    monkeypatch.setattr(bot, "KLINE_CACHE", {})
+    monkeypatch.setattr(bot, "exchange_klines", e.klines)
+    monkeypatch.setattr(bot.time, "time", lambda: e.now / 1000 + 1)
+    return e
+
+def assert_parity(ex, tf):
+    want = aggregate(ex.upto(), TFS[tf])[-20:]
+    got = bot.resampled("SYM", tf, 20)[::-1]
+    assert [g[0] for g in got] == [w[0] for w in want], tf
+    for g, w in zip(got, want):
+        assert g[1:] == pytest.approx(w[1:], rel=1e-12, abs=1e-9), (tf, g[0])
+
+def stream_to(ex, until, skip=()):
+    while ex.now < until:
+        ex.now += MIN
+        if ex.now not in skip:
+            bot.resample_feed("SYM", ex.klines("SYM", "1", 1))
+
+# ===============================
+# PARITY
+# ===============================
+def test_seeded_then_streamed_minutes_match_exchange_bars(ex):
+    ex.now = A + 37 * MIN  # every timeframe has an open, partial bucket
+    for tf in TFS:
+        assert_parity(ex, tf)
+
+    # fold minute by minute across 5m/15m/1h/4h boundaries
+    seeds = bot.RESAMPLE_STATS["seeds"]
+    stream_to(ex, A + 4 * 60 * MIN + 12 * MIN)
+    for tf in TFS:
+        assert_parity(ex, tf)
+    assert bot.RESAMPLE_STATS["seeds"] == seeds  # all local, no reseed
+
+def test_partial_bucket_includes_the_forming_minute(ex):
+    ex.now = A + 61 * MIN
+    bot.resampled("SYM", "60", 5)
+    stream_to(ex, A + 83 * MIN)
+
+    top = bot.resampled("SYM", "60", 1)[0]
+    minutes = [m for m in ex.minutes if A + 60 * MIN <= m[0] <= ex.now]
+    assert top[0] == A + 60 * MIN
+    assert top[1] == minutes[0][1] and top[4] == minutes[-1][4]
+    assert top[5] == pytest.approx(sum(m[5] for m in minutes))
+
+def test_missing_minute_reseeds_and_stays_exact(ex):
+    ex.now = A + 10 * MIN
+    for tf in TFS:
+        bot.resampled("SYM", tf, 5)
+    gaps = bot.RESAMPLE_STATS["gaps"]
+
+    # the stream drops one minute in the middle of a 5m/15m/1h bucket
+    stream_to(ex, A + 100 * MIN, skip={A + 47 * MIN})
+    assert bot.RESAMPLE_STATS["gaps"] == gaps + 1
+    assert "SYM" not in bot.RESAMPLE_STATE
+
+    for tf in TFS:
+        assert_parity(ex, tf)
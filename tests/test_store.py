@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+import smart_bot as bot
+
+STEP = 60_000
+T0 = 1_600_000_000_000  # long closed
+
+# ===============================
+# FIXTURES
+# ===============================
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "KLINE_STORE", True)
+    monkeypatch.setattr(bot, "KLINE_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(bot, "STORE_MAPS", {})
+    monkeypatch.setattr(bot, "IND_SERIES", {})
+
+def candles(n, seed=5):
+    rnd = random.Random(seed)
+    return [[T0 + i * STEP, 1, 1, 1, round(100 + rnd.random(), 4), 1] for i in range(n)]
+
+def closes(rows):
+    return [r[4] for r in rows]
+
+# ===============================
+# RANGE READS
+# ===============================
+def test_range_is_half_open_and_zero_copy():
+    rows = candles(50)
+    bot.store_append("SYM", "1", rows)
+
+    view = bot.store_closes("SYM", "1", T0 + 10 * STEP, T0 + 20 * STEP)
+    assert isinstance(view, memoryview)
+    assert list(view) == closes(rows[10:20])
+    assert len(bot.store_closes("SYM", "1", T0 + 60 * STEP)) == 0
+
+def test_engine_reads_the_close_column():
+    rows = candles(120)
+    bot.store_append("SYM", "1", rows[:80])
+    assert bot.indicator("SYM", "1", "sma", 20, [[str(rows[79][0])]]) == pytest.approx(
+        sum(closes(rows[60:80])) / 20)
+
+    # new candles and a hole in the store
+    bot.store_append("SYM", "1", rows[80:90])
+    bot.store_append("SYM", "1", rows[100:])
+    assert bot.indicator("SYM", "1", "sma", 5, [[str(rows[-1][0])]]) == pytest.approx(
+        sum(closes(rows[-5:])) / 5)
+
+def test_store_behind_rest_feeds_the_rows():
+    rows = candles(30)
+    bot.store_append("SYM", "1", rows[:10])
+
+    assert not bot.store_series("SYM", "1", newest=rows[-1][0])
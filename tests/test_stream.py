@@ -0,0 +1,203 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import smart_bot as bot
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# ===============================
+# STAND-IN SERVER
+# (just enough RFC 6455 for bybit's public topics: text frames, close)
+# ===============================
+class StandIn:
+    """
+    Local stand-in for the public linear stream. Answers every subscribe
+    with a ticker snapshot and a kline; drops the first connection once
+    so the client has to reconnect and resubscribe.
+    """
+    def __init__(self, price="123.5"):
+        self.price = price
+        self.subscribes = []  # (connection number, topics)
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.url = f"ws://127.0.0.1:{self.sock.getsockname()[1]}"
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        n = 0
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            n += 1
+            threading.Thread(target=self.handle, args=(conn, n), daemon=True).start()
+
+    def handle(self, conn, n):
+        with conn:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                request += conn.recv(1024)
+            key = [l.split(b":", 1)[1].strip() for l in request.split(b"\r\n")
+                   if l.lower().startswith(b"sec-websocket-key")][0]
+            accept = base64.b64encode(hashlib.sha1(key + WS_GUID.encode()).digest())
+            conn.sendall(
+                b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+            )
+            while True:
+                op, payload = self.recv_frame(conn)
+                if op is None or op == 8:
+                    return
+                msg = json.loads(payload)
+                if msg.get("op") != "subscribe":
+                    continue
+                self.subscribes.append((n, msg["args"]))
+                self.push(conn, msg["args"])
+                if n == 1:
+                    conn.sendall(b"\x88\x00")  # close: force a reconnect
+                    return
+
+    def push(self, conn, topics):
+        start = int(time.time()) // 60 * 60_000
+        for topic in topics:
+            kind, _, symbol = topic.rpartition(".")
+            if kind == "tickers":
+                data = {"symbol": symbol, "lastPrice": self.price,
+                        "bid1Price": "123.4", "ask1Price": "123.6"}
+            elif kind.startswith("kline."):
+                data = [{"start": start, "open": "1", "high": "2", "low": "0.5",
+                         "close": self.price, "volume": "3", "turnover": "4", "confirm": False}]
+            else:
+                continue
+            self.send_text(conn, json.dumps({"topic": topic, "type": "snapshot", "data": data}))
+
+    @staticmethod
+    def send_text(conn, text):
+        body = text.encode()
+        if len(body) < 126:
+            head = struct.pack("!BB", 0x81, len(body))
+        else:
+            head = struct.pack("!BBH", 0x81, 126, len(body))
+        conn.sendall(head + body)
+
+    @staticmethod
+    def recv_exact(conn, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = conn.recv(n - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    def recv_frame(self, conn):
+        head = self.recv_exact(conn, 2)
+        if head is None:
+            return None, None
+        op, size = head[0] & 0x0F, head[1] & 0x7F
+        if size == 126:
+            size = struct.unpack("!H", self.recv_exact(conn, 2))[0]
+        elif size == 127:
+            size = struct.unpack("!Q", self.recv_exact(conn, 8))[0]
+        mask = self.recv_exact(conn, 4)  # client frames are always masked
+        data = self.recv_exact(conn, size) or b""
+        return op, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+    def close(self):
+        self.sock.close()
+
+# ===============================
+# STREAM CLIENT AGAINST THE STAND-IN
+# ===============================
+class NoRest:
+    def __getattr__(self, name):
+        raise AssertionError(f"REST call {name} while the stream had the data")
+
+def wait_for(cond, timeout=10.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+@pytest.fixture
+def standin(monkeypatch):
+    server = StandIn()
+    monkeypatch.setattr(bot, "STREAM_URL", server.url)
+    monkeypatch.setattr(bot, "STREAM_TOPICS", set())
+    monkeypatch.setattr(bot, "LAST_PRICE", {})
+    monkeypatch.setattr(bot, "LAST_TICKER", {})
+    monkeypatch.setattr(bot, "LAST_CANDLE", {})
+    monkeypatch.setattr(bot, "ACTIVE_TIMEFRAME", "1m")
+    yield server
+    bot.STREAM_STOP.set()
+    ws = bot.STREAM_WS
+    if ws is not None:
+        ws.close()
+    server.close()
+    for t in threading.enumerate():
+        if t.name == "stream-test":
+            t.join(5)
+    bot.STREAM_STOP.clear()
+
+def test_prices_and_quotes_come_from_the_stream_table(standin, monkeypatch):
+    threading.Thread(target=bot.market_stream, args=(["BTCUSDT"],), name="stream-test", daemon=True).start()
+
+    # first connection is dropped after one subscribe; the client must come back
+    assert wait_for(lambda: len({n for n, _ in standin.subscribes}) >= 2)
+    assert wait_for(lambda: bot.live_price("BTCUSDT") is not None)
+
+    topics = [sorted(args) for _, args in standin.subscribes[:2]]
+    assert topics[0] == topics[1] == ["kline.1.BTCUSDT", "tickers.BTCUSDT"]
+    assert bot.STREAM_STATS["reconnects"] >= 1
+
+    monkeypatch.setattr(bot, "session", NoRest())
+    assert bot.get_price("BTCUSDT") == 123.5
+    assert bot.get_quote("BTCUSDT") == (123.4, 123.6)
+    assert bot.LAST_CANDLE[("BTCUSDT", "1")][4] == "123.5"
+
+def test_stale_table_falls_back_to_rest(monkeypatch):
+    monkeypatch.setattr(bot, "LAST_PRICE", {"ETHUSDT": (10.0, time.time() - 60)})
+    monkeypatch.setattr(bot, "LAST_TICKER", {"ETHUSDT": {"bid1Price": "9", "ask1Price": "11",
+                                                           "_received": time.time() - 60}})
+    monkeypatch.setattr(bot, "TICKER_SNAPSHOT", {"ts": 0, "data": {}})
+
+    class Rest:
+        def get_tickers(self, **kw):
+            return {"result": {"list": [{"lastPrice": "12", "bid1Price": "11.9", "ask1Price": "12.1"}]}}
+
+    monkeypatch.setattr(bot, "session", Rest())
+    assert bot.get_price("ETHUSDT") == 12.0
+    assert bot.get_quote("ETHUSDT") == (11.9, 12.1)
+
+def test_leaving_tick_mode_unsubscribes_trades(monkeypatch):
+    class Socket:
+        sent = []
+
+        def send(self, text):
+            self.sent.append(json.loads(text))
+
+    monkeypatch.setattr(bot, "STREAM_TOPICS", set())
+    monkeypatch.setattr(bot, "STREAM_WS", Socket())
+    monkeypatch.setattr(bot, "STREAM_STATS", dict(bot.STREAM_STATS, connected=True))
+    monkeypatch.setattr(bot, "SYMBOLS", ["BTCUSDT"])
+    monkeypatch.setattr(bot, "ACTIVE_TIMEFRAME", "1m")
+    monkeypatch.setattr(bot, "wake_trader", lambda: None)
+    monkeypatch.setattr(bot, "tg", lambda *a, **kw: None)
+
+    bot.cmd_tf("1s")
+    assert "publicTrade.BTCUSDT" in bot.STREAM_TOPICS
+
+    bot.cmd_tf("1m")
+    assert not any(t.startswith("publicTrade.") for t in bot.STREAM_TOPICS)
+    assert Socket.sent[-1] == {"op": "unsubscribe", "args": ["publicTrade.BTCUSDT"]}
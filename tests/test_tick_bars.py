@@ -0,0 +1,50 @@
+import pytest
+
+import smart_bot as bot
+
+S = 1_700_000_010_000  # a 15s-aligned second, ms
+
+@pytest.fixture(autouse=True)
+def fresh_ticks(monkeypatch):
+    monkeypatch.setattr(bot, "TICK_STATE", {})
+    monkeypatch.setattr(bot, "TICK_STATS", dict.fromkeys(bot.TICK_STATS, 0))
+    monkeypatch.setattr(bot, "ACTIVE_TIMEFRAME", "1m")  # no signal queueing
+
+def trade(ts, p=100.0, v=1.0):
+    return {"T": str(ts), "p": str(p), "v": str(v)}
+
+def ring_ts(tf):
+    ring = bot.TICK_STATE["SYM"]["rings"][tf]
+    return [int(r[0]) for r in ring.rows(ring.n)][::-1]
+
+def test_trade_after_sweep_is_late_not_a_second_bar():
+    bot.on_trades("SYM", [trade(S + 100), trade(S + 900)])
+    bot.tick_sweep(S + 1000 + bot.TICK_GRACE)
+    bot.on_trades("SYM", [trade(S + 950)])  # its second was just swept
+    bot.on_trades("SYM", [trade(S + 2100), trade(S + 5100)])
+
+    assert ring_ts(1) == [S, S + 2000]
+    assert bot.TICK_STATS["late"] == 1
+
+def test_swept_empty_second_stays_closed_for_higher_tfs():
+    bot.on_trades("SYM", [trade(S + 1000, v=2.0)])
+    # nothing traded in S+4000, but the sweep seals it and the 5s bucket
+    bot.tick_sweep(S + 5000 + bot.TICK_GRACE)
+    bot.on_trades("SYM", [trade(S + 4500, v=7.0)])  # late for both
+    bot.on_trades("SYM", [trade(S + 6000, v=3.0)])
+    bot.tick_sweep(S + 15000 + bot.TICK_GRACE)
+
+    assert ring_ts(5) == [S, S + 5000]
+    assert ring_ts(15) == [S]
+    ring = bot.TICK_STATE["SYM"]["rings"][15]
+    assert ring.v[0] == 5.0  # the late trade is not folded in
+    assert bot.TICK_STATS["late"] == 1
+
+def test_out_of_order_inside_open_second_still_counts():
+    bot.on_trades("SYM", [trade(S + 500, 100.0), trade(S + 200, 99.0), trade(S + 800, 101.0)])
+    bot.tick_sweep(S + 1000 + bot.TICK_GRACE)
+
+    ring = bot.TICK_STATE["SYM"]["rings"][1]
+    assert ring_ts(1) == [S]
+    assert (ring.h[0], ring.l[0], ring.c[0], ring.v[0]) == (101.0, 99.0, 101.0, 3.0)
+    assert bot.TICK_STATS["late"] == 0